@@ -0,0 +1,37 @@
+"""Alembic environment, runs revisions against app.database.SYNC_DATABASE_URL"""
+from logging.config import fileConfig
+
+from alembic import context
+
+from app import models
+from app.database import engine
+
+config = context.config
+target_metadata = models.Base.metadata
+
+def run_migrations(connection) -> None:
+    # SQLite cannot alter most things in place, batch operations copy the table
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        render_as_batch=connection.dialect.name == "sqlite",
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online() -> None:
+    # app.migrations.upgrade_database passes the connection of its transaction
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        run_migrations(connection)
+        return
+
+    with engine.connect() as connection:
+        run_migrations(connection)
+
+if context.is_offline_mode():
+    raise RuntimeError("Revisions inspect the database to skip what exists, offline (--sql) mode is not supported")
+# Logging is only set up from the ini file when run as the alembic CLI
+if config.config_file_name is not None and "connection" not in config.attributes:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+run_migrations_online()
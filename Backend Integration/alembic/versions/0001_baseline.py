@@ -0,0 +1,64 @@
+"""Users and invoices as created before migrations
+
+Revision ID: 0001
+Revises: None
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app import migrations
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    tables = migrations.table_names()
+    if "users" not in tables:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("email", sa.String()),
+            sa.Column("hashed_password", sa.String()),
+            sa.Column("full_name", sa.String()),
+            sa.Column("created_at", sa.DateTime()),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+    if "invoices" not in tables:
+        op.create_table(
+            "invoices",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("filename", sa.String()),
+            sa.Column("status", sa.Enum("PENDING", "PROCESSING", "COMPLETED", "ERROR", name="invoicestatus")),
+            sa.Column("invoice_number", sa.String()),
+            sa.Column("date", sa.DateTime()),
+            sa.Column("due_date", sa.DateTime()),
+            sa.Column("amount", sa.Float()),
+            sa.Column("tax", sa.Float()),
+            sa.Column("total", sa.Float()),
+            sa.Column("vendor_name", sa.String()),
+            sa.Column("vendor_address", sa.String()),
+            sa.Column("vendor_email", sa.String()),
+            sa.Column("client_name", sa.String()),
+            sa.Column("client_address", sa.String()),
+            sa.Column("client_email", sa.String()),
+            sa.Column("created_at", sa.DateTime()),
+            sa.Column("processed_at", sa.DateTime()),
+            sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id")),
+        )
+        op.create_index("ix_invoices_id", "invoices", ["id"])
+        op.create_index("ix_invoices_invoice_number", "invoices", ["invoice_number"])
+
+
+def downgrade() -> None:
+    op.drop_table("invoices")
+    op.drop_table("users")
+    sa.Enum(name="invoicestatus").drop(op.get_bind(), checkfirst=True)
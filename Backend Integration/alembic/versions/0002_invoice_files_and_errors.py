@@ -0,0 +1,33 @@
+"""Uploaded file path, error message and status index
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:01:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app import migrations
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    migrations.add_columns(
+        "invoices",
+        sa.Column("file_path", sa.String()),
+        sa.Column("error_message", sa.String()),
+    )
+    migrations.create_index("ix_invoices_status", "invoices", ["status"])
+
+
+def downgrade() -> None:
+    migrations.drop_index("ix_invoices_status", "invoices")
+    migrations.drop_columns("invoices", "file_path", "error_message")
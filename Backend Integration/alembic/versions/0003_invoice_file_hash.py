@@ -0,0 +1,27 @@
+"""Content hash of uploaded files
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 09:02:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app import migrations
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    migrations.add_columns("invoices", sa.Column("file_hash", sa.String()))
+
+
+def downgrade() -> None:
+    migrations.drop_columns("invoices", "file_hash")
@@ -0,0 +1,27 @@
+"""Per-user date index for analytics
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 09:03:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app import migrations
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    migrations.create_index("ix_invoices_owner_date", "invoices", ["owner_id", "date"])
+
+
+def downgrade() -> None:
+    migrations.drop_index("ix_invoices_owner_date", "invoices")
@@ -0,0 +1,47 @@
+"""Per-user, per-month invoice rollups
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 09:04:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from app import migrations
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if "invoice_rollups" in migrations.table_names():
+        return
+    op.create_table(
+        "invoice_rollups",
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("month", sa.String(), primary_key=True),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("amount_sum", sa.Float(), nullable=False),
+        sa.Column("pending_count", sa.Integer(), nullable=False),
+        sa.Column("processing_count", sa.Integer(), nullable=False),
+        sa.Column("completed_count", sa.Integer(), nullable=False),
+        sa.Column("error_count", sa.Integer(), nullable=False),
+        sa.Column("processing_time_sum", sa.Float(), nullable=False),
+        sa.Column("processing_time_count", sa.Integer(), nullable=False),
+    )
+    # Backfill from the invoices received so far, only the columns of this
+    # revision are read
+    from app import rollups
+    with Session(bind=op.get_bind()) as db:
+        rollups.rebuild(db)
+
+
+def downgrade() -> None:
+    op.drop_table("invoice_rollups")
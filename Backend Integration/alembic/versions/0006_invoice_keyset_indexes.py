@@ -0,0 +1,39 @@
+"""Indexes for keyset pagination and the worker queue
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 09:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app import migrations
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = {
+    "ix_invoices_owner_created_id": ["owner_id", "created_at", "id"],
+    "ix_invoices_owner_status_created_id": ["owner_id", "status", "created_at", "id"],
+    "ix_invoices_owner_vendor_created_id": ["owner_id", "vendor_name", "created_at", "id"],
+    "ix_invoices_status_created_id": ["status", "created_at", "id"],
+}
+
+
+def upgrade() -> None:
+    for name, columns in INDEXES.items():
+        migrations.create_index(name, "invoices", columns)
+    # Superseded by ix_invoices_status_created_id
+    migrations.drop_index("ix_invoices_status", "invoices")
+
+
+def downgrade() -> None:
+    migrations.create_index("ix_invoices_status", "invoices", ["status"])
+    for name in INDEXES:
+        migrations.drop_index(name, "invoices")
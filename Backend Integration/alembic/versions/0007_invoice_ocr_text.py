@@ -0,0 +1,34 @@
+"""OCR text for full-text search
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 09:06:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app import migrations
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The search index over it is created by app.search.create_search_index
+    migrations.add_columns("invoices", sa.Column("ocr_text", sa.Text()))
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        for trigger in ("invoices_fts_insert", "invoices_fts_delete", "invoices_fts_update"):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS invoices_fts")
+    else:
+        op.execute("ALTER TABLE invoices DROP COLUMN IF EXISTS search_vector")
+    migrations.drop_columns("invoices", "ocr_text")
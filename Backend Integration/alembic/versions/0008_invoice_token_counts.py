@@ -0,0 +1,31 @@
+"""Token counts of the OCR text and the LLM prompt
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 09:07:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app import migrations
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    migrations.add_columns(
+        "invoices",
+        sa.Column("ocr_tokens", sa.Integer()),
+        sa.Column("prompt_tokens", sa.Integer()),
+    )
+
+
+def downgrade() -> None:
+    migrations.drop_columns("invoices", "ocr_tokens", "prompt_tokens")
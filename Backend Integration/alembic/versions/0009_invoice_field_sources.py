@@ -0,0 +1,27 @@
+"""Extraction tier and confidence per field
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 09:08:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app import migrations
+
+# revision identifiers, used by Alembic.
+revision: str = '0009'
+down_revision: Union[str, None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    migrations.add_columns("invoices", sa.Column("field_sources", sa.JSON()))
+
+
+def downgrade() -> None:
+    migrations.drop_columns("invoices", "field_sources")
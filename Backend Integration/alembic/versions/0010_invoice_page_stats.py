@@ -0,0 +1,27 @@
+"""How each page's text was read
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 09:09:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app import migrations
+
+# revision identifiers, used by Alembic.
+revision: str = '0010'
+down_revision: Union[str, None] = '0009'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    migrations.add_columns("invoices", sa.Column("page_stats", sa.JSON()))
+
+
+def downgrade() -> None:
+    migrations.drop_columns("invoices", "page_stats")
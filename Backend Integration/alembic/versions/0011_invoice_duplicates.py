@@ -0,0 +1,46 @@
+"""Duplicate detection at ingest
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18 09:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app import migrations
+
+# revision identifiers, used by Alembic.
+revision: str = '0011'
+down_revision: Union[str, None] = '0010'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BANDS = ["image_hash_band0", "image_hash_band1", "image_hash_band2", "image_hash_band3"]
+
+
+def upgrade() -> None:
+    migrations.add_columns(
+        "invoices",
+        sa.Column("fingerprint", sa.String()),
+        sa.Column("image_hash", sa.String()),
+        *(sa.Column(band, sa.Integer()) for band in BANDS),
+        sa.Column("duplicate_of_id", sa.Integer(), sa.ForeignKey("invoices.id", name="fk_invoices_duplicate_of_id")),
+        sa.Column("duplicate_reason", sa.String()),
+    )
+    migrations.create_index("ix_invoices_owner_file_hash_id", "invoices", ["owner_id", "file_hash", "id"])
+    migrations.create_index("ix_invoices_owner_fingerprint_id", "invoices", ["owner_id", "fingerprint", "id"])
+    for band in BANDS:
+        migrations.create_index(f"ix_invoices_owner_{band}", "invoices", ["owner_id", band])
+
+
+def downgrade() -> None:
+    for band in BANDS:
+        migrations.drop_index(f"ix_invoices_owner_{band}", "invoices")
+    migrations.drop_index("ix_invoices_owner_fingerprint_id", "invoices")
+    migrations.drop_index("ix_invoices_owner_file_hash_id", "invoices")
+    migrations.drop_columns(
+        "invoices", "fingerprint", "image_hash", *BANDS, "duplicate_of_id", "duplicate_reason"
+    )
@@ -0,0 +1,43 @@
+"""Owner column in the SQLite full-text index
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from app import search
+
+# revision identifiers, used by Alembic.
+revision: str = '0012'
+down_revision: Union[str, None] = '0011'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TRIGGERS = ["invoices_fts_insert", "invoices_fts_delete", "invoices_fts_update"]
+
+
+def drop_search_index() -> None:
+    for trigger in TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    op.execute("DROP TABLE IF EXISTS invoices_fts")
+
+
+def upgrade() -> None:
+    # PostgreSQL filters the tsvector matches on owner_id already
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    # FTS5 tables cannot gain a column, the index is built again from invoices
+    drop_search_index()
+    for statement in search.SQLITE_SEARCH_DDL:
+        op.execute(statement)
+    search.rebuild_search_index(op.get_bind())
+
+
+def downgrade() -> None:
+    # Recreated without the owner by app.search of the earlier release
+    if op.get_bind().dialect.name == "sqlite":
+        drop_search_index()
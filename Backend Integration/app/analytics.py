@@ -0,0 +1,94 @@
+"""Invoice analytics.
+
+Dashboard analytics are read from the ``invoice_rollups`` table, which
+``app.rollups`` keeps up to date as invoices change, so a request costs
+O(months) regardless of how many invoices a user has. ``aggregate_invoices``
+computes the same figures from the invoices table with SQL aggregates and is
+used to backfill and verify the rollups. Date arithmetic differs between
+SQLite and PostgreSQL; the helpers below pick the right expression for the
+session's dialect.
+"""
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+from . import models
+
+def month_key(dialect: str, column):
+    """SQL expression formatting a datetime column as YYYY-MM"""
+    if dialect == "postgresql":
+        return func.to_char(column, "YYYY-MM")
+    return func.strftime("%Y-%m", column)
+
+def seconds_between(dialect: str, end, start):
+    """SQL expression for the number of seconds from start to end"""
+    if dialect == "postgresql":
+        return func.extract("epoch", end - start)
+    return (func.julianday(end) - func.julianday(start)) * 86400.0
+
+def _status_count(status: models.InvoiceStatus):
+    return func.sum(case((models.Invoice.status == status, 1), else_=0))
+
+def aggregate_invoices(db: Session, owner_id: Optional[int] = None) -> Dict[Tuple[int, str], Dict[str, float]]:
+    """Per-user, per-month rollup values computed from the invoices table"""
+    dialect = db.get_bind().dialect.name
+    Invoice = models.Invoice
+    month = func.coalesce(month_key(dialect, Invoice.date), "")
+    seconds = seconds_between(dialect, Invoice.processed_at, Invoice.created_at)
+
+    query = db.query(
+        Invoice.owner_id,
+        month,
+        func.count(Invoice.id),
+        func.coalesce(func.sum(Invoice.total), 0.0),
+        _status_count(models.InvoiceStatus.PENDING),
+        _status_count(models.InvoiceStatus.PROCESSING),
+        _status_count(models.InvoiceStatus.COMPLETED),
+        _status_count(models.InvoiceStatus.ERROR),
+        func.coalesce(func.sum(seconds), 0.0),
+        # COUNT skips rows where either timestamp is NULL
+        func.count(seconds),
+    ).filter(Invoice.owner_id.isnot(None))
+    if owner_id is not None:
+        query = query.filter(Invoice.owner_id == owner_id)
+
+    return {
+        (row[0], row[1]): {
+            "count": row[2],
+            "amount_sum": float(row[3]),
+            "pending_count": row[4],
+            "processing_count": row[5],
+            "completed_count": row[6],
+            "error_count": row[7],
+            "processing_time_sum": float(row[8]),
+            "processing_time_count": row[9],
+        }
+        for row in query.group_by(Invoice.owner_id, month)
+    }
+
+def compute_analytics(db: Session, owner_id: int) -> Dict[str, Any]:
+    rollups = db.query(models.InvoiceRollup)\
+        .filter(models.InvoiceRollup.owner_id == owner_id)\
+        .order_by(models.InvoiceRollup.month)\
+        .all()
+
+    total_count = sum(rollup.count for rollup in rollups)
+    total_amount = sum(rollup.amount_sum for rollup in rollups)
+    completed_count = sum(rollup.completed_count for rollup in rollups)
+    processing_time_sum = sum(rollup.processing_time_sum for rollup in rollups)
+    processing_time_count = sum(rollup.processing_time_count for rollup in rollups)
+
+    return {
+        "total_count": total_count,
+        "total_amount": total_amount,
+        "average_amount": total_amount / total_count if total_count else 0.0,
+        "processing_time": processing_time_sum / processing_time_count if processing_time_count else 0.0,
+        "success_rate": completed_count / total_count * 100 if total_count else 0.0,
+        # Invoices without a date only count towards the totals
+        "monthly_trends": {
+            rollup.month: {"count": rollup.count, "amount": rollup.amount_sum}
+            for rollup in rollups
+            if rollup.month and rollup.count
+        },
+    }
@@ -1,13 +1,19 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Dict, Optional, Set, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from . import models, schemas
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, schemas, metrics
 from .database import get_db
+import asyncio
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,14 +23,85 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Verified tokens are cached for at most TOKEN_CACHE_TTL seconds and never
+# beyond their exp claim; 0 disables the cache
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+
+# Comma-separated emails of the users allowed to see server-wide statistics
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+# The password hash is left out, it is only loaded to log in
+USER_CACHE_COLUMNS = ["id", "email", "full_name", "created_at"]
+
+# bcrypt runs in PASSWORD_HASH_WORKERS threads; at most PASSWORD_HASH_QUEUE
+# more requests may wait for one before new ones are turned away with 429.
+# The queue scales with the workers so the worst-case wait stays bounded.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", str(4 * PASSWORD_HASH_WORKERS)))
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    with metrics.STAGE_SECONDS.time(stage="password_verify"):
+        return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    with metrics.STAGE_SECONDS.time(stage="password_hash"):
+        return pwd_context.hash(password)
+
+class PasswordPoolSaturated(Exception):
+    pass
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop in a bounded thread pool.
+
+    bcrypt releases the GIL while hashing, so the threads use separate cores.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_size: int = PASSWORD_HASH_QUEUE):
+        self.capacity = max(1, workers) + max(0, queue_size)
+        self.in_flight = 0
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="bcrypt")
+
+    async def _run(self, func, *args):
+        # Only touched from the event loop thread, so no lock is needed
+        if self.in_flight >= self.capacity:
+            metrics.ERRORS.inc(source="password_pool")
+            raise PasswordPoolSaturated()
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.in_flight -= 1
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+password_hasher = PasswordHasher()
+
+def _too_many_requests() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many password checks in progress, please retry",
+        headers={"Retry-After": "1"},
+    )
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordPoolSaturated:
+        raise _too_many_requests()
+
+async def get_password_hash_async(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordPoolSaturated:
+        raise _too_many_requests()
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
@@ -36,14 +113,83 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+class TokenCache:
+    """Bounded LRU cache mapping verified tokens to a snapshot of their user"""
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires_at, user_data = entry
+            if expires_at <= time.time():
+                self._remove(token)
+                return None
+            self._entries.move_to_end(token)
+            return user_data
+
+    def set(self, token: str, user_data: Dict[str, Any], token_exp: float) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[token] = (min(token_exp, time.time() + self.ttl), user_data)
+            self._entries.move_to_end(token)
+            self._tokens_by_user.setdefault(user_data["id"], set()).add(token)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def _remove(self, token: str) -> None:
+        _, user_data = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(user_data["id"])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user_data["id"]]
+
+token_cache = TokenCache()
+
+# Only changes made through this process are seen here; other processes
+# serve a changed user for at most TOKEN_CACHE_TTL seconds
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target: models.User) -> None:
+    token_cache.invalidate_user(target.id)
+
+def _user_from_cache(user_data: Dict[str, Any]) -> models.User:
+    # A transient instance, it is not attached to the request's session
+    return models.User(**user_data)
+
 async def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
 ) -> models.User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    user_data = token_cache.get(token)
+    if token_cache.maxsize > 0:
+        metrics.record_cache("token", user_data is not None)
+    if user_data is not None:
+        return _user_from_cache(user_data)
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -53,9 +199,23 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    user = db.query(models.User).filter(models.User.email == token_data.email).first()
+    # Tokens issued with a uid claim are resolved by primary key
+    user_id = payload.get("uid")
+    if user_id is not None:
+        user = await db.get(models.User, user_id)
+        if user is not None and user.email != token_data.email:
+            user = None
+    else:
+        result = await db.execute(select(models.User).where(models.User.email == token_data.email))
+        user = result.scalars().first()
     if user is None:
         raise credentials_exception
+
+    token_cache.set(
+        token,
+        {column: getattr(user, column) for column in USER_CACHE_COLUMNS},
+        payload.get("exp", float("inf")),
+    )
     return user
 
 async def get_current_active_user(
@@ -64,3 +224,10 @@ async def get_current_active_user(
     if not current_user:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
+
+async def get_current_admin_user(
+    current_user: models.User = Depends(get_current_active_user),
+) -> models.User:
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
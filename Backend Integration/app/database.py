@@ -1,6 +1,23 @@
-from sqlalchemy import create_engine
+"""Database engines and sessions.
+
+The API serves requests through an asyncio engine (``AsyncSessionLocal`` and
+the ``get_db`` dependency), so queries never block the event loop. Its
+driver is derived from ``DATABASE_URL``: ``sqlite://`` runs on aiosqlite and
+``postgresql://`` on asyncpg, while a URL that already names an async driver
+is used as is. The background worker and the maintenance CLIs keep using the
+synchronous ``engine`` and ``SessionLocal`` on the same database.
+
+Both engines share the pool settings below, except on aiosqlite: each of its
+connections runs in a thread that keeps the process alive until the
+connection is closed, so those are not pooled. SQLite connections are
+switched to WAL mode so readers do not block the worker's writes.
+"""
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from dotenv import load_dotenv
 import os
 
@@ -8,16 +25,76 @@ load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./invosmart.db")
 
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Seconds after which a connection is replaced, -1 keeps them forever
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+SYNC_DRIVERS = {"sqlite": "sqlite", "postgresql": "postgresql+psycopg2"}
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+def database_url(url: str, drivers) -> str:
+    """Rewrite a database URL to use the driver registered for its backend"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in drivers:
+        return url
+    return parsed.set(drivername=drivers[backend]).render_as_string(hide_password=False)
+
+def engine_options(url: str) -> dict:
+    parsed = make_url(url)
+    # In-memory SQLite lives in a single connection, pooling does not apply
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return {}
+    # A pooled aiosqlite connection holds a non-daemon thread, opening a file
+    # connection is cheap next to leaving the process hanging at exit
+    if parsed.drivername == "sqlite+aiosqlite":
+        return {"poolclass": NullPool}
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    return options
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # NORMAL is durable in WAL mode except for the last commits on power loss
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def configure_sqlite(engine) -> None:
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+
+SYNC_DATABASE_URL = database_url(SQLALCHEMY_DATABASE_URL, SYNC_DRIVERS)
+ASYNC_DATABASE_URL = database_url(SQLALCHEMY_DATABASE_URL, ASYNC_DRIVERS)
+
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SYNC_DATABASE_URL,
+    connect_args={"check_same_thread": False} if SYNC_DATABASE_URL.startswith("sqlite") else {},
+    **engine_options(SYNC_DATABASE_URL)
 )
+configure_sqlite(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+configure_sqlite(async_engine.sync_engine)
+# Objects stay usable after commit, lazy refreshes would need an await
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
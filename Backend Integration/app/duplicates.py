@@ -0,0 +1,186 @@
+"""Detection of invoices that were already received, at ingest time.
+
+Suppliers often send one invoice through several channels. Before an
+invoice is stored it is compared with the earlier completed invoices of the
+same user, in this order:
+
+- ``file``: byte-identical upload (same SHA-256), checked before OCR
+- ``fingerprint``: same vendor, invoice number, total and date once
+  normalized, hashed into ``Invoice.fingerprint``
+- ``image``: near-identical first page by perceptual hash (dHash), for scans
+  that differ slightly. Invoices printed on one template look alike too, so
+  an image match also needs the invoice number or total to agree and neither
+  to conflict.
+
+The worker checks the file before OCR and, when the cheap extraction tiers
+leave fields to the LLM, checks their result before calling it; a match
+copies the original's fields and skips the remaining stages. Everything else
+is checked on the final fields. Duplicates are stored and flagged with
+``duplicate_of_id`` (the first invoice received) and ``duplicate_reason``,
+not rejected.
+
+Every lookup is an indexed equality on ``owner_id`` plus a hash, so it stays
+O(log n) as the table grows. For the image hash, the 64 bits are split into
+``IMAGE_HASH_BANDS`` indexed columns: hashes within ``IMAGE_HASH_BANDS - 1``
+bits of each other share at least one band exactly, so near matches are found
+with band equality lookups and only those candidates are compared bit by bit.
+Bands of blank paper are all zeros and are not looked up.
+"""
+import hashlib
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+from sqlalchemy import or_, select, union
+from sqlalchemy.orm import Session
+
+from . import models
+from .services.tiered_extraction import parse_date
+
+DUPLICATE_DETECTION = os.getenv("DUPLICATE_DETECTION", "true").lower() == "true"
+# Differing bits up to which two first pages count as the same image,
+# at most IMAGE_HASH_BANDS - 1 for the band lookup to find every match
+DUPLICATE_IMAGE_DISTANCE = int(os.getenv("DUPLICATE_IMAGE_DISTANCE", "3"))
+# Image matches compared bit by bit per lookup
+DUPLICATE_IMAGE_CANDIDATES = int(os.getenv("DUPLICATE_IMAGE_CANDIDATES", "50"))
+
+FILE = "file"
+FINGERPRINT = "fingerprint"
+IMAGE = "image"
+
+# 9x8 grey levels give 8x8 = 64 bits
+IMAGE_HASH_SIZE = 8
+IMAGE_HASH_BANDS = 4
+BAND_BITS = IMAGE_HASH_SIZE * IMAGE_HASH_SIZE // IMAGE_HASH_BANDS
+# Grey level difference below which neighbouring cells count as equal. Blank
+# paper otherwise yields bits that flip with scanner noise.
+IMAGE_HASH_MIN_DIFFERENCE = 2
+
+BAND_COLUMNS = [
+    models.Invoice.image_hash_band0, models.Invoice.image_hash_band1,
+    models.Invoice.image_hash_band2, models.Invoice.image_hash_band3,
+]
+
+LEGAL_SUFFIXES = re.compile(r"\b(inc|incorporated|llc|ltd|limited|gmbh|corp|corporation|co|company|plc|sa|ag|bv)\b")
+
+class Identity(NamedTuple):
+    """What an invoice is compared on"""
+    fingerprint: Optional[str]
+    invoice_number: Optional[str]
+    total: Optional[float]
+    image_hash: Optional[str]
+
+def _alphanumeric(value: Any) -> str:
+    return re.sub(r"[^0-9a-z]", "", str(value or "").lower())
+
+def fingerprint(data: Dict[str, Any]) -> Optional[str]:
+    """Hash of the normalized vendor, invoice number, total and date, None without a number and total"""
+    number = _alphanumeric(data.get("invoice_number"))
+    total = data.get("total")
+    if not number or total is None:
+        return None
+    vendor = _alphanumeric(LEGAL_SUFFIXES.sub("", str((data.get("vendor_info") or {}).get("name") or "").lower()))
+    date = parse_date(data.get("date"))
+    key = "|".join([vendor, number, str(round(float(total) * 100)), date.strftime("%Y-%m-%d") if date else ""])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def image_hash(image: np.ndarray) -> str:
+    """64-bit difference hash of a page image, as 16 hex digits"""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    cells = cv2.resize(image, (IMAGE_HASH_SIZE + 1, IMAGE_HASH_SIZE), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = (cells[:, :-1] > cells[:, 1:] + IMAGE_HASH_MIN_DIFFERENCE).flatten()
+    return f"{int(''.join('1' if bit else '0' for bit in bits), 2):016x}"
+
+def image_hash_bands(value: str) -> List[int]:
+    number = int(value, 16)
+    mask = (1 << BAND_BITS) - 1
+    return [(number >> (band * BAND_BITS)) & mask for band in range(IMAGE_HASH_BANDS)]
+
+def hamming_distance(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+def identity(data: Dict[str, Any], page_hash: Optional[str] = None) -> Identity:
+    """Identity of extracted invoice data, in the structure apply_extraction takes"""
+    number = data.get("invoice_number")
+    total = data.get("total")
+    return Identity(fingerprint(data), _alphanumeric(number) or None,
+                    float(total) if total is not None else None, page_hash)
+
+def store_identity(invoice: models.Invoice, invoice_identity: Identity) -> None:
+    """Set the indexed columns the lookups of later invoices use"""
+    invoice.fingerprint = invoice_identity.fingerprint
+    invoice.image_hash = invoice_identity.image_hash
+    bands = image_hash_bands(invoice_identity.image_hash) if invoice_identity.image_hash else [None] * IMAGE_HASH_BANDS
+    for column, band in zip(BAND_COLUMNS, bands):
+        setattr(invoice, column.key, band)
+
+def mark_duplicate(invoice: models.Invoice, match: models.Invoice, reason: str) -> None:
+    """Flag invoice as a duplicate of match, or of the invoice match duplicates"""
+    invoice.duplicate_of_id = match.duplicate_of_id or match.id
+    invoice.duplicate_reason = reason
+
+def _earlier_invoices(db: Session, owner_id: int, invoice_id: int):
+    Invoice = models.Invoice
+    return db.query(Invoice)\
+        .filter(Invoice.owner_id == owner_id)\
+        .filter(Invoice.id < invoice_id)\
+        .filter(Invoice.status == models.InvoiceStatus.COMPLETED)
+
+def find_file_duplicate(db: Session, invoice: models.Invoice) -> Optional[models.Invoice]:
+    """The first completed invoice of the user with the same file contents"""
+    if not invoice.file_hash:
+        return None
+    return _earlier_invoices(db, invoice.owner_id, invoice.id)\
+        .filter(models.Invoice.file_hash == invoice.file_hash)\
+        .order_by(models.Invoice.id)\
+        .first()
+
+def _agrees(candidate: models.Invoice, invoice_identity: Identity) -> bool:
+    """Whether the invoice number and total agree on at least one and conflict on neither"""
+    number = _alphanumeric(candidate.invoice_number) or None
+    checks = []
+    if number is not None and invoice_identity.invoice_number is not None:
+        checks.append(number == invoice_identity.invoice_number)
+    if candidate.total is not None and invoice_identity.total is not None:
+        checks.append(abs(candidate.total - invoice_identity.total) < 0.005)
+    return bool(checks) and all(checks)
+
+def find_duplicate(db: Session, owner_id: int, invoice_id: int,
+                   invoice_identity: Identity) -> Optional[Tuple[models.Invoice, str]]:
+    """An earlier invoice this one duplicates by fingerprint or, failing that, by first page image"""
+    Invoice = models.Invoice
+    if invoice_identity.fingerprint is not None:
+        match = _earlier_invoices(db, owner_id, invoice_id)\
+            .filter(Invoice.fingerprint == invoice_identity.fingerprint)\
+            .order_by(Invoice.id)\
+            .first()
+        if match is not None:
+            return match, FINGERPRINT
+
+    if invoice_identity.image_hash is None:
+        return None
+    # Blank bands (empty paper) are shared by most pages and not looked up
+    bands = [(column, band) for column, band in zip(BAND_COLUMNS, image_hash_bands(invoice_identity.image_hash))
+             if band]
+    if not bands:
+        return None
+    # One index lookup per band, rather than an OR the planner may answer with a scan
+    matches = union(*(
+        select(Invoice.id).where(Invoice.owner_id == owner_id, column == band) for column, band in bands
+    )).subquery()
+    candidates = _earlier_invoices(db, owner_id, invoice_id).join(matches, Invoice.id == matches.c.id)
+    if invoice_identity.total is not None:
+        # Recurring invoices on one template only differ in their figures
+        candidates = candidates.filter(or_(
+            Invoice.total.is_(None),
+            Invoice.total.between(invoice_identity.total - 0.005, invoice_identity.total + 0.005)
+        ))
+    # Copies tend to arrive close together, so the newest candidates come first
+    for candidate in candidates.order_by(Invoice.id.desc()).limit(DUPLICATE_IMAGE_CANDIDATES):
+        if (hamming_distance(candidate.image_hash, invoice_identity.image_hash) <= DUPLICATE_IMAGE_DISTANCE
+                and _agrees(candidate, invoice_identity)):
+            return candidate, IMAGE
+    return None
@@ -0,0 +1,166 @@
+"""Streaming bulk export of a user's invoices as CSV, NDJSON or Parquet.
+
+Rows are read with a server-side cursor (``yield_per``) and written out one
+batch of ``EXPORT_BATCH_SIZE`` rows at a time, so memory stays constant
+whatever the number of invoices. Each batch is encoded straight from the
+result rows, without building ``schemas.Invoice`` objects, and optionally
+gzipped on the fly.
+
+Parquet needs pyarrow, which is optional; every batch becomes a row group.
+"""
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import datetime
+from enum import Enum
+from typing import Any, AsyncIterator, Iterable, List, Sequence
+
+from sqlalchemy import DateTime, Float, Integer, Select
+
+from . import models, schemas
+from .database import AsyncSessionLocal
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+# Columns of schemas.Invoice, without the owner that is the same on every row
+EXPORT_FIELDS = ["id"] + [field for field in schemas.Invoice.model_fields if field not in ("id", "owner_id")]
+
+MEDIA_TYPES = {
+    schemas.ExportFormat.CSV: "text/csv",
+    schemas.ExportFormat.NDJSON: "application/x-ndjson",
+    schemas.ExportFormat.PARQUET: "application/vnd.apache.parquet",
+}
+
+class ExportUnavailable(Exception):
+    pass
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def _encode_csv(fields: Sequence[str]):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def encode(rows: Iterable[Sequence[Any]]) -> bytes:
+        writer.writerows([["" if value is None else _plain(value) for value in row] for row in rows])
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk.encode()
+
+    return encode([fields]), encode, lambda: b""
+
+def _encode_ndjson(fields: Sequence[str]):
+    def encode(rows: Iterable[Sequence[Any]]) -> bytes:
+        return "".join(
+            json.dumps(dict(zip(fields, map(_plain, row))), separators=(",", ":")) + "\n" for row in rows
+        ).encode()
+
+    return b"", encode, lambda: b""
+
+class _ChunkSink(io.RawIOBase):
+    """File object collecting what pyarrow writes until it is taken"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        # The Parquet footer records offsets from the start of the file
+        return self.position
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def _arrow_type(field: str):
+    column_type = models.Invoice.__table__.c[field].type
+    if isinstance(column_type, Integer):
+        return pyarrow.int64()
+    if isinstance(column_type, Float):
+        return pyarrow.float64()
+    if isinstance(column_type, DateTime):
+        return pyarrow.timestamp("us")
+    return pyarrow.string()
+
+def _encode_parquet(fields: Sequence[str]):
+    schema = pyarrow.schema([(field, _arrow_type(field)) for field in fields])
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression="snappy")
+
+    def encode(rows: Sequence[Sequence[Any]]) -> bytes:
+        columns = {
+            field: [value.value if isinstance(value, Enum) else value for value in column]
+            for field, column in zip(fields, zip(*rows))
+        }
+        writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+        return sink.take()
+
+    def close() -> bytes:
+        writer.close()
+        return sink.take()
+
+    return b"", encode, close
+
+ENCODERS = {
+    schemas.ExportFormat.CSV: _encode_csv,
+    schemas.ExportFormat.NDJSON: _encode_ndjson,
+    schemas.ExportFormat.PARQUET: _encode_parquet,
+}
+
+def check_available(export_format: schemas.ExportFormat) -> None:
+    """Raise ExportUnavailable when the format needs a missing dependency"""
+    if export_format == schemas.ExportFormat.PARQUET and pyarrow is None:
+        raise ExportUnavailable("Parquet export needs pyarrow, install it or use csv or ndjson")
+
+def export_filename(export_format: schemas.ExportFormat, gzip: bool) -> str:
+    return f"invoices.{export_format.value}" + (".gz" if gzip else "")
+
+async def stream_invoices(
+    query: Select, fields: Sequence[str], export_format: schemas.ExportFormat, gzip: bool = False
+) -> AsyncIterator[bytes]:
+    """Run the query with a server-side cursor and yield the encoded file in chunks"""
+    header, encode, close = ENCODERS[export_format](fields)
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if gzip else None
+
+    def output(data: bytes) -> bytes:
+        return compressor.compress(data) if compressor is not None else data
+
+    # The response outlives the request's session, so the export has its own
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        chunk = output(header)
+        if chunk:
+            yield chunk
+        async for rows in result.partitions():
+            chunk = output(encode(rows))
+            if chunk:
+                yield chunk
+
+    chunk = output(close())
+    if compressor is not None:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
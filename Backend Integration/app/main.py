@@ -1,16 +1,38 @@
-from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, status
+from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, Query, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+from datetime import date, datetime, time, timedelta
+import asyncio
 import os
-from typing import List
-from . import models, schemas, auth
-from .database import engine, get_db
-from .services.invoice_processor import InvoiceProcessor
+import zipfile
+from typing import List, Optional
+from . import models, schemas, auth, metrics
+# Registers the flush listener that keeps invoice_rollups up to date
+from . import rollups
+from .analytics import compute_analytics
+from .export import (
+    EXPORT_FIELDS, MEDIA_TYPES, ExportUnavailable, check_available, export_filename, stream_invoices
+)
+from .migrations import upgrade_database
+from .search import search_invoices
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+from .database import async_engine, engine, get_db
+from .worker import InvoiceWorker
+from .services.extraction_cache import ExtractionCache
+from .services.tiered_extraction import summarize_sources
+from .services.upload_storage import (
+    MAX_ARCHIVE_BYTES, MAX_BATCH_FILES, UploadTooLarge, extract_archive,
+    is_archive, is_supported, remove_upload, save_upload
+)
 
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
+# Create or migrate the database tables
+upgrade_database(engine)
 
 app = FastAPI(
     title="InvoSmart AI API",
@@ -25,18 +47,54 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+# Times every request, see GET /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Number of invoices processed in parallel inside the API process. Set to 0
+# when running standalone workers (python -m app.worker) instead.
+EMBEDDED_WORKERS = int(os.getenv("EMBEDDED_WORKERS", "2"))
+WORKER_SHUTDOWN_TIMEOUT = float(os.getenv("WORKER_SHUTDOWN_TIMEOUT", "30"))
+
+extraction_cache = ExtractionCache()
+invoice_worker = InvoiceWorker(concurrency=EMBEDDED_WORKERS) if EMBEDDED_WORKERS > 0 else None
+worker_task = None
+
+@app.on_event("startup")
+async def start_invoice_worker():
+    global worker_task
+    if invoice_worker is not None:
+        worker_task = asyncio.create_task(invoice_worker.run())
 
-# Initialize invoice processor
-invoice_processor = InvoiceProcessor()
+@app.on_event("shutdown")
+async def stop_invoice_worker():
+    if worker_task is not None:
+        invoice_worker.stop()
+        try:
+            await asyncio.wait_for(worker_task, WORKER_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Interrupted invoices stay in PROCESSING, see app.worker --requeue
+            pass
+
+@app.on_event("shutdown")
+async def close_database():
+    await async_engine.dispose()
 
 @app.post("/token", response_model=schemas.Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+    result = await db.execute(
+        select(models.User)
+        .options(undefer(models.User.hashed_password))
+        .where(models.User.email == form_data.username)
+    )
+    user = result.scalars().first()
+    # Return the connection to the pool while bcrypt runs
+    await db.close()
+    if not user or not await auth.verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -45,25 +103,27 @@ async def login_for_access_token(
     
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email, "uid": user.id}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/users/", response_model=schemas.User)
-async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
-    if db_user:
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(models.User).where(models.User.email == user.email))
+    if result.scalars().first():
         raise HTTPException(status_code=400, detail="Email already registered")
-    
-    hashed_password = auth.get_password_hash(user.password)
+
+    # Return the connection to the pool while bcrypt runs
+    await db.close()
+    hashed_password = await auth.get_password_hash_async(user.password)
     db_user = models.User(
         email=user.email,
         hashed_password=hashed_password,
         full_name=user.full_name
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 @app.get("/users/me", response_model=schemas.User)
@@ -72,87 +132,277 @@ async def read_users_me(
 ):
     return current_user
 
-@app.post("/invoices/upload", response_model=schemas.Invoice)
+@app.post("/invoices/upload", response_model=schemas.Invoice, status_code=status.HTTP_202_ACCEPTED)
 async def upload_invoice(
     file: UploadFile = File(...),
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    # Save the uploaded file
-    file_path = f"uploads/{file.filename}"
-    os.makedirs("uploads", exist_ok=True)
-    
-    with open(file_path, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
-    
-    try:
-        # Process the invoice
-        result = invoice_processor.process_invoice(file_path)
+    with metrics.UPLOADS_IN_FLIGHT.track_inprogress():
+        # Stream the uploaded file to disk
+        try:
+            with metrics.STAGE_SECONDS.time(stage="upload_store"):
+                upload = await save_upload(file)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
         
-        if not result["success"]:
-            raise HTTPException(status_code=400, detail=result["error"])
-        
-        # Create invoice record
-        invoice_data = result["data"]
+        # Queue the invoice, the worker picks it up and processes it
         db_invoice = models.Invoice(
             filename=file.filename,
-            status=models.InvoiceStatus.COMPLETED,
-            invoice_number=invoice_data.get("invoice_number"),
-            date=datetime.strptime(invoice_data.get("date"), "%Y-%m-%d") if invoice_data.get("date") else None,
-            due_date=datetime.strptime(invoice_data.get("due_date"), "%Y-%m-%d") if invoice_data.get("due_date") else None,
-            amount=invoice_data.get("amount"),
-            tax=invoice_data.get("tax"),
-            total=invoice_data.get("total"),
-            vendor_name=invoice_data.get("vendor_info", {}).get("name"),
-            vendor_address=invoice_data.get("vendor_info", {}).get("address"),
-            vendor_email=invoice_data.get("vendor_info", {}).get("email"),
-            client_name=invoice_data.get("client_info", {}).get("name"),
-            client_address=invoice_data.get("client_info", {}).get("address"),
-            client_email=invoice_data.get("client_info", {}).get("email"),
-            processed_at=datetime.utcnow(),
+            status=models.InvoiceStatus.PENDING,
+            file_path=upload.path,
+            file_hash=upload.sha256,
             owner_id=current_user.id
         )
         
         db.add(db_invoice)
-        db.commit()
-        db.refresh(db_invoice)
-        
-        # Clean up the file
-        os.remove(file_path)
-        
-        return db_invoice
+        with metrics.STAGE_SECONDS.time(stage="db_commit"):
+            await db.commit()
+        await db.refresh(db_invoice)
+    
+    if invoice_worker is not None:
+        invoice_worker.notify()
+    
+    return db_invoice
+
+@app.post("/invoices/batch", response_model=schemas.BatchUploadResult, status_code=status.HTTP_202_ACCEPTED)
+async def upload_invoice_batch(
+    files: List[UploadFile] = File(...),
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    with metrics.UPLOADS_IN_FLIGHT.track_inprogress():
+        # One manifest entry per file, a bad file only rejects its own entry
+        results = []
+        queued = []
+
+        def reject(filename, error):
+            results.append({"filename": filename, "status": "rejected", "error": error})
+
+        def accept(filename, upload):
+            entry = {"filename": filename, "status": "queued"}
+            results.append(entry)
+            queued.append((entry, upload))
+
+        for file in files:
+            if is_archive(file.filename):
+                try:
+                    archive = await save_upload(file, max_bytes=MAX_ARCHIVE_BYTES)
+                except UploadTooLarge as e:
+                    reject(file.filename, str(e))
+                    continue
+
+                try:
+                    members = await run_in_threadpool(
+                        extract_archive, archive.path, MAX_BATCH_FILES - len(queued)
+                    )
+                except zipfile.BadZipFile:
+                    reject(file.filename, "Invalid ZIP archive")
+                    continue
+                finally:
+                    remove_upload(archive.path)
+
+                for member in members:
+                    if member.upload is None:
+                        reject(member.filename, member.error)
+                    else:
+                        accept(member.filename, member.upload)
+            elif not is_supported(file.filename):
+                reject(file.filename, "Unsupported file type")
+            elif len(queued) >= MAX_BATCH_FILES:
+                reject(file.filename, f"Batch is limited to {MAX_BATCH_FILES} files")
+            else:
+                try:
+                    with metrics.STAGE_SECONDS.time(stage="upload_store"):
+                        accept(file.filename, await save_upload(file))
+                except UploadTooLarge as e:
+                    reject(file.filename, str(e))
+
+        # Queue all accepted invoices in a single transaction
+        db_invoices = [
+            models.Invoice(
+                filename=entry["filename"],
+                status=models.InvoiceStatus.PENDING,
+                file_path=upload.path,
+                file_hash=upload.sha256,
+                owner_id=current_user.id
+            )
+            for entry, upload in queued
+        ]
+    
+        try:
+            db.add_all(db_invoices)
+            await db.flush()
+            for (entry, _), db_invoice in zip(queued, db_invoices):
+                entry["invoice_id"] = db_invoice.id
+            with metrics.STAGE_SECONDS.time(stage="db_commit"):
+                await db.commit()
+        except Exception:
+            await db.rollback()
+            for _, upload in queued:
+                remove_upload(upload.path)
+            raise
     
-    except Exception as e:
-        # Clean up the file in case of error
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        raise HTTPException(status_code=500, detail=str(e))
+        if invoice_worker is not None and db_invoices:
+            invoice_worker.notify()
+    
+        return {
+            "total": len(results),
+            "queued": len(queued),
+            "rejected": len(results) - len(queued),
+            "results": results
+        }
+
+def filter_invoices(
+    query, status_filter: Optional[schemas.InvoiceStatus], date_from: Optional[date], date_to: Optional[date],
+    vendor_name: Optional[str], min_total: Optional[float], max_total: Optional[float]
+):
+    """Apply the invoice list filters shared by listing and export"""
+    Invoice = models.Invoice
+    if status_filter is not None:
+        query = query.where(Invoice.status == models.InvoiceStatus(status_filter.value))
+    if date_from is not None:
+        query = query.where(Invoice.date >= datetime.combine(date_from, time.min))
+    if date_to is not None:
+        query = query.where(Invoice.date < datetime.combine(date_to + timedelta(days=1), time.min))
+    if vendor_name is not None:
+        query = query.where(Invoice.vendor_name == vendor_name)
+    if min_total is not None:
+        query = query.where(Invoice.total >= min_total)
+    if max_total is not None:
+        query = query.where(Invoice.total <= max_total)
+    return query
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Split a comma-separated fields= parameter, rejecting unknown columns"""
+    if not fields:
+        return None
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = set(selected) - schemas.INVOICE_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return selected
 
 @app.get("/invoices/", response_model=List[schemas.Invoice])
 async def list_invoices(
-    skip: int = 0,
-    limit: int = 100,
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    status_filter: Optional[schemas.InvoiceStatus] = Query(None, alias="status"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    vendor_name: Optional[str] = None,
+    min_total: Optional[float] = None,
+    max_total: Optional[float] = None,
+    fields: Optional[str] = None,
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    invoices = db.query(models.Invoice)\
-        .filter(models.Invoice.owner_id == current_user.id)\
-        .offset(skip)\
-        .limit(limit)\
-        .all()
-    return invoices
+    """List invoices newest first. The cursor for the next page is returned
+    in the X-Next-Cursor header; fields= is a comma-separated column subset."""
+    Invoice = models.Invoice
+    selected = parse_fields(fields)
+    
+    # Only the requested columns are loaded, plus the cursor columns
+    columns = [getattr(Invoice, field) for field in selected] if selected else [Invoice]
+    query = select(*columns, Invoice.created_at.label("_created_at"), Invoice.id.label("_id"))\
+        .where(Invoice.owner_id == current_user.id)
+    
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = query.where(tuple_(Invoice.created_at, Invoice.id) < tuple_(cursor_created_at, cursor_id))
+    query = filter_invoices(query, status_filter, date_from, date_to, vendor_name, min_total, max_total)
+    
+    result = await db.execute(query.order_by(Invoice.created_at.desc(), Invoice.id.desc()).limit(limit))
+    rows = result.all()
+    
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1]._created_at, rows[-1]._id)
+    
+    if selected:
+        content = jsonable_encoder([{field: getattr(row, field) for field in selected} for row in rows])
+        return JSONResponse(content=content, headers=dict(response.headers))
+    return [row[0] for row in rows]
+
+@app.get("/invoices/export")
+async def export_invoices(
+    export_format: schemas.ExportFormat = Query(schemas.ExportFormat.CSV, alias="format"),
+    gzip: bool = False,
+    status_filter: Optional[schemas.InvoiceStatus] = Query(None, alias="status"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    vendor_name: Optional[str] = None,
+    min_total: Optional[float] = None,
+    max_total: Optional[float] = None,
+    fields: Optional[str] = None,
+    current_user: models.User = Depends(auth.get_current_active_user)
+):
+    """Stream all matching invoices oldest first as one CSV, NDJSON or Parquet
+    file, gzipped with gzip=true; takes the filters of GET /invoices/"""
+    Invoice = models.Invoice
+    try:
+        check_available(export_format)
+    except ExportUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=str(e))
+    selected = parse_fields(fields) or EXPORT_FIELDS
+    
+    query = select(*(getattr(Invoice, field) for field in selected)).where(Invoice.owner_id == current_user.id)
+    query = filter_invoices(query, status_filter, date_from, date_to, vendor_name, min_total, max_total)
+    query = query.order_by(Invoice.created_at, Invoice.id)
+    
+    filename = export_filename(export_format, gzip)
+    return StreamingResponse(
+        stream_invoices(query, selected, export_format, gzip),
+        # A gzip file to save, not a transfer encoding for the client to undo
+        media_type="application/gzip" if gzip else MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/invoices/search", response_model=List[schemas.InvoiceSearchResult])
+async def search(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    hits = await db.run_sync(search_invoices, current_user.id, q, limit)
+    return [
+        {"invoice": invoice, "rank": rank, "snippet": snippet}
+        for invoice, rank, snippet in hits
+    ]
 
 @app.get("/invoices/{invoice_id}", response_model=schemas.Invoice)
 async def get_invoice(
     invoice_id: int,
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    invoice = db.query(models.Invoice)\
-        .filter(models.Invoice.id == invoice_id)\
-        .filter(models.Invoice.owner_id == current_user.id)\
-        .first()
+    result = await db.execute(
+        select(models.Invoice)
+        .where(models.Invoice.id == invoice_id)
+        .where(models.Invoice.owner_id == current_user.id)
+    )
+    invoice = result.scalars().first()
+    
+    if invoice is None:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    return invoice
+
+@app.get("/invoices/{invoice_id}/status", response_model=schemas.InvoiceJobStatus)
+async def get_invoice_status(
+    invoice_id: int,
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    result = await db.execute(
+        select(models.Invoice)
+        .where(models.Invoice.id == invoice_id)
+        .where(models.Invoice.owner_id == current_user.id)
+    )
+    invoice = result.scalars().first()
     
     if invoice is None:
         raise HTTPException(status_code=404, detail="Invoice not found")
@@ -161,56 +411,52 @@ async def get_invoice(
 @app.get("/analytics", response_model=schemas.InvoiceAnalytics)
 async def get_analytics(
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    # Get user's invoices
-    invoices = db.query(models.Invoice)\
-        .filter(models.Invoice.owner_id == current_user.id)\
-        .all()
+    # Aggregates are computed by the database
+    analytics = await db.run_sync(compute_analytics, current_user.id)
     
-    if not invoices:
-        return {
-            "total_count": 0,
-            "total_amount": 0.0,
-            "average_amount": 0.0,
-            "processing_time": 0.0,
-            "success_rate": 0.0,
-            "monthly_trends": {},
-            "category_distribution": {}
-        }
-    
-    # Calculate analytics
-    total_amount = sum(invoice.total or 0 for invoice in invoices)
-    processing_times = [
-        (invoice.processed_at - invoice.created_at).total_seconds()
-        for invoice in invoices
-        if invoice.processed_at and invoice.created_at
-    ]
+    if analytics["total_count"] == 0:
+        analytics["category_distribution"] = {}
+        return analytics
     
-    # Monthly trends
-    monthly_trends = {}
-    for invoice in invoices:
-        if invoice.date:
-            month_key = invoice.date.strftime("%Y-%m")
-            if month_key not in monthly_trends:
-                monthly_trends[month_key] = {"count": 0, "amount": 0}
-            monthly_trends[month_key]["count"] += 1
-            monthly_trends[month_key]["amount"] += invoice.total or 0
-    
-    return {
-        "total_count": len(invoices),
-        "total_amount": total_amount,
-        "average_amount": total_amount / len(invoices) if invoices else 0,
-        "processing_time": sum(processing_times) / len(processing_times) if processing_times else 0,
-        "success_rate": len([i for i in invoices if i.status == models.InvoiceStatus.COMPLETED]) / len(invoices) * 100,
-        "monthly_trends": monthly_trends,
-        "category_distribution": {
-            "services": 45,  # Mock data - implement actual categorization
-            "products": 30,
-            "equipment": 15,
-            "others": 10
-        }
+    analytics["category_distribution"] = {
+        "services": 45,  # Mock data - implement actual categorization
+        "products": 30,
+        "equipment": 15,
+        "others": 10
     }
+    return analytics
+
+@app.get("/extraction/stats", response_model=schemas.ExtractionStats)
+async def get_extraction_stats(
+    limit: int = Query(1000, ge=1, le=10000),
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Which extraction tier produced each field, over the latest completed invoices"""
+    result = await db.execute(
+        select(models.Invoice.field_sources)
+        .where(models.Invoice.owner_id == current_user.id)
+        .where(models.Invoice.status == models.InvoiceStatus.COMPLETED)
+        .where(models.Invoice.field_sources.isnot(None))
+        .order_by(models.Invoice.created_at.desc(), models.Invoice.id.desc())
+        .limit(limit)
+    )
+    return summarize_sources(result.scalars())
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Stage and request timings, counters and gauges in the Prometheus text format"""
+    # Set as a header, media_type would get a second charset appended
+    return Response(metrics.REGISTRY.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+@app.get("/cache/stats", response_model=schemas.CacheStats)
+async def get_cache_stats(
+    current_user: models.User = Depends(auth.get_current_admin_user)
+):
+    # Counters are shared by all users, so only admins (ADMIN_EMAILS) see them
+    return await run_in_threadpool(extraction_cache.stats)
 
 if __name__ == "__main__":
     import uvicorn
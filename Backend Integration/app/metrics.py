@@ -0,0 +1,262 @@
+"""In-process metrics served in the Prometheus text exposition format.
+
+Counters, gauges and histograms live in this module and are rendered by
+``GET /metrics`` (see ``app.main``). An update is one dict lookup under a
+lock, so instrumentation stays on under load; there is no dependency on
+``prometheus_client``.
+
+Stages that run in pool processes (preprocessing, OCR, the cheap extraction
+tiers) are timed into a plain ``{stage: seconds}`` dict with ``timed``. The
+dict travels back with the result and the parent records it with
+``observe_stages``, so the process serving ``/metrics`` sees them. Each API
+or worker process reports its own figures; scrape all of them. Standalone
+workers have no API, ``serve`` exposes their registry on a port of its own
+(``python -m app.worker --metrics-port 9100``).
+
+HTTP requests are timed by ``MetricsMiddleware``, labelled with the route
+template (``/invoices/{invoice_id}``) rather than the path to keep the
+number of series bounded.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds, from a cached lookup to a multi-page OCR
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+class Registry:
+    def __init__(self):
+        self._metrics: List["Metric"] = []
+
+    def register(self, metric: "Metric") -> None:
+        if any(existing.name == metric.name for existing in self._metrics):
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        """All metrics in the text exposition format"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        # A series without labels is reported from the start
+        if not self.labelnames:
+            self._values[()] = self._zero()
+        if registry is not None:
+            registry.register(self)
+
+    def _zero(self):
+        return 0.0
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {', '.join(self.labelnames) or '(none)'}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in sorted(values):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        """Count the block as in progress while it runs"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional[Registry] = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _zero(self):
+        # Counts per bucket, the last one above the largest bucket, and the sum
+        return [[0] * (len(self.buckets) + 1), 0.0]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = self._zero()
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds the block takes, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in sorted(values):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+STAGE_SECONDS = Histogram(
+    "invosmart_stage_seconds", "Seconds spent per invoice processing stage", ["stage"]
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "invosmart_http_request_seconds", "Seconds to answer HTTP requests", ["method", "route", "status"]
+)
+LLM_FALLBACKS = Counter(
+    "invosmart_llm_fallbacks_total", "LLM extractions that failed and kept the regex and NER results"
+)
+CACHE_REQUESTS = Counter(
+    "invosmart_cache_requests_total", "Cache lookups by cache and result (hit or miss)", ["cache", "result"]
+)
+DUPLICATES = Counter(
+    "invosmart_duplicates_total", "Invoices flagged as duplicates by what matched", ["reason"]
+)
+ERRORS = Counter(
+    "invosmart_errors_total", "Errors by where they happened", ["source"]
+)
+UPLOADS_IN_FLIGHT = Gauge(
+    "invosmart_uploads_in_flight", "Upload requests being received and stored"
+)
+INVOICES_IN_PROGRESS = Gauge(
+    "invosmart_invoices_in_progress", "Invoices claimed by this process's worker and not yet stored"
+)
+
+@contextmanager
+def timed(timings: Dict[str, float], stage: str):
+    """Add the seconds the block takes to timings[stage]"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+def observe_stages(timings: Optional[Dict[str, float]]) -> None:
+    """Record stage timings measured elsewhere, e.g. in a pool process"""
+    for stage, seconds in (timings or {}).items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by method, route and status"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            ERRORS.inc(source="http")
+            raise
+        finally:
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, method=scope["method"],
+                route=getattr(route, "path", "unmatched"), status=status
+            )
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve the registry over HTTP from a daemon thread, for processes without the API"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
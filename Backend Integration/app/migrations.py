@@ -0,0 +1,93 @@
+"""Database schema migrations.
+
+The schema is versioned with Alembic, one revision per change under
+``alembic/versions``. ``upgrade_database`` brings a database to the latest
+revision and (re)creates the full-text index; the API, the worker and the
+maintenance CLIs call it on startup instead of ``create_all``, which never
+alters existing tables. It can also be run on its own::
+
+    python -m app.migrations
+
+or with the Alembic CLI from the backend directory (``alembic upgrade head``,
+``alembic revision -m "..."``).
+
+Databases created by ``create_all`` before migrations existed have no
+version table. They are stamped with the baseline revision and upgraded
+from there, which is why revisions only add the columns, tables and indexes
+that are missing.
+"""
+import argparse
+import os
+from typing import List, Sequence
+
+from alembic import command, op
+from alembic.config import Config
+from sqlalchemy import Column, inspect
+from sqlalchemy.engine import Engine
+
+from .database import engine
+from .search import create_search_index
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+# Schema of the first release, the tables create_all made before migrations
+BASELINE_REVISION = "0001"
+
+def alembic_config() -> Config:
+    return Config(ALEMBIC_INI)
+
+def upgrade_database(bind: Engine = engine) -> None:
+    """Migrate the database to the latest revision and create the search index"""
+    config = alembic_config()
+    with bind.begin() as connection:
+        # env.py runs the revisions on this connection, in this transaction
+        config.attributes["connection"] = connection
+        tables = inspect(connection).get_table_names()
+        if "invoices" in tables and "alembic_version" not in tables:
+            command.stamp(config, BASELINE_REVISION)
+        command.upgrade(config, "head")
+    create_search_index(bind)
+
+# Helpers for revisions, which must not fail on tables create_all already made
+
+def table_names() -> List[str]:
+    return inspect(op.get_bind()).get_table_names()
+
+def column_names(table: str) -> List[str]:
+    return [column["name"] for column in inspect(op.get_bind()).get_columns(table)]
+
+def index_names(table: str) -> List[str]:
+    return [index["name"] for index in inspect(op.get_bind()).get_indexes(table)]
+
+def add_columns(table: str, *columns: Column) -> None:
+    existing = column_names(table)
+    # SQLite copies the table to add a column with a foreign key
+    with op.batch_alter_table(table) as batch:
+        for column in columns:
+            if column.name not in existing:
+                batch.add_column(column)
+
+def drop_columns(table: str, *names: str) -> None:
+    existing = column_names(table)
+    # SQLite can only drop some columns by copying the table
+    with op.batch_alter_table(table) as batch:
+        for name in names:
+            if name in existing:
+                batch.drop_column(name)
+
+def create_index(name: str, table: str, columns: Sequence[str], **kwargs) -> None:
+    if name not in index_names(table):
+        op.create_index(name, table, list(columns), **kwargs)
+
+def drop_index(name: str, table: str) -> None:
+    if name in index_names(table):
+        op.drop_index(name, table_name=table)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Migrate the database to the latest schema")
+    parser.parse_args()
+
+    upgrade_database(engine)
+    print("Database is up to date")
+
+if __name__ == "__main__":
+    main()
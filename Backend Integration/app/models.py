@@ -1,12 +1,12 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Text, Float, DateTime, ForeignKey, Enum, Index, JSON
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 from datetime import datetime
 import enum
 
 Base = declarative_base()
 
-class InvoiceStatus(enum.Enum):
+class InvoiceStatus(str, enum.Enum):
     PENDING = "pending"
     PROCESSING = "processing"
     COMPLETED = "completed"
@@ -17,7 +17,8 @@ class User(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True)
-    hashed_password = Column(String)
+    # Only loaded where a password is checked, see the /token endpoint
+    hashed_password = deferred(Column(String))
     full_name = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
     invoices = relationship("Invoice", back_populates="owner")
@@ -42,5 +43,61 @@ class Invoice(Base):
     client_email = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
     processed_at = Column(DateTime)
+    file_path = Column(String)
+    file_hash = Column(String)
+    error_message = Column(String)
+    # Raw OCR output, indexed for full-text search (see app.search)
+    ocr_text = Column(Text)
+    # Token counts of the OCR text and of the compacted LLM prompt
+    ocr_tokens = Column(Integer)
+    prompt_tokens = Column(Integer)
+    # Extraction tier and confidence of every field (see app.services.tiered_extraction)
+    field_sources = Column(JSON)
+    # How each page's text was read (text layer or OCR) and how long it took
+    page_stats = Column(JSON)
+    # Duplicate detection (see app.duplicates): normalized field hash, first
+    # page dHash split into indexed bands, and the invoice this one repeats
+    fingerprint = Column(String)
+    image_hash = Column(String)
+    image_hash_band0 = Column(Integer)
+    image_hash_band1 = Column(Integer)
+    image_hash_band2 = Column(Integer)
+    image_hash_band3 = Column(Integer)
+    duplicate_of_id = Column(Integer, ForeignKey("invoices.id"))
+    duplicate_reason = Column(String)
     owner_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="invoices")
+
+    __table_args__ = (
+        # Keyset pagination of a user's invoices, newest first
+        Index("ix_invoices_owner_created_id", "owner_id", "created_at", "id"),
+        Index("ix_invoices_owner_status_created_id", "owner_id", "status", "created_at", "id"),
+        Index("ix_invoices_owner_vendor_created_id", "owner_id", "vendor_name", "created_at", "id"),
+        # Date range filters and per-user aggregates for analytics
+        Index("ix_invoices_owner_date", "owner_id", "date"),
+        # Worker queue: oldest pending invoice first
+        Index("ix_invoices_status_created_id", "status", "created_at", "id"),
+        # Duplicate lookups at ingest, always within one user's invoices
+        Index("ix_invoices_owner_file_hash_id", "owner_id", "file_hash", "id"),
+        Index("ix_invoices_owner_fingerprint_id", "owner_id", "fingerprint", "id"),
+        Index("ix_invoices_owner_image_hash_band0", "owner_id", "image_hash_band0"),
+        Index("ix_invoices_owner_image_hash_band1", "owner_id", "image_hash_band1"),
+        Index("ix_invoices_owner_image_hash_band2", "owner_id", "image_hash_band2"),
+        Index("ix_invoices_owner_image_hash_band3", "owner_id", "image_hash_band3"),
+    )
+
+class InvoiceRollup(Base):
+    """Per-user, per-month invoice aggregates maintained by app.rollups"""
+    __tablename__ = "invoice_rollups"
+
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    # YYYY-MM of the invoice date, empty for invoices without a date
+    month = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    amount_sum = Column(Float, nullable=False, default=0.0)
+    pending_count = Column(Integer, nullable=False, default=0)
+    processing_count = Column(Integer, nullable=False, default=0)
+    completed_count = Column(Integer, nullable=False, default=0)
+    error_count = Column(Integer, nullable=False, default=0)
+    processing_time_sum = Column(Float, nullable=False, default=0.0)
+    processing_time_count = Column(Integer, nullable=False, default=0)
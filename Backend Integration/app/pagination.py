@@ -0,0 +1,26 @@
+"""Opaque keyset-pagination cursors.
+
+A cursor encodes the ``(created_at, id)`` of the last invoice on a page; the
+next page continues strictly after it in ``created_at DESC, id DESC`` order,
+which the ``(owner_id, created_at, id)`` indexes serve without scanning the
+skipped rows.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Tuple
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(created_at: datetime, invoice_id: int) -> str:
+    payload = json.dumps([created_at.isoformat(), invoice_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, invoice_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(invoice_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor("Invalid pagination cursor") from e
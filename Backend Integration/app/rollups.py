@@ -0,0 +1,219 @@
+"""Incrementally maintained per-user, per-month invoice rollups.
+
+Every flush that inserts, updates or deletes an ``Invoice`` adjusts the
+matching ``invoice_rollups`` rows in the same transaction, so analytics can
+be read in O(months) instead of aggregating the invoices table. Bulk
+``update()`` statements bypass the ORM; code changing invoice status that way
+must call ``record_status_change`` (see ``app.worker``).
+
+Backfill or verify the rollups from the invoices table with::
+
+    python -m app.rollups check
+    python -m app.rollups rebuild
+
+Run ``rebuild`` while no workers are writing invoices.
+"""
+import argparse
+import sys
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import models
+from .analytics import aggregate_invoices
+from .database import SessionLocal, engine
+from .migrations import upgrade_database
+
+ROLLUP_FIELDS = [
+    "count",
+    "amount_sum",
+    "pending_count",
+    "processing_count",
+    "completed_count",
+    "error_count",
+    "processing_time_sum",
+    "processing_time_count",
+]
+
+STATUS_FIELDS = {
+    models.InvoiceStatus.PENDING: "pending_count",
+    models.InvoiceStatus.PROCESSING: "processing_count",
+    models.InvoiceStatus.COMPLETED: "completed_count",
+    models.InvoiceStatus.ERROR: "error_count",
+}
+
+TRACKED_COLUMNS = ["owner_id", "date", "total", "status", "created_at", "processed_at"]
+
+RollupKey = Tuple[int, str]
+Deltas = Dict[RollupKey, Dict[str, float]]
+
+def month_of(date: Optional[datetime]) -> str:
+    return date.strftime("%Y-%m") if date else ""
+
+def _add(deltas: Deltas, row, sign: int) -> None:
+    """Add (sign=1) or remove (sign=-1) one invoice's contribution"""
+    if row["owner_id"] is None:
+        return
+    values = deltas[(row["owner_id"], month_of(row["date"]))]
+    values["count"] += sign
+    values["amount_sum"] += sign * (row["total"] or 0.0)
+    # Unflushed invoices get the column default
+    values[STATUS_FIELDS[row["status"] or models.InvoiceStatus.PENDING]] += sign
+    if row["created_at"] and row["processed_at"]:
+        values["processing_time_sum"] += sign * (row["processed_at"] - row["created_at"]).total_seconds()
+        values["processing_time_count"] += sign
+
+def _new_deltas() -> Deltas:
+    return defaultdict(lambda: dict.fromkeys(ROLLUP_FIELDS, 0))
+
+def _upsert(dialect: str):
+    if dialect == "postgresql":
+        return postgresql.insert
+    if dialect == "sqlite":
+        return sqlite.insert
+    raise NotImplementedError(f"Invoice rollups are not supported on {dialect}")
+
+def apply_deltas(connection, deltas: Deltas) -> None:
+    """Add the deltas to the rollup rows, creating missing rows"""
+    table = models.InvoiceRollup.__table__
+    insert = _upsert(connection.dialect.name)
+
+    for (owner_id, month), values in deltas.items():
+        if not any(values.values()):
+            continue
+        stmt = insert(table).values(owner_id=owner_id, month=month, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.owner_id, table.c.month],
+            set_={field: table.c[field] + stmt.excluded[field] for field in ROLLUP_FIELDS},
+        )
+        connection.execute(stmt)
+
+def _stored_row(connection, invoice_id: int):
+    table = models.Invoice.__table__
+    return connection.execute(
+        select(*[table.c[column] for column in TRACKED_COLUMNS]).where(table.c.id == invoice_id)
+    ).mappings().first()
+
+def _has_tracked_changes(invoice: models.Invoice) -> bool:
+    attrs = inspect(invoice).attrs
+    return any(attrs[column].history.has_changes() for column in TRACKED_COLUMNS)
+
+@event.listens_for(Session, "before_flush")
+def _update_rollups(session: Session, flush_context, instances) -> None:
+    deltas = _new_deltas()
+    connection = None
+
+    for invoice in session.new:
+        if isinstance(invoice, models.Invoice):
+            # Fill the default now so the processing time can be computed
+            if invoice.created_at is None:
+                invoice.created_at = datetime.utcnow()
+            _add(deltas, {column: getattr(invoice, column) for column in TRACKED_COLUMNS}, 1)
+
+    for invoice in session.dirty:
+        if isinstance(invoice, models.Invoice) and _has_tracked_changes(invoice):
+            # The previous values may not be loaded, read them from the row
+            connection = connection or session.connection()
+            stored = _stored_row(connection, invoice.id)
+            if stored is not None:
+                _add(deltas, stored, -1)
+            _add(deltas, {column: getattr(invoice, column) for column in TRACKED_COLUMNS}, 1)
+
+    for invoice in session.deleted:
+        if isinstance(invoice, models.Invoice):
+            connection = connection or session.connection()
+            stored = _stored_row(connection, invoice.id)
+            if stored is not None:
+                _add(deltas, stored, -1)
+
+    if deltas:
+        apply_deltas(connection or session.connection(), deltas)
+
+def record_status_change(
+    db: Session,
+    invoice_id: int,
+    old_status: models.InvoiceStatus,
+    new_status: models.InvoiceStatus,
+) -> None:
+    """Adjust rollups for a status change made with a bulk update()"""
+    connection = db.connection()
+    stored = _stored_row(connection, invoice_id)
+    if stored is None or stored["owner_id"] is None:
+        return
+    deltas = _new_deltas()
+    values = deltas[(stored["owner_id"], month_of(stored["date"]))]
+    values[STATUS_FIELDS[old_status]] -= 1
+    values[STATUS_FIELDS[new_status]] += 1
+    apply_deltas(connection, deltas)
+
+def stored_rollups(db: Session, owner_id: Optional[int] = None) -> Dict[RollupKey, Dict[str, float]]:
+    query = db.query(models.InvoiceRollup)
+    if owner_id is not None:
+        query = query.filter(models.InvoiceRollup.owner_id == owner_id)
+    return {
+        (rollup.owner_id, rollup.month): {field: getattr(rollup, field) for field in ROLLUP_FIELDS}
+        for rollup in query
+    }
+
+def find_drift(db: Session, owner_id: Optional[int] = None) -> Iterable[Tuple[RollupKey, str, float, float]]:
+    """Yield (key, field, stored, expected) for every rollup value that is off"""
+    expected = aggregate_invoices(db, owner_id)
+    stored = stored_rollups(db, owner_id)
+    zero = dict.fromkeys(ROLLUP_FIELDS, 0)
+
+    for key in sorted(set(expected) | set(stored)):
+        for field in ROLLUP_FIELDS:
+            stored_value = stored.get(key, zero)[field]
+            expected_value = expected.get(key, zero)[field]
+            # Float sums may differ in the last digits depending on order, and
+            # SQLite date functions drop timestamps below milliseconds
+            if field == "processing_time_sum":
+                tolerance = 2e-3 * max(1, expected.get(key, zero)["processing_time_count"])
+            else:
+                tolerance = 1e-6 * max(1.0, abs(expected_value))
+            if abs(stored_value - expected_value) > tolerance:
+                yield key, field, stored_value, expected_value
+
+def rebuild(db: Session, owner_id: Optional[int] = None) -> int:
+    """Recompute rollups from the invoices table, returns the number of rows"""
+    expected = aggregate_invoices(db, owner_id)
+    query = db.query(models.InvoiceRollup)
+    if owner_id is not None:
+        query = query.filter(models.InvoiceRollup.owner_id == owner_id)
+    query.delete(synchronize_session=False)
+
+    db.add_all(
+        models.InvoiceRollup(owner_id=key[0], month=key[1], **values)
+        for key, values in expected.items()
+    )
+    db.commit()
+    return len(expected)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintain invoice analytics rollups")
+    parser.add_argument("command", choices=["check", "rebuild"])
+    parser.add_argument("--owner-id", type=int, default=None, help="limit to one user")
+    args = parser.parse_args()
+
+    upgrade_database(engine)
+    db = SessionLocal()
+    try:
+        if args.command == "rebuild":
+            print(f"Rebuilt {rebuild(db, args.owner_id)} rollup rows")
+            return
+
+        drift = list(find_drift(db, args.owner_id))
+        for (owner, month), field, stored_value, expected_value in drift:
+            print(f"owner {owner} month {month or '-'}: {field} is {stored_value}, expected {expected_value}")
+        print(f"{len(drift)} drifted values")
+        if drift:
+            sys.exit(1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 from enum import Enum
 
@@ -47,10 +47,67 @@ class Invoice(InvoiceBase):
     created_at: datetime
     processed_at: Optional[datetime] = None
     owner_id: int
+    # Set when the invoice repeats an earlier one (file, fingerprint or image)
+    duplicate_of_id: Optional[int] = None
+    duplicate_reason: Optional[str] = None
 
     class Config:
         orm_mode = True
 
+INVOICE_FIELDS = set(Invoice.model_fields)
+
+class ExportFormat(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+    PARQUET = "parquet"
+
+class InvoiceSearchResult(BaseModel):
+    invoice: Invoice
+    rank: float
+    snippet: Optional[str] = None
+
+class FieldSource(BaseModel):
+    tier: str
+    confidence: float
+
+class PageStat(BaseModel):
+    page: int
+    # "text" for the PDF text layer, "ocr" for rendered and OCR'd pages
+    method: str
+    seconds: float
+
+class InvoiceJobStatus(BaseModel):
+    id: int
+    status: InvoiceStatus
+    error_message: Optional[str] = None
+    created_at: datetime
+    processed_at: Optional[datetime] = None
+    ocr_tokens: Optional[int] = None
+    prompt_tokens: Optional[int] = None
+    field_sources: Optional[Dict[str, FieldSource]] = None
+    page_stats: Optional[List[PageStat]] = None
+
+    class Config:
+        orm_mode = True
+
+class ExtractionStats(BaseModel):
+    invoices: int
+    llm_invoices: int
+    # Field name -> tier -> number of invoices
+    fields: Dict[str, Dict[str, int]]
+
+class BatchFileResult(BaseModel):
+    filename: str
+    invoice_id: Optional[int] = None
+    status: str
+    error: Optional[str] = None
+
+class BatchUploadResult(BaseModel):
+    total: int
+    queued: int
+    rejected: int
+    results: List[BatchFileResult]
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -66,3 +123,12 @@ class InvoiceAnalytics(BaseModel):
     success_rate: float
     monthly_trends: dict
     category_distribution: dict
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    hit_rate: float
+    saved_seconds: float
+    evictions: int
+    entries: int
+    size_bytes: int
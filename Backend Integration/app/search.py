@@ -0,0 +1,171 @@
+"""Full-text search over extracted invoice content.
+
+The OCR text is indexed together with the vendor, client and invoice number
+fields. SQLite uses an external-content FTS5 table kept in sync by triggers,
+PostgreSQL a generated, weighted ``tsvector`` column with a GIN index. Both
+are created idempotently by ``create_search_index``; rebuild the SQLite index
+from existing rows with::
+
+    python -m app.search rebuild
+"""
+import argparse
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import engine
+
+# The owner is indexed too, so a search only ranks the user's own invoices:
+# the query requires the owner_id token rather than filtering after MATCH
+SQLITE_SEARCH_COLUMNS = "vendor_name, client_name, invoice_number, ocr_text, owner_id"
+
+SQLITE_SEARCH_DDL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS invoices_fts USING fts5(
+        {SQLITE_SEARCH_COLUMNS},
+        content='invoices', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS invoices_fts_insert AFTER INSERT ON invoices BEGIN
+        INSERT INTO invoices_fts (rowid, {SQLITE_SEARCH_COLUMNS})
+        VALUES (new.id, new.vendor_name, new.client_name, new.invoice_number, new.ocr_text, new.owner_id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS invoices_fts_delete AFTER DELETE ON invoices BEGIN
+        INSERT INTO invoices_fts (invoices_fts, rowid, {SQLITE_SEARCH_COLUMNS})
+        VALUES ('delete', old.id, old.vendor_name, old.client_name, old.invoice_number, old.ocr_text, old.owner_id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS invoices_fts_update
+    AFTER UPDATE OF {SQLITE_SEARCH_COLUMNS} ON invoices BEGIN
+        INSERT INTO invoices_fts (invoices_fts, rowid, {SQLITE_SEARCH_COLUMNS})
+        VALUES ('delete', old.id, old.vendor_name, old.client_name, old.invoice_number, old.ocr_text, old.owner_id);
+        INSERT INTO invoices_fts (rowid, {SQLITE_SEARCH_COLUMNS})
+        VALUES (new.id, new.vendor_name, new.client_name, new.invoice_number, new.ocr_text, new.owner_id);
+    END
+    """,
+]
+
+POSTGRESQL_SEARCH_DDL = [
+    """
+    ALTER TABLE invoices ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(vendor_name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(client_name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(invoice_number, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(ocr_text, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_invoices_search_vector ON invoices USING GIN (search_vector)",
+]
+
+SQLITE_SEARCH_QUERY = """
+    SELECT rowid AS id,
+           bm25(invoices_fts, 4.0, 4.0, 4.0, 1.0, 0.0) AS rank,
+           snippet(invoices_fts, 3, '<b>', '</b>', '…', 16) AS snippet
+    FROM invoices_fts
+    WHERE invoices_fts MATCH :query
+    ORDER BY rank
+    LIMIT :limit
+"""
+
+# Headlines are expensive, so they are only built for the top rows
+POSTGRESQL_SEARCH_QUERY = """
+    SELECT top.id, top.rank,
+           ts_headline('english', coalesce(invoices.ocr_text, ''), top.query,
+                       'StartSel=<b>, StopSel=</b>, MaxFragments=1, MaxWords=16, MinWords=6') AS snippet
+    FROM (
+        SELECT invoices.id, ts_rank_cd(invoices.search_vector, query) AS rank, query
+        FROM invoices, websearch_to_tsquery('english', :query) AS query
+        WHERE invoices.search_vector @@ query AND invoices.owner_id = :owner_id
+        ORDER BY rank DESC
+        LIMIT :limit
+    ) AS top
+    JOIN invoices ON invoices.id = top.id
+    ORDER BY top.rank DESC
+"""
+
+def create_search_index(bind: Engine) -> None:
+    """Create the full-text index if it does not exist yet"""
+    with bind.begin() as connection:
+        dialect = connection.dialect.name
+        if dialect == "sqlite":
+            existed = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'invoices_fts'")
+            ).first() is not None
+            for statement in SQLITE_SEARCH_DDL:
+                connection.execute(text(statement))
+            # Index the invoices that predate the search table
+            if not existed:
+                rebuild_search_index(connection)
+        elif dialect == "postgresql":
+            for statement in POSTGRESQL_SEARCH_DDL:
+                connection.execute(text(statement))
+
+def rebuild_search_index(connection: Connection) -> None:
+    # PostgreSQL's generated column never needs rebuilding
+    if connection.dialect.name == "sqlite":
+        connection.execute(text("INSERT INTO invoices_fts (invoices_fts) VALUES ('rebuild')"))
+
+def fts5_query(query: str) -> str:
+    """Turn free text into an FTS5 query matching all words, the last as a prefix"""
+    words = re.findall(r"\w+", query)
+    if not words:
+        return ""
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+def sqlite_owner_query(query: str, owner_id: int) -> str:
+    """Restrict an FTS5 query to the text columns of one user's invoices"""
+    return f'owner_id : "{int(owner_id)}" AND {{vendor_name client_name invoice_number ocr_text}} : ({query})'
+
+def search_invoices(
+    db: Session, owner_id: int, query: str, limit: int = 20
+) -> List[Tuple[models.Invoice, float, Optional[str]]]:
+    """Return (invoice, rank, snippet) for the best matches, best first"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        terms = fts5_query(query)
+        query = sqlite_owner_query(terms, owner_id) if terms else ""
+        statement = SQLITE_SEARCH_QUERY
+    elif dialect == "postgresql":
+        statement = POSTGRESQL_SEARCH_QUERY
+    else:
+        raise NotImplementedError(f"Full-text search is not supported on {dialect}")
+
+    if not query.strip():
+        return []
+
+    hits = db.execute(text(statement), {"query": query, "owner_id": owner_id, "limit": limit}).all()
+    invoices = {
+        invoice.id: invoice
+        for invoice in db.query(models.Invoice)
+        .filter(models.Invoice.owner_id == owner_id)
+        .filter(models.Invoice.id.in_([hit.id for hit in hits]))
+    }
+
+    # bm25() scores better matches lower, flip it so higher is better everywhere
+    sign = -1 if dialect == "sqlite" else 1
+    return [(invoices[hit.id], sign * hit.rank, hit.snippet) for hit in hits if hit.id in invoices]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintain the invoice full-text index")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+
+    # Imported here, app.migrations creates the index with this module
+    from .migrations import upgrade_database
+    upgrade_database(engine)
+    with engine.begin() as connection:
+        rebuild_search_index(connection)
+    print("Search index rebuilt")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Content-addressed cache of invoice extraction results.
+
+Entries are keyed by the SHA-256 of the uploaded file plus the processor
+version, so re-uploads of the same invoice skip OCR and the LLM entirely.
+Results live in a local SQLite file shared by all worker processes; entries
+are evicted once they exceed ``EXTRACTION_CACHE_MAX_AGE_DAYS`` or, least
+recently used first, once the cache grows past ``EXTRACTION_CACHE_MAX_BYTES``.
+Hit/miss counters are stored alongside so they add up across processes.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", "./extraction_cache.db")
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+EXTRACTION_CACHE_MAX_AGE_DAYS = float(os.getenv("EXTRACTION_CACHE_MAX_AGE_DAYS", "30"))
+
+def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ExtractionCache:
+    def __init__(
+        self,
+        path: str = EXTRACTION_CACHE_PATH,
+        max_bytes: int = EXTRACTION_CACHE_MAX_BYTES,
+        max_age_days: float = EXTRACTION_CACHE_MAX_AGE_DAYS,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 24 * 60 * 60
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections are opened lazily so the cache can be created before
+        # forking worker processes
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, data TEXT NOT NULL, size INTEGER NOT NULL, "
+                "elapsed REAL NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_last_used ON entries (last_used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+            self._conn = conn
+        return self._conn
+
+    def _increment(self, conn: sqlite3.Connection, name: str, amount: float = 1) -> None:
+        conn.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached extraction for key, counting the hit or miss"""
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute("SELECT data, elapsed, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+
+        if row is not None and now - row[2] > self.max_age:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            row = None
+
+        if row is None:
+            self._increment(conn, "misses")
+            return None
+
+        conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+        self._increment(conn, "hits")
+        # Time the original OCR + extraction took, i.e. what this hit saved
+        self._increment(conn, "saved_seconds", row[1])
+        return json.loads(row[0])
+
+    def set(self, key: str, data: Dict[str, Any], elapsed: float) -> None:
+        """Store an extraction result that took elapsed seconds to compute"""
+        conn = self._connect()
+        payload = json.dumps(data)
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, data, size, elapsed, created_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, payload, len(payload), elapsed, now, now),
+        )
+        self.evict()
+
+    def evict(self) -> int:
+        """Drop expired entries, then least recently used ones beyond max_bytes"""
+        conn = self._connect()
+        removed = conn.execute("DELETE FROM entries WHERE created_at < ?", (time.time() - self.max_age,)).rowcount
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total > self.max_bytes:
+            excess = total - self.max_bytes
+            stale = []
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_used"):
+                stale.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+            removed += len(stale)
+
+        if removed:
+            self._increment(conn, "evictions", removed)
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        counters = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        hits = int(counters.get("hits", 0))
+        misses = int(counters.get("misses", 0))
+
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) * 100 if hits + misses else 0.0,
+            "saved_seconds": counters.get("saved_seconds", 0.0),
+            "evictions": int(counters.get("evictions", 0)),
+            "entries": entries,
+            "size_bytes": size,
+        }
+
+    def clear(self) -> None:
+        conn = self._connect()
+        conn.execute("DELETE FROM entries")
+        conn.execute("DELETE FROM stats")
@@ -1,165 +1,282 @@
-import pytesseract
 from PIL import Image
 import cv2
 import numpy as np
-from pdf2image import convert_from_path
-import re
 from datetime import datetime
-import openai
-from typing import Dict, Any, Union
+from typing import Dict, Any, List, NamedTuple, Optional, Union
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
+from .. import duplicates, metrics
+from .ml_bridge import ml_field_extraction, ml_tesseract_pool
+from .ocr_engine import OCR, OCR_WORKERS, PDF_DPI, OCREngine
+from .preprocessing import Preprocessor
+from .extraction_cache import EXTRACTION_CACHE_ENABLED, ExtractionCache, hash_file
+from .llm_client import LLMClient, Messages
+from .prompt_compaction import CompactedText, compact_text, count_tokens
+from .tiered_extraction import (
+    FIELD_DESCRIPTIONS, FIELDS, Fields, TieredExtractor, field_sources, merge_llm_fields, to_invoice_data
+)
 
 load_dotenv()
 
-# Configure OpenAI
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Bump whenever OCR, prompt or parsing changes alter extraction results, so
+# cached results from older versions are no longer used
+PROCESSOR_VERSION = "7"
+
+SYSTEM_PROMPT = "You are an AI trained to extract information from invoices. Reply with JSON only."
+
+EXTRACTION_PROMPT = """
+Extract the following information from this invoice text. Return a JSON object
+with exactly these keys, using null for anything that is not on the invoice:
+{fields}
+Invoice text:
+"""
+
+class Extraction(NamedTuple):
+    data: Dict[str, Any]
+    sources: Dict[str, Dict[str, Any]]
+    ocr_tokens: int
+    prompt_tokens: int
+    # False when the LLM was needed but failed, so a re-upload retries it
+    cacheable: bool
+
+def record_analysis(result: Dict[str, Any]) -> None:
+    """Record the stage timings, cache lookup and errors of an analyze_invoice result"""
+    # Results may come from a pool process, whose own metrics nobody reads
+    metrics.observe_stages(result.get("timings"))
+    if result.get("cache_key") is not None:
+        metrics.record_cache("extraction", result["cached"])
+    if not result["success"]:
+        metrics.ERRORS.inc(source="ocr")
+
+def extraction_messages(text: str, fields: List[str] = FIELDS) -> Messages:
+    keys = "".join(f"- {field}: {FIELD_DESCRIPTIONS[field]}\n" for field in fields)
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": EXTRACTION_PROMPT.format(fields=keys) + text}
+    ]
 
 class InvoiceProcessor:
-    def __init__(self):
-        self.date_patterns = [
-            r'\d{2}/\d{2}/\d{4}',
-            r'\d{2}-\d{2}-\d{4}',
-            r'\d{4}/\d{2}/\d{2}',
-            r'\d{4}-\d{2}-\d{2}',
-        ]
-        self.amount_pattern = r'\$\s*\d+(?:,\d{3})*(?:\.\d{2})?'
-        self.email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
+    def __init__(self, ocr_workers: int = OCR_WORKERS):
+        self.preprocessor = Preprocessor()
+        # Rendering above the resolution preprocessing scales down to is wasted
+        target_dpi = self.preprocessor.config.target_dpi
+        self.ocr_engine = OCREngine(preprocess=self.preprocessor, max_workers=ocr_workers,
+                                    dpi=min(PDF_DPI, target_dpi) if target_dpi else PDF_DPI)
+        self.cache = ExtractionCache() if EXTRACTION_CACHE_ENABLED else None
+        self.tiered = TieredExtractor(self.extract_information_with_regex)
 
     def preprocess_image(self, image: np.ndarray) -> np.ndarray:
         """Preprocess the image for better OCR results"""
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Apply thresholding
-        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        
-        # Denoise
-        denoised = cv2.fastNlMeansDenoising(binary)
-        
-        return denoised
+        # Steps and options are configured by PREPROCESS_PRESET
+        return self.preprocessor(image)
 
-    def extract_text_from_image(self, image_path: str) -> str:
+    def extract_text_from_image(self, image_path: str, timings: Optional[Dict[str, float]] = None) -> str:
         """Extract text from image using OCR"""
+        timings = {} if timings is None else timings
         # Read image
-        image = cv2.imread(image_path)
-        
+        with metrics.timed(timings, "image_read"):
+            image = cv2.imread(image_path)
+        return self.ocr_image(image, timings)
+
+    def ocr_image(self, image: np.ndarray, timings: Optional[Dict[str, float]] = None) -> str:
+        """Preprocess and OCR an image that is already loaded"""
+        timings = {} if timings is None else timings
         # Preprocess
-        processed_image = self.preprocess_image(image)
+        with metrics.timed(timings, "preprocess"):
+            processed_image = self.preprocess_image(image)
         
         # Perform OCR
-        text = pytesseract.image_to_string(processed_image)
+        with metrics.timed(timings, "ocr"):
+            text = ml_tesseract_pool.image_to_string(processed_image)
         
         return text
 
     def extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Extract text from PDF by converting to images first"""
-        # Convert PDF to images
-        images = convert_from_path(pdf_path)
-        
-        # Extract text from each image
-        text = ""
-        for image in images:
-            # Convert PIL image to numpy array
-            image_np = np.array(image)
-            
-            # Preprocess and extract text
-            processed_image = self.preprocess_image(image_np)
-            text += pytesseract.image_to_string(processed_image)
-            text += "\n"
-        
-        return text
+        """Extract text from PDF, reading the text layer where there is one"""
+        # Scanned pages are rendered in chunks and OCR'd in parallel
+        return self.ocr_engine.extract_text_from_pdf(pdf_path)
 
     def extract_information_with_ai(self, text: str) -> Dict[str, Any]:
-        """Use OpenAI's GPT to extract structured information from invoice text"""
-        prompt = f"""
-        Extract the following information from this invoice text. Return a JSON object:
-        - Invoice number
-        - Date
-        - Due date
-        - Amount
-        - Tax amount
-        - Total amount
-        - Vendor information (name, address, email)
-        - Client information (name, address, email)
-
-        Invoice text:
-        {text}
-        """
-
+        """Use an LLM to extract structured information from invoice text"""
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are an AI trained to extract information from invoices."},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            # Parse the response
-            extracted_info = eval(response.choices[0].message.content)
-            return extracted_info
-        
+            return self._extract_with_ai(text)
         except Exception as e:
             print(f"Error in AI extraction: {str(e)}")
+            metrics.LLM_FALLBACKS.inc()
             return self.extract_information_with_regex(text)
 
-    def extract_information_with_regex(self, text: str) -> Dict[str, Any]:
+    def compact_text(self, text: str) -> CompactedText:
+        """Cut the OCR text down to the regions the LLM needs"""
+        return compact_text(text, candidates=self.regex_candidates(text))
+
+    def _extract_with_ai(self, text: str) -> Dict[str, Any]:
+        async def extract():
+            async with LLMClient() as llm:
+                return await llm.complete_json(extraction_messages(self.compact_text(text).text))
+
+        with metrics.STAGE_SECONDS.time(stage="llm"):
+            reply = asyncio.run(extract())
+        return to_invoice_data(merge_llm_fields({}, reply, FIELDS))
+
+    async def complete_extraction(self, text: str, fields: Fields, llm: LLMClient) -> Extraction:
+        """Ask the LLM for the fields the cheap tiers are unsure of, if any"""
+        requested = self.tiered.fields_for_llm(fields)
+        if not requested:
+            return Extraction(to_invoice_data(fields), field_sources(fields), count_tokens(text), 0, True)
+
+        with metrics.STAGE_SECONDS.time(stage="prompt_compaction"):
+            prompt = self.compact_text(text)
+        try:
+            with metrics.STAGE_SECONDS.time(stage="llm"):
+                reply = await llm.complete_json(extraction_messages(prompt.text, requested))
+        except Exception as e:
+            print(f"Error in AI extraction: {str(e)}")
+            metrics.LLM_FALLBACKS.inc()
+            return Extraction(to_invoice_data(fields), field_sources(fields),
+                              prompt.tokens_before, prompt.tokens_after, False)
+
+        fields = merge_llm_fields(fields, reply, requested)
+        return Extraction(to_invoice_data(fields), field_sources(fields),
+                          prompt.tokens_before, prompt.tokens_after, True)
+
+    def regex_candidates(self, text: str) -> List[str]:
+        """The raw matches extract_information_with_regex takes its fields from"""
+        candidates = ml_field_extraction.scan(text)
+        dates, amounts, emails = candidates.dates, candidates.amounts, candidates.emails
+        return [candidate.text for candidate in dates[:2] + amounts[:2] + amounts[-1:] + emails[:2]]
+
+    def extract_information_with_regex(self, text: str, candidates=None) -> Dict[str, Any]:
         """Fallback method to extract information using regex patterns"""
-        # Find dates
-        dates = []
-        for pattern in self.date_patterns:
-            dates.extend(re.findall(pattern, text))
-        
-        # Find amounts
-        amounts = re.findall(self.amount_pattern, text)
-        
-        # Find emails
-        emails = re.findall(self.email_pattern, text)
+        # Dates, amounts with a currency and emails in document order, from one scan
+        candidates = candidates or ml_field_extraction.scan(text)
+        dates, amounts, emails = candidates.dates, candidates.amounts, candidates.emails
         
         return {
             "invoice_number": None,  # Need more sophisticated pattern matching
-            "date": dates[0] if dates else None,
-            "due_date": dates[1] if len(dates) > 1 else None,
-            "amount": self.parse_amount(amounts[0]) if amounts else None,
-            "tax": self.parse_amount(amounts[1]) if len(amounts) > 1 else None,
-            "total": self.parse_amount(amounts[-1]) if amounts else None,
+            "date": dates[0].value.strftime("%Y-%m-%d") if dates else None,
+            "due_date": dates[1].value.strftime("%Y-%m-%d") if len(dates) > 1 else None,
+            "amount": amounts[0].value if amounts else None,
+            "tax": amounts[1].value if len(amounts) > 1 else None,
+            "total": amounts[-1].value if amounts else None,
             "vendor_info": {
-                "email": emails[0] if emails else None
+                "email": emails[0].text if emails else None
             },
             "client_info": {
-                "email": emails[1] if len(emails) > 1 else None
+                "email": emails[1].text if len(emails) > 1 else None
             }
         }
 
-    def parse_amount(self, amount_str: str) -> float:
-        """Convert amount string to float"""
-        try:
-            return float(amount_str.replace('$', '').replace(',', ''))
-        except:
-            return 0.0
+    def cache_key(self, file_hash: str) -> str:
+        return f"{PROCESSOR_VERSION}:{file_hash}"
 
-    def process_invoice(self, file_path: str) -> Dict[str, Any]:
-        """Main method to process an invoice"""
+    def store_result(self, key: Optional[str], extraction: Extraction, text: str, elapsed: float,
+                     image_hash: Optional[str] = None) -> None:
+        # Results the LLM failed to complete are not cached so they are
+        # retried once it is reachable again
+        if self.cache is not None and key is not None and extraction.cacheable:
+            with metrics.STAGE_SECONDS.time(stage="cache_store"):
+                self.cache.set(key, {"data": extraction.data, "sources": extraction.sources, "text": text,
+                                     "image_hash": image_hash}, elapsed)
+
+    def ocr_invoice(self, file_path: str, file_hash: Optional[str] = None) -> Dict[str, Any]:
+        """Read the text of an invoice, or its whole cached result if known"""
+        # Seconds per stage, recorded by whoever receives the result (see record_analysis)
+        timings: Dict[str, float] = {}
         try:
+            # Re-uploads of a known file skip OCR and the LLM
+            key = None
+            if self.cache is not None:
+                with metrics.timed(timings, "cache_lookup"):
+                    key = self.cache_key(file_hash or hash_file(file_path))
+                    cached = self.cache.get(key)
+                if cached is not None:
+                    return {
+                        "success": True,
+                        "data": cached["data"],
+                        "field_sources": cached.get("sources"),
+                        "text": cached["text"],
+                        "image_hash": cached.get("image_hash"),
+                        "error": None,
+                        "cached": True,
+                        "cache_key": key,
+                        "elapsed": 0.0,
+                        "timings": timings
+                    }
+
+            start = time.perf_counter()
+
             # Extract text based on file type
+            image_hash = None
             if file_path.lower().endswith('.pdf'):
-                text = self.extract_text_from_pdf(file_path)
+                pdf = self.ocr_engine.extract_pdf(file_path)
+                text, pages = pdf.text, pdf.page_stats()
+                timings.update(pdf.stage_seconds())
+                if duplicates.DUPLICATE_DETECTION:
+                    with metrics.timed(timings, "image_hash"):
+                        image_hash = duplicates.image_hash(self.ocr_engine.render_thumbnail(file_path))
             else:
-                text = self.extract_text_from_image(file_path)
+                with metrics.timed(timings, "image_read"):
+                    image = cv2.imread(file_path)
+                text = self.ocr_image(image, timings)
+                pages = [{"page": 1, "method": OCR, "seconds": round(time.perf_counter() - start, 4)}]
+                if duplicates.DUPLICATE_DETECTION:
+                    with metrics.timed(timings, "image_hash"):
+                        image_hash = duplicates.image_hash(image)
 
-            # Try AI extraction first, fallback to regex
-            extracted_info = self.extract_information_with_ai(text)
-            
             return {
                 "success": True,
-                "data": extracted_info,
-                "error": None
+                "data": None,
+                "text": text,
+                "pages": pages,
+                "image_hash": image_hash,
+                "error": None,
+                "cached": False,
+                "cache_key": key,
+                "elapsed": time.perf_counter() - start,
+                "timings": timings
             }
-        
+
         except Exception as e:
             return {
                 "success": False,
                 "data": None,
-                "error": str(e)
+                "text": None,
+                "error": str(e),
+                "cached": False,
+                "cache_key": None,
+                "elapsed": 0.0,
+                "timings": timings
             }
+
+    def analyze_invoice(self, file_path: str, file_hash: Optional[str] = None) -> Dict[str, Any]:
+        """OCR an invoice and run the cheap extraction tiers on its text"""
+        result = self.ocr_invoice(file_path, file_hash)
+        if result["success"] and not result["cached"]:
+            start = time.perf_counter()
+            result["fields"] = self.tiered.extract(result["text"])
+            seconds = time.perf_counter() - start
+            result["timings"]["extraction"] = seconds
+            result["elapsed"] += seconds
+        return result
+
+    def process_invoice(self, file_path: str, file_hash: Optional[str] = None) -> Dict[str, Any]:
+        """Main method to process an invoice"""
+        result = self.analyze_invoice(file_path, file_hash)
+        record_analysis(result)
+        if not result["success"] or result["cached"]:
+            return result
+
+        # Cheap tiers first, the LLM only for what they are unsure of
+        async def extract():
+            async with LLMClient() as llm:
+                return await self.complete_extraction(result["text"], result["fields"], llm)
+
+        start = time.perf_counter()
+        extraction = asyncio.run(extract())
+        self.store_result(result["cache_key"], extraction, result["text"],
+                          result["elapsed"] + time.perf_counter() - start, result["image_hash"])
+        result["data"] = extraction.data
+        result["field_sources"] = extraction.sources
+        return result
@@ -0,0 +1,209 @@
+"""Async client for LLM chat completions.
+
+All calls from a process share one ``LLMClient``. It bounds the number of
+requests in flight (``LLM_MAX_CONCURRENCY``) and paces them with a token
+bucket (``LLM_REQUESTS_PER_MINUTE``), so batch throughput is limited by the
+provider's rate limit rather than by sequential round trips. Timeouts,
+HTTP 429 and 5xx replies are retried with jittered exponential backoff, and
+replies are parsed as strict JSON.
+
+The transport is pluggable through ``LLM_BACKEND``:
+
+- ``http`` (default) posts to any OpenAI-compatible ``/chat/completions``
+  endpoint at ``LLM_BASE_URL``, including a local stand-in server for tests
+  and CI
+- ``openai`` uses the official ``openai`` package (>= 1.0), which must be
+  installed separately
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+load_dotenv()
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "http")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.openai.com/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# 0 disables rate limiting
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "60"))
+LLM_BURST = int(os.getenv("LLM_BURST", str(LLM_MAX_CONCURRENCY)))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_RETRY_MAX_WAIT = float(os.getenv("LLM_RETRY_MAX_WAIT", "30"))
+
+Messages = List[Dict[str, str]]
+
+class LLMError(Exception):
+    pass
+
+class LLMUnavailable(LLMError):
+    """A transient failure (timeout, rate limit, server error) worth retrying"""
+
+class LLMResponseError(LLMError):
+    """The backend answered, but not with something usable"""
+
+class TokenBucket:
+    """Async token bucket refilled at `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        # Waiters are served in arrival order
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+class HTTPBackend:
+    """OpenAI-compatible chat completions over plain HTTP"""
+
+    def __init__(self, base_url: str = LLM_BASE_URL, api_key: Optional[str] = OPENAI_API_KEY,
+                 model: str = LLM_MODEL):
+        self.model = model
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        # Timeouts are enforced per call by LLMClient
+        self._client = httpx.AsyncClient(base_url=base_url.rstrip("/"), headers=headers, timeout=None)
+
+    async def complete(self, messages: Messages) -> str:
+        try:
+            response = await self._client.post(
+                "/chat/completions",
+                json={"model": self.model, "messages": messages, "temperature": 0},
+            )
+        except httpx.TransportError as e:
+            raise LLMUnavailable(f"LLM request failed: {e}")
+
+        if response.status_code == 429 or response.status_code >= 500:
+            raise LLMUnavailable(f"LLM backend returned HTTP {response.status_code}")
+        if response.status_code >= 400:
+            raise LLMError(f"LLM backend returned HTTP {response.status_code}: {response.text[:200]}")
+        try:
+            return response.json()["choices"][0]["message"]["content"]
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise LLMResponseError(f"Unexpected LLM response: {e}")
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+class OpenAIBackend:
+    """Chat completions through the official openai package"""
+
+    def __init__(self, base_url: str = LLM_BASE_URL, api_key: Optional[str] = OPENAI_API_KEY,
+                 model: str = LLM_MODEL):
+        import openai
+
+        self._openai = openai
+        self.model = model
+        # Retries are handled by LLMClient
+        self._client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+
+    async def complete(self, messages: Messages) -> str:
+        openai = self._openai
+        try:
+            response = await self._client.chat.completions.create(
+                model=self.model, messages=messages, temperature=0
+            )
+        except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+            raise LLMUnavailable(f"LLM request failed: {e}")
+        except openai.APIError as e:
+            raise LLMError(str(e))
+        content = response.choices[0].message.content
+        if content is None:
+            raise LLMResponseError("LLM returned an empty reply")
+        return content
+
+    async def aclose(self) -> None:
+        await self._client.close()
+
+BACKENDS = {
+    "http": HTTPBackend,
+    "openai": OpenAIBackend,
+}
+
+def create_backend(name: str = LLM_BACKEND):
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown LLM backend {name!r}, expected one of {', '.join(BACKENDS)}")
+    return backend_class()
+
+def parse_json_reply(content: str) -> Dict[str, Any]:
+    """Parse a reply as a JSON object, allowing a surrounding Markdown code fence"""
+    match = re.fullmatch(r"\s*```(?:json)?\s*(.*?)\s*```\s*", content, re.DOTALL)
+    if match:
+        content = match.group(1)
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError as e:
+        raise LLMResponseError(f"LLM reply is not valid JSON: {e}")
+    if not isinstance(data, dict):
+        raise LLMResponseError("LLM reply is not a JSON object")
+    return data
+
+class LLMClient:
+    """Concurrency-limited, rate-limited and retrying LLM client"""
+
+    def __init__(self, backend=None, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 requests_per_minute: float = LLM_REQUESTS_PER_MINUTE, burst: int = LLM_BURST,
+                 timeout: float = LLM_TIMEOUT, max_retries: int = LLM_MAX_RETRIES):
+        self.backend = backend or create_backend()
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.max_retries = max(0, max_retries)
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._bucket = TokenBucket(requests_per_minute / 60.0, burst)
+
+    async def __aenter__(self) -> "LLMClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self.backend.aclose()
+
+    async def complete(self, messages: Messages) -> str:
+        """Return the reply text, retrying transient failures"""
+        retrying = AsyncRetrying(
+            retry=retry_if_exception_type(LLMUnavailable),
+            wait=wait_random_exponential(multiplier=0.5, max=LLM_RETRY_MAX_WAIT),
+            stop=stop_after_attempt(self.max_retries + 1),
+            reraise=True,
+        )
+        async for attempt in retrying:
+            with attempt:
+                return await self._call(messages)
+
+    async def complete_json(self, messages: Messages) -> Dict[str, Any]:
+        return parse_json_reply(await self.complete(messages))
+
+    async def _call(self, messages: Messages) -> str:
+        # The slot is only held for the request itself, not during backoff
+        async with self._slots:
+            await self._bucket.acquire()
+            try:
+                return await asyncio.wait_for(self.backend.complete(messages), self.timeout)
+            except asyncio.TimeoutError:
+                raise LLMUnavailable(f"LLM request timed out after {self.timeout}s")
@@ -0,0 +1,21 @@
+"""Access to the shared extraction code in the repository's ``ml`` directory.
+
+``ml`` is a plain directory of modules rather than an installable package, so
+it is appended to ``sys.path`` (``ML_PATH`` overrides its location) and its
+modules are imported here. Backend code imports them from this module only.
+"""
+import os
+import sys
+
+ML_PATH = os.getenv(
+    "ML_PATH",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "ml")),
+)
+
+if ML_PATH not in sys.path:
+    sys.path.append(ML_PATH)
+
+import field_extraction as ml_field_extraction  # noqa: E402
+import invoice_processor as ml_invoice_processor  # noqa: E402
+import model_registry as ml_model_registry  # noqa: E402
+import tesseract_pool as ml_tesseract_pool  # noqa: E402
@@ -0,0 +1,257 @@
+"""Text extraction for multi-page PDFs.
+
+Most invoices are generated digitally and carry a text layer. When PyMuPDF
+is installed, every page's text layer is read directly, together with the
+position of every word, and only pages without a usable text layer (scans,
+or pages whose fonts do not map to text) are rendered and OCR'd. Without
+PyMuPDF every page is OCR'd.
+
+Pages to OCR are rendered one at a time by PyMuPDF, or in small chunks by
+pdf2image with ``first_page``/``last_page``, so only a bounded number of
+page images is held in memory, and each page is preprocessed and recognised
+in a process pool. Page texts are reassembled in page order, and the method
+and time spent are recorded for every page, split into stages (text layer,
+render, preprocess, OCR) for ``app.metrics``.
+
+OCR goes through ``ml/tesseract_pool.py``: with tesserocr installed each
+pool process loads the Tesseract model once and receives page images in
+memory, instead of starting ``tesseract`` with temporary files per page.
+
+Invoice workers (``app.worker``) each own an engine and split the CPUs with
+it: every worker pool process gets ``cpu_count // INVOICE_WORKERS`` OCR
+processes at most (see ``ocr_workers_per_process``), so both pools together
+do not start more Tesseract processes than there are CPUs.
+"""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+from .ml_bridge import ml_tesseract_pool
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+def ocr_workers_per_process(processes: int, max_workers: int = OCR_WORKERS) -> int:
+    """OCR pool size for each of processes parallel engines, sharing the CPUs between them"""
+    return max(1, min(max_workers, (os.cpu_count() or 1) // max(1, processes)))
+
+PDF_RENDER_CHUNK = int(os.getenv("PDF_RENDER_CHUNK", "4"))
+PDF_DPI = int(os.getenv("PDF_DPI", "200"))
+# Resolution of first page thumbnails, e.g. for duplicate detection
+PDF_THUMBNAIL_DPI = int(os.getenv("PDF_THUMBNAIL_DPI", "50"))
+# Set to false to OCR every page even when it has a text layer
+PDF_TEXT_LAYER = os.getenv("PDF_TEXT_LAYER", "true").lower() == "true"
+# A text layer with fewer letters and digits than this is treated as a scan
+PDF_TEXT_MIN_CHARS = int(os.getenv("PDF_TEXT_MIN_CHARS", "20"))
+# Share of characters that may be unmapped glyphs before the text layer is distrusted
+PDF_TEXT_MAX_UNREADABLE = float(os.getenv("PDF_TEXT_MAX_UNREADABLE", "0.1"))
+
+TEXT_LAYER = "text"
+OCR = "ocr"
+
+# x0, y0, x1, y1 in PDF points from the top left corner of the page, and the word
+Word = Tuple[float, float, float, float, str]
+
+class PageText(NamedTuple):
+    index: int
+    method: str
+    text: str
+    seconds: float
+    # Only known for pages read from the text layer
+    words: Optional[List[Word]] = None
+    # Seconds per stage, adding up to seconds
+    timings: Optional[Dict[str, float]] = None
+
+class PDFText(NamedTuple):
+    text: str
+    pages: List[PageText]
+
+    def page_stats(self) -> List[Dict[str, object]]:
+        """Method and time spent per page, without the page contents"""
+        return [
+            {"page": page.index + 1, "method": page.method, "seconds": round(page.seconds, 4)}
+            for page in self.pages
+        ]
+
+    def stage_seconds(self) -> Dict[str, float]:
+        """Seconds per stage over all pages"""
+        timings: Dict[str, float] = {}
+        for page in self.pages:
+            for stage, seconds in (page.timings or {}).items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+        return timings
+
+def ocr_page(preprocess: Callable[[np.ndarray], np.ndarray], image: np.ndarray) -> Tuple[str, Dict[str, float]]:
+    """Preprocess and OCR a single page image and time both (executed in a pool process)"""
+    start = time.perf_counter()
+    processed = preprocess(image)
+    preprocessed = time.perf_counter()
+    text = ml_tesseract_pool.image_to_string(processed)
+    return text, {"preprocess": preprocessed - start, "ocr": time.perf_counter() - preprocessed}
+
+def usable_text_layer(text: str, min_chars: int = PDF_TEXT_MIN_CHARS,
+                      max_unreadable: float = PDF_TEXT_MAX_UNREADABLE) -> bool:
+    """Whether a page's embedded text is worth using instead of OCR"""
+    readable = sum(char.isalnum() for char in text)
+    if readable < min_chars:
+        return False
+    # Fonts without a Unicode mapping come out as U+FFFD
+    unreadable = text.count("\ufffd")
+    return unreadable <= max_unreadable * (readable + unreadable)
+
+def read_text_layer(page) -> Tuple[str, List[Word]]:
+    """Text of a PyMuPDF page in reading order, and the position of every word"""
+    words = [
+        (round(x0, 1), round(y0, 1), round(x1, 1), round(y1, 1), word)
+        for x0, y0, x1, y1, word, *_ in page.get_text("words", sort=True)
+    ]
+    # Tesseract ends every page with a form feed, keep the same page separators
+    return page.get_text("text", sort=True).rstrip("\n") + "\n\f", words
+
+class OCREngine:
+    def __init__(
+        self,
+        preprocess: Callable[[np.ndarray], np.ndarray],
+        max_workers: int = OCR_WORKERS,
+        chunk_size: int = PDF_RENDER_CHUNK,
+        dpi: int = PDF_DPI,
+        text_layer: bool = PDF_TEXT_LAYER,
+    ):
+        # preprocess must be picklable, e.g. a module-level function
+        self.preprocess = preprocess
+        self.max_workers = max(1, max_workers)
+        self.chunk_size = max(1, chunk_size)
+        self.dpi = dpi
+        self.text_layer = text_layer and pymupdf is not None
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.max_workers == 1:
+            return None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             initializer=ml_tesseract_pool.init_worker)
+        return self._pool
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def page_count(self, pdf_path: str) -> int:
+        if pymupdf is not None:
+            with pymupdf.open(pdf_path) as document:
+                return document.page_count
+        return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+    def read_text_layers(self, pdf_path: str) -> Tuple[Dict[int, PageText], List[int]]:
+        """Pages with a usable text layer, and the indexes of the pages that need OCR"""
+        pages: Dict[int, PageText] = {}
+        scanned: List[int] = []
+        with pymupdf.open(pdf_path) as document:
+            for index, page in enumerate(document):
+                start = time.perf_counter()
+                text, words = read_text_layer(page)
+                if usable_text_layer(text):
+                    seconds = time.perf_counter() - start
+                    pages[index] = PageText(index, TEXT_LAYER, text, seconds, words, {"pdf_text_layer": seconds})
+                else:
+                    scanned.append(index)
+        return pages, scanned
+
+    def render_pages(self, pdf_path: str, indexes: Iterable[int]):
+        """Yield (page_index, image, render_seconds) for the given pages"""
+        indexes = sorted(indexes)
+        if pymupdf is not None:
+            with pymupdf.open(pdf_path) as document:
+                for index in indexes:
+                    start = time.perf_counter()
+                    pixmap = document[index].get_pixmap(dpi=self.dpi, colorspace=pymupdf.csRGB, alpha=False)
+                    image = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width, 3)
+                    yield index, image, time.perf_counter() - start
+            return
+
+        position = 0
+        while position < len(indexes):
+            # Consecutive pages are rendered together, up to chunk_size of them
+            end = position + 1
+            while (end < len(indexes) and end - position < self.chunk_size
+                   and indexes[end] == indexes[end - 1] + 1):
+                end += 1
+            start = time.perf_counter()
+            images = convert_from_path(pdf_path, dpi=self.dpi,
+                                       first_page=indexes[position] + 1, last_page=indexes[end - 1] + 1)
+            seconds = (time.perf_counter() - start) / max(1, len(images))
+            for offset, image in enumerate(images):
+                yield indexes[position] + offset, np.array(image), seconds
+            position = end
+
+    def render_thumbnail(self, pdf_path: str, index: int = 0, dpi: int = PDF_THUMBNAIL_DPI) -> np.ndarray:
+        """Render one page in grey at a low resolution"""
+        if pymupdf is not None:
+            with pymupdf.open(pdf_path) as document:
+                pixmap = document[index].get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY, alpha=False)
+                return np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width)
+        images = convert_from_path(pdf_path, dpi=dpi, first_page=index + 1, last_page=index + 1, grayscale=True)
+        return np.array(images[0])
+
+    def render_chunks(self, pdf_path: str):
+        """Yield (page_index, image) pairs for every page, rendering chunk_size pages at a time"""
+        for index, image, _ in self.render_pages(pdf_path, range(self.page_count(pdf_path))):
+            yield index, image
+
+    def ocr_pages(self, pdf_path: str, indexes: List[int]) -> Dict[int, PageText]:
+        """Render and OCR the given pages"""
+        pool = self._get_pool()
+        pages: Dict[int, PageText] = {}
+        render_seconds: Dict[int, float] = {}
+
+        def add(index: int, text: str, timings: Dict[str, float]) -> None:
+            timings = {"pdf_render": render_seconds.pop(index), **timings}
+            pages[index] = PageText(index, OCR, text, sum(timings.values()), timings=timings)
+
+        if pool is None:
+            for index, image, seconds in self.render_pages(pdf_path, indexes):
+                render_seconds[index] = seconds
+                add(index, *ocr_page(self.preprocess, image))
+        else:
+            # Cap the number of rendered pages waiting for a worker
+            max_pending = self.max_workers * 2
+            pending: Dict[Future, int] = {}
+
+            def collect(futures) -> None:
+                for future in futures:
+                    add(pending.pop(future), *future.result())
+
+            for index, image, seconds in self.render_pages(pdf_path, indexes):
+                if len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                render_seconds[index] = seconds
+                pending[pool.submit(ocr_page, self.preprocess, image)] = index
+
+            collect(list(pending))
+        return pages
+
+    def extract_pdf(self, pdf_path: str) -> PDFText:
+        """Read every page of a PDF from its text layer or, failing that, with OCR"""
+        if self.text_layer:
+            pages, scanned = self.read_text_layers(pdf_path)
+        else:
+            pages, scanned = {}, list(range(self.page_count(pdf_path)))
+        if scanned:
+            pages.update(self.ocr_pages(pdf_path, scanned))
+
+        ordered = [pages[index] for index in sorted(pages)]
+        return PDFText("".join(page.text + "\n" for page in ordered), ordered)
+
+    def extract_text_from_pdf(self, pdf_path: str) -> str:
+        """Return the page texts of a PDF in order"""
+        return self.extract_pdf(pdf_path).text
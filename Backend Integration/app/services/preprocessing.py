@@ -0,0 +1,155 @@
+"""Configurable image preprocessing before OCR.
+
+A page image goes through these steps, each of which can be switched off:
+
+1. grayscale conversion
+2. downscaling to ``target_dpi``; Tesseract reads 200-300 DPI text as well
+   as higher resolutions, and every later step is cheaper on fewer pixels
+3. deskewing by the angle of the text block
+4. binarization with a global Otsu threshold or an adaptive threshold,
+   which copes better with uneven lighting and shadows in photos
+5. a median blur and a morphological open or close on the binary image to
+   remove speckles or close broken strokes
+6. ``cv2.fastNlMeansDenoising``, which is slow and kept for comparison
+
+``PREPROCESS_PRESET`` selects one of ``PRESETS`` and ``PREPROCESS_<OPTION>``
+variables (e.g. ``PREPROCESS_TARGET_DPI=250``) override single options.
+``benchmarks/bench_preprocessing.py`` compares the presets' throughput and
+OCR accuracy.
+
+Image files carry no reliable resolution, so their DPI is estimated from
+the longest side, assuming a Letter-sized page.
+"""
+import os
+from typing import NamedTuple, Optional
+
+import cv2
+import numpy as np
+
+# Longest side of a Letter page in inches, used to estimate the DPI of images
+PAGE_LONG_SIDE_INCHES = 11.0
+# Larger angles are not skew but rotated or unusual layouts
+MAX_SKEW_DEGREES = 10.0
+
+class PreprocessConfig(NamedTuple):
+    # 0 keeps the input resolution
+    target_dpi: int = 0
+    deskew: bool = False
+    # "otsu", "adaptive" or "none"
+    threshold: str = "otsu"
+    adaptive_block_size: int = 31
+    adaptive_c: int = 15
+    # Kernel size, 0 disables
+    median_blur: int = 0
+    # "open" drops ink specks, "close" joins broken strokes, or "none"
+    morphology: str = "none"
+    morphology_kernel: int = 2
+    denoise: bool = False
+
+PRESETS = {
+    # The original pipeline: Otsu and non-local means denoising at full resolution
+    "legacy": PreprocessConfig(threshold="otsu", denoise=True),
+    # The ml/ pipeline: Otsu and a median blur
+    "median": PreprocessConfig(threshold="otsu", median_blur=3),
+    "fast": PreprocessConfig(target_dpi=200, threshold="otsu"),
+    "balanced": PreprocessConfig(target_dpi=300, deskew=True, threshold="otsu", median_blur=3),
+    "photo": PreprocessConfig(target_dpi=300, deskew=True, threshold="adaptive", morphology="open"),
+}
+
+PREPROCESS_PRESET = os.getenv("PREPROCESS_PRESET", "balanced")
+
+def load_config(preset: str = PREPROCESS_PRESET) -> PreprocessConfig:
+    """The preset's options with PREPROCESS_<OPTION> environment overrides applied"""
+    try:
+        config = PRESETS[preset]
+    except KeyError:
+        raise ValueError(f"Unknown preprocessing preset {preset!r}, expected one of {', '.join(PRESETS)}")
+
+    overrides = {}
+    for option, default in config._asdict().items():
+        value = os.getenv(f"PREPROCESS_{option.upper()}")
+        if value is None:
+            continue
+        if isinstance(default, bool):
+            overrides[option] = value.lower() == "true"
+        else:
+            overrides[option] = type(default)(value)
+    return config._replace(**overrides)
+
+def estimate_dpi(image: np.ndarray) -> float:
+    return max(image.shape[:2]) / PAGE_LONG_SIDE_INCHES
+
+def downscale(image: np.ndarray, target_dpi: int, dpi: Optional[float] = None) -> np.ndarray:
+    """Shrink an image to target_dpi; images at or below it are returned unchanged"""
+    scale = target_dpi / (dpi or estimate_dpi(image))
+    if scale >= 1:
+        return image
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+def skew_angle(gray: np.ndarray) -> float:
+    """Angle in degrees of the text block of a grayscale page, 0 if unsure"""
+    # A small copy is enough to measure the angle
+    scale = min(1.0, 1000 / max(gray.shape))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    _, ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    # Merge the characters of a line so the lines, not glyphs, set the angle
+    ink = cv2.dilate(ink, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1)))
+    points = cv2.findNonZero(ink)
+    if points is None or len(points) < 50:
+        return 0.0
+
+    angle = cv2.minAreaRect(points)[2]
+    # minAreaRect reports angles in [0, 90)
+    if angle > 45:
+        angle -= 90
+    return angle if abs(angle) <= MAX_SKEW_DEGREES else 0.0
+
+def deskew(gray: np.ndarray) -> np.ndarray:
+    angle = skew_angle(gray)
+    if abs(angle) < 0.1:
+        return gray
+    height, width = gray.shape
+    rotation = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(gray, rotation, (width, height), flags=cv2.INTER_LINEAR, borderValue=255)
+
+def binarize(gray: np.ndarray, config: PreprocessConfig) -> np.ndarray:
+    if config.threshold == "otsu":
+        return cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+    if config.threshold == "adaptive":
+        # The block size must be odd
+        block_size = config.adaptive_block_size | 1
+        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                     block_size, config.adaptive_c)
+    if config.threshold == "none":
+        return gray
+    raise ValueError(f"Unknown threshold method {config.threshold!r}")
+
+def preprocess(image: np.ndarray, config: PreprocessConfig, dpi: Optional[float] = None) -> np.ndarray:
+    """Run a page image through the configured steps"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    if config.target_dpi:
+        gray = downscale(gray, config.target_dpi, dpi)
+    if config.deskew:
+        gray = deskew(gray)
+
+    binary = binarize(gray, config)
+    if config.median_blur:
+        binary = cv2.medianBlur(binary, config.median_blur | 1)
+    if config.morphology != "none":
+        # The option names refer to the ink; text is black on white, so
+        # opening the ink (dropping specks) is a closing of the image
+        operation = {"open": cv2.MORPH_CLOSE, "close": cv2.MORPH_OPEN}[config.morphology]
+        kernel = np.ones((config.morphology_kernel, config.morphology_kernel), np.uint8)
+        binary = cv2.morphologyEx(binary, operation, kernel)
+    if config.denoise:
+        binary = cv2.fastNlMeansDenoising(binary)
+    return binary
+
+class Preprocessor:
+    """Picklable preprocessing callable for OCR pool processes"""
+
+    def __init__(self, config: Optional[PreprocessConfig] = None):
+        self.config = config or load_config()
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        return preprocess(image, self.config)
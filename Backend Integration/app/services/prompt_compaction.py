@@ -0,0 +1,141 @@
+"""Compaction of OCR text before it is sent to the LLM.
+
+The fields we extract sit in a few places: the header of the first page
+(vendor, client, invoice number, dates) and the lines around totals, tax
+and due dates. Long multi-page invoices otherwise cost many tokens and
+seconds of latency for text the model ignores.
+
+``compact_text`` normalizes whitespace, drops OCR noise lines and, when the
+text is still over the token budget, keeps the most relevant lines in this
+order of priority: lines with field keywords, lines holding the values the
+regex extractor would pick, the first-page header, and the lines next to
+keyword lines. Other lines, such as line items, are dropped. Kept lines
+stay in document order, with ``...`` marking cuts; the markers are not
+counted against the budget.
+
+Token counts use tiktoken when it is installed and a characters-per-token
+estimate otherwise.
+"""
+import os
+import re
+from typing import Iterable, List, NamedTuple, Optional
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+LLM_PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", "800"))
+LLM_HEADER_LINES = int(os.getenv("LLM_HEADER_LINES", "25"))
+LLM_TOKENIZER = os.getenv("LLM_TOKENIZER", "cl100k_base")
+
+CHARS_PER_TOKEN = 4
+OMISSION_MARKER = "..."
+
+KEYWORD_PATTERN = re.compile(
+    r"\b(invoice|inv|bill(ed)?\s+to|ship\s+to|sold\s+to|from|vendor|supplier|client|customer|"
+    r"date|due|terms|total|sub-?total|tax|vat|gst|amount|balance|paid|payable)\b",
+    re.IGNORECASE,
+)
+
+# Lines without at least two letters or digits in a row are OCR noise,
+# e.g. table rulers, stray punctuation or speckles read as characters
+CONTENT_PATTERN = re.compile(r"[A-Za-z0-9]{2}")
+
+# Priorities, lower is kept first
+KEYWORD, CANDIDATE, HEADER, CONTEXT = range(4)
+
+_encoding = None
+
+class CompactedText(NamedTuple):
+    text: str
+    tokens_before: int
+    tokens_after: int
+
+def count_tokens(text: str) -> int:
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding(LLM_TOKENIZER)
+        return len(_encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def normalize_lines(text: str) -> List[str]:
+    """Collapse whitespace and drop empty, noise and repeated lines"""
+    lines = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if not CONTENT_PATTERN.search(line):
+            continue
+        if lines and lines[-1] == line:
+            continue
+        lines.append(line)
+    return lines
+
+def _first_page(text: str) -> str:
+    # Tesseract ends every page with a form feed
+    return text.split("\f", 1)[0]
+
+def _priorities(lines: List[str], header_lines: int, candidates: Iterable[str]) -> List[Optional[int]]:
+    priorities: List[Optional[int]] = [None] * len(lines)
+
+    def mark(index: int, priority: int) -> None:
+        if 0 <= index < len(lines) and (priorities[index] is None or priority < priorities[index]):
+            priorities[index] = priority
+
+    candidates = [" ".join(candidate.split()) for candidate in candidates if candidate.strip()]
+    for index, line in enumerate(lines):
+        if KEYWORD_PATTERN.search(line):
+            mark(index, KEYWORD)
+            # Values often sit on the line below or above their label
+            mark(index - 1, CONTEXT)
+            mark(index + 1, CONTEXT)
+        if any(candidate in line for candidate in candidates):
+            mark(index, CANDIDATE)
+        if index < header_lines:
+            mark(index, HEADER)
+    return priorities
+
+def compact_text(
+    text: str,
+    budget: int = LLM_PROMPT_TOKEN_BUDGET,
+    candidates: Iterable[str] = (),
+    header_lines: int = LLM_HEADER_LINES,
+) -> CompactedText:
+    """Reduce OCR text to the lines most likely to hold invoice fields"""
+    tokens_before = count_tokens(text)
+    lines = normalize_lines(text)
+    normalized = "\n".join(lines)
+    if count_tokens(normalized) <= budget:
+        return CompactedText(normalized, tokens_before, count_tokens(normalized))
+
+    # The header only counts on the first page
+    header_lines = min(header_lines, len(normalize_lines(_first_page(text))))
+    priorities = _priorities(lines, header_lines, candidates)
+    ranked = sorted(
+        (index for index, priority in enumerate(priorities) if priority is not None),
+        key=lambda index: (priorities[index], index),
+    )
+
+    kept = set()
+    used = 0
+    for index in ranked:
+        # One token per line for the newline
+        cost = count_tokens(lines[index]) + 1
+        if used + cost > budget:
+            continue
+        kept.add(index)
+        used += cost
+
+    output = []
+    previous = -1
+    for index in sorted(kept):
+        if index != previous + 1:
+            output.append(OMISSION_MARKER)
+        output.append(lines[index])
+        previous = index
+    if previous != len(lines) - 1:
+        output.append(OMISSION_MARKER)
+
+    compacted = "\n".join(output)
+    return CompactedText(compacted, tokens_before, count_tokens(compacted))
@@ -0,0 +1,238 @@
+"""Confidence-scored field extraction with the LLM as the last tier.
+
+Cheap extractors run first and every field they find gets a confidence:
+
+- ``regex``: labelled values ("Total Due: $1,234.00") and the positional
+  guesses of ``InvoiceProcessor.extract_information_with_regex``, both
+  taken from a single ``ml/field_extraction.scan`` of the text
+- ``ner``: vendor and client names from spaCy organization entities, via
+  ``ml/invoice_processor.extract_entities``
+
+Values found by several extractors reinforce each other, and amounts that
+add up (amount + tax = total) are trusted. The LLM is only asked when a
+required field (``ml/invoice_processor.REQUIRED_FIELDS``, checked with the
+same ``find_missing_fields`` as ``validate_results``) is missing or below
+``EXTRACTION_CONFIDENCE_THRESHOLD``, and then only for the fields that are
+missing or uncertain. Each field records the tier that produced it.
+"""
+import logging
+import os
+import re
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from .ml_bridge import ml_field_extraction, ml_invoice_processor, ml_model_registry
+
+EXTRACTION_CONFIDENCE_THRESHOLD = float(os.getenv("EXTRACTION_CONFIDENCE_THRESHOLD", "0.8"))
+# Empty disables the NER tier
+EXTRACTION_NER_MODEL = os.getenv("EXTRACTION_NER_MODEL", "en_core_web_sm")
+
+logger = logging.getLogger(__name__)
+# NER models that failed to load, so each process logs the failure once
+_failed_ner_models = set()
+
+# Flat field names and how the LLM is told to fill them
+FIELD_DESCRIPTIONS = {
+    "invoice_number": "string",
+    "date": "string, YYYY-MM-DD",
+    "due_date": "string, YYYY-MM-DD",
+    "amount": "number, the amount before tax",
+    "tax": "number, the tax amount",
+    "total": "number, the total amount",
+    "vendor_name": "string",
+    "vendor_address": "string",
+    "vendor_email": "string",
+    "client_name": "string",
+    "client_address": "string",
+    "client_email": "string",
+}
+FIELDS = list(FIELD_DESCRIPTIONS)
+AMOUNT_FIELDS = {"amount", "tax", "total"}
+DATE_FIELDS = {"date", "due_date"}
+
+# Names used by ml/invoice_processor for the same fields
+ML_FIELD_NAMES = {"total": "total_amount", "tax": "tax_amount"}
+# Names of the ml/field_extraction labels that differ from ours
+LABELLED_FIELD_NAMES = {"subtotal": "amount"}
+LABELLED_CONFIDENCE = 0.85
+
+LLM_TIER = "llm"
+LLM_CONFIDENCE = 0.85
+
+class FieldValue(NamedTuple):
+    value: Any
+    confidence: float
+    tier: str
+
+Fields = Dict[str, FieldValue]
+
+def parse_date(value: Optional[str]) -> Optional[datetime]:
+    """Parse a date string returned by the extractors, None if unparseable"""
+    return ml_field_extraction.parse_date(value)
+
+def parse_amount(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)):
+        return float(value)
+    return ml_field_extraction.parse_amount(str(value))
+
+def normalize(field: str, value: Any) -> Any:
+    """Canonical form of a value, None when it is not valid for the field"""
+    if value is None or value == "":
+        return None
+    if field in AMOUNT_FIELDS:
+        return parse_amount(value)
+    if field in DATE_FIELDS:
+        parsed = parse_date(str(value))
+        return parsed.strftime("%Y-%m-%d") if parsed else None
+    if field == "invoice_number":
+        value = str(value).strip()
+        # "Invoice Date" must not be read as invoice number "Date"
+        return value if re.search(r"\d", value) else None
+    return str(value).strip() or None
+
+def _same(field: str, a: Any, b: Any) -> bool:
+    if field in AMOUNT_FIELDS:
+        return abs(a - b) < 0.005
+    return a == b
+
+class TieredExtractor:
+    """Runs the cheap extractors and decides whether the LLM is needed"""
+
+    def __init__(self, positional: Callable[[str, Any], Dict[str, Any]],
+                 threshold: float = EXTRACTION_CONFIDENCE_THRESHOLD, ner_model: str = EXTRACTION_NER_MODEL):
+        # positional is InvoiceProcessor.extract_information_with_regex
+        self.positional = positional
+        self.threshold = threshold
+        self.ner_model = ner_model
+        self._nlp = None
+
+    def _get_nlp(self):
+        if self._nlp is None and self.ner_model:
+            if self.ner_model in _failed_ner_models:
+                self.ner_model = ""
+                return None
+            try:
+                # Shared with every other extractor in the process
+                self._nlp = ml_model_registry.get_model("ner", self.ner_model)
+            except (ImportError, OSError):
+                logger.warning("Error loading NER model %s, NER tier disabled", self.ner_model, exc_info=True)
+                _failed_ner_models.add(self.ner_model)
+                self.ner_model = ""
+        return self._nlp
+
+    def preload(self) -> None:
+        """Load the NER model now rather than on the first invoice"""
+        nlp = self._get_nlp()
+        if nlp is not None:
+            ml_model_registry.warmup_ner(nlp)
+
+    def extract(self, text: str) -> Fields:
+        """Fields found by the regex and NER tiers, with their confidence"""
+        fields: Fields = {}
+
+        def add(field: str, value: Any, confidence: float, tier: str) -> None:
+            value = normalize(field, value)
+            if value is None:
+                return
+            current = fields.get(field)
+            if current is None:
+                fields[field] = FieldValue(value, confidence, tier)
+            elif _same(field, current.value, value):
+                # Independent extractors agreeing are more likely right
+                combined = 1 - (1 - current.confidence) * (1 - confidence)
+                fields[field] = current._replace(confidence=combined)
+            elif confidence > current.confidence:
+                fields[field] = FieldValue(value, confidence, tier)
+
+        # One scan finds the labelled values and the positional candidates
+        candidates = ml_field_extraction.scan(text)
+        for field, candidate in candidates.fields.items():
+            add(LABELLED_FIELD_NAMES.get(field, field), candidate.text, LABELLED_CONFIDENCE, "regex")
+
+        # Positional guesses, e.g. the last amount on the page is the total
+        guessed = self.positional(text, candidates)
+        for field, confidence in [("date", 0.5), ("due_date", 0.4), ("amount", 0.3), ("tax", 0.3), ("total", 0.5)]:
+            add(field, guessed.get(field), confidence, "regex")
+        add("vendor_email", (guessed.get("vendor_info") or {}).get("email"), 0.6, "regex")
+        add("client_email", (guessed.get("client_info") or {}).get("email"), 0.6, "regex")
+
+        self._check_amounts(fields)
+        self._add_entities(text, add)
+        return fields
+
+    def _check_amounts(self, fields: Fields) -> None:
+        amount, tax, total = (fields.get(field) for field in ("amount", "tax", "total"))
+        if amount and tax and total and abs(amount.value + tax.value - total.value) < 0.015:
+            for field in ("amount", "tax", "total"):
+                fields[field] = fields[field]._replace(confidence=max(fields[field].confidence, 0.95))
+
+    def _add_entities(self, text: str, add) -> None:
+        nlp = self._get_nlp()
+        if nlp is None:
+            return
+        organizations = ml_invoice_processor.extract_entities(nlp, text)["organizations"]
+        # The issuer usually comes first, the billed party second
+        if organizations:
+            add("vendor_name", organizations[0], 0.6, "ner")
+        if len(organizations) > 1:
+            add("client_name", organizations[1], 0.5, "ner")
+
+    def fields_for_llm(self, fields: Fields) -> List[str]:
+        """Fields to ask the LLM for, empty when the required ones are confident"""
+        confident = {field: value.value for field, value in fields.items() if value.confidence >= self.threshold}
+        results = {ML_FIELD_NAMES.get(field, field): value for field, value in confident.items()}
+        if not ml_invoice_processor.find_missing_fields(results):
+            return []
+        return [field for field in FIELDS if field not in confident]
+
+def merge_llm_fields(fields: Fields, llm_data: Dict[str, Any], requested: Iterable[str]) -> Fields:
+    """Fill the requested fields from an LLM reply, keeping cheap values it left empty"""
+    merged = dict(fields)
+    for field in requested:
+        value = normalize(field, llm_data.get(field))
+        if value is not None:
+            merged[field] = FieldValue(value, LLM_CONFIDENCE, LLM_TIER)
+    return merged
+
+def to_invoice_data(fields: Fields) -> Dict[str, Any]:
+    """The nested structure apply_extraction expects"""
+    value = lambda field: fields[field].value if field in fields else None
+    return {
+        "invoice_number": value("invoice_number"),
+        "date": value("date"),
+        "due_date": value("due_date"),
+        "amount": value("amount"),
+        "tax": value("tax"),
+        "total": value("total"),
+        "vendor_info": {
+            "name": value("vendor_name"),
+            "address": value("vendor_address"),
+            "email": value("vendor_email"),
+        },
+        "client_info": {
+            "name": value("client_name"),
+            "address": value("client_address"),
+            "email": value("client_email"),
+        },
+    }
+
+def field_sources(fields: Fields) -> Dict[str, Dict[str, Any]]:
+    """Which tier produced each field, and how confident it was"""
+    return {
+        field: {"tier": value.tier, "confidence": round(value.confidence, 3)}
+        for field, value in fields.items()
+    }
+
+def summarize_sources(all_sources: Iterable[Dict[str, Dict[str, Any]]]) -> Dict[str, Any]:
+    """Count per field which tier produced it, and how many invoices needed the LLM"""
+    invoices = 0
+    llm_invoices = 0
+    counts: Dict[str, Dict[str, int]] = {}
+    for sources in all_sources:
+        invoices += 1
+        if any(source["tier"] == LLM_TIER for source in sources.values()):
+            llm_invoices += 1
+        for field, source in sources.items():
+            tiers = counts.setdefault(field, {})
+            tiers[source["tier"]] = tiers.get(source["tier"], 0) + 1
+    return {"invoices": invoices, "llm_invoices": llm_invoices, "fields": counts}
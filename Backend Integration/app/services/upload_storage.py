@@ -0,0 +1,132 @@
+"""Streaming storage of uploaded invoice files.
+
+Uploads are copied to disk in chunks with non-blocking file I/O, hashed and
+size-checked on the way, and stored under a unique name so concurrent
+uploads with the same filename never overwrite each other. ZIP archives
+from batch uploads are unpacked member by member the same way.
+"""
+import hashlib
+import os
+import uuid
+import zipfile
+from typing import List, NamedTuple, Optional
+
+import aiofiles
+from fastapi import UploadFile
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "500"))
+MAX_ARCHIVE_BYTES = int(os.getenv("MAX_ARCHIVE_BYTES", str(1024 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+SUPPORTED_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp"}
+
+class UploadTooLarge(Exception):
+    pass
+
+class StoredUpload(NamedTuple):
+    path: str
+    sha256: str
+    size: int
+
+class ArchiveMember(NamedTuple):
+    filename: str
+    upload: Optional[StoredUpload]
+    error: Optional[str]
+
+def is_supported(filename: str) -> bool:
+    return os.path.splitext(filename or "")[1].lower() in SUPPORTED_EXTENSIONS
+
+def is_archive(filename: str) -> bool:
+    return os.path.splitext(filename or "")[1].lower() == ".zip"
+
+def unique_upload_path(filename: str) -> str:
+    # Keep the extension, the processor picks the OCR path from it
+    extension = os.path.splitext(filename or "")[1].lower()
+    return os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}{extension}")
+
+async def save_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> StoredUpload:
+    """Stream an upload to a unique path, returning its path, SHA-256 and size"""
+    # The multipart parser already knows the size of spooled uploads
+    if file.size is not None and file.size > max_bytes:
+        raise UploadTooLarge(f"File exceeds the {max_bytes} byte upload limit")
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    path = unique_upload_path(file.filename)
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        async with aiofiles.open(path, "wb") as buffer:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"File exceeds the {max_bytes} byte upload limit")
+                digest.update(chunk)
+                await buffer.write(chunk)
+    except BaseException:
+        # Clean up the partial file
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+    return StoredUpload(path=path, sha256=digest.hexdigest(), size=size)
+
+def _extract_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, max_bytes: int) -> StoredUpload:
+    # file_size comes from the archive directory and may lie, so the size is
+    # checked again while copying
+    if info.file_size > max_bytes:
+        raise UploadTooLarge(f"File exceeds the {max_bytes} byte upload limit")
+
+    path = unique_upload_path(info.filename)
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with archive.open(info) as source, open(path, "wb") as buffer:
+            for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"File exceeds the {max_bytes} byte upload limit")
+                digest.update(chunk)
+                buffer.write(chunk)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+    return StoredUpload(path=path, sha256=digest.hexdigest(), size=size)
+
+def extract_archive(archive_path: str, max_files: int = MAX_BATCH_FILES,
+                    max_bytes: int = MAX_UPLOAD_BYTES) -> List[ArchiveMember]:
+    """Unpack the invoices in a ZIP archive to unique upload paths (blocking)"""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    members: List[ArchiveMember] = []
+    extracted = 0
+
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            filename = os.path.basename(info.filename)
+            if not is_supported(filename):
+                members.append(ArchiveMember(filename, None, "Unsupported file type"))
+                continue
+            if extracted >= max_files:
+                members.append(ArchiveMember(filename, None, f"Batch is limited to {max_files} files"))
+                continue
+            try:
+                members.append(ArchiveMember(filename, _extract_member(archive, info, max_bytes), None))
+                extracted += 1
+            except (UploadTooLarge, zipfile.BadZipFile, OSError) as e:
+                members.append(ArchiveMember(filename, None, str(e)))
+
+    return members
+
+def remove_upload(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,399 @@
+"""Background processing of uploaded invoices.
+
+The ``invoices`` table doubles as the job queue: uploads are stored as
+``PENDING`` rows, a worker claims a row by atomically moving it to
+``PROCESSING``, runs OCR and the cheap extraction tiers in a process pool,
+asks the LLM from the event loop for whatever they were unsure of (see
+``app.services.tiered_extraction``) and records the outcome as ``COMPLETED``
+or ``ERROR``.
+
+Invoices already received are flagged, and when that shows before OCR or
+before the LLM the remaining stages are skipped (see ``app.duplicates``).
+
+Stage timings measured in the pool come back with each result and are
+recorded in this process's metrics (see ``app.metrics``).
+
+OCR is bounded by the number of pool processes. LLM calls only wait for the
+shared ``LLMClient``, so while some invoices wait for the LLM the pool
+already reads the next ones.
+
+The worker runs embedded in the API process (see ``EMBEDDED_WORKERS`` in
+``app/main.py``) or standalone with ``python -m app.worker``. Several
+standalone workers can share one database since claiming is atomic.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+
+from sqlalchemy import update
+
+from . import duplicates, metrics, models, rollups
+from .database import SessionLocal, engine
+from .migrations import upgrade_database
+from .services.invoice_processor import InvoiceProcessor, record_analysis
+from .services.llm_client import LLMClient
+from .services.ml_bridge import ml_model_registry, ml_tesseract_pool
+from .services.ocr_engine import ocr_workers_per_process
+from .services.tiered_extraction import parse_date, to_invoice_data
+
+INVOICE_WORKERS = int(os.getenv("INVOICE_WORKERS", str(os.cpu_count() or 1)))
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "2.0"))
+# Port serving /metrics of a standalone worker, 0 disables it
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+# Load the models before starting the pool so its processes inherit them
+# copy-on-write instead of each loading their own (needs the fork start method)
+WORKER_PRELOAD_MODELS = os.getenv("WORKER_PRELOAD_MODELS", "false").lower() == "true"
+
+logger = logging.getLogger(__name__)
+
+# One processor per pool process, created on first use
+_processor: Optional[InvoiceProcessor] = None
+# OCR processes each pool process may start, set by init_pool_process
+_ocr_workers = 1
+
+def init_pool_process(ocr_workers: int) -> None:
+    global _ocr_workers
+    _ocr_workers = ocr_workers
+    # Images are OCR'd in this process, and PDF pages in OCR processes forked from it
+    ml_tesseract_pool.limit_threads()
+
+def analyze_file(file_path: str, file_hash: Optional[str] = None) -> Dict[str, Any]:
+    """Run OCR and the cheap extraction tiers on a single file (executed in a pool process)"""
+    global _processor
+    if _processor is None:
+        _processor = InvoiceProcessor(ocr_workers=_ocr_workers)
+    return _processor.analyze_invoice(file_path, file_hash)
+
+def apply_extraction(invoice: models.Invoice, data: Dict[str, Any]) -> None:
+    """Copy extracted invoice fields onto an Invoice row"""
+    vendor_info = data.get("vendor_info") or {}
+    client_info = data.get("client_info") or {}
+
+    invoice.invoice_number = data.get("invoice_number")
+    invoice.date = parse_date(data.get("date"))
+    invoice.due_date = parse_date(data.get("due_date"))
+    invoice.amount = data.get("amount")
+    invoice.tax = data.get("tax")
+    invoice.total = data.get("total")
+    invoice.vendor_name = vendor_info.get("name")
+    invoice.vendor_address = vendor_info.get("address")
+    invoice.vendor_email = vendor_info.get("email")
+    invoice.client_name = client_info.get("name")
+    invoice.client_address = client_info.get("address")
+    invoice.client_email = client_info.get("email")
+
+def invoice_data(invoice: models.Invoice) -> Dict[str, Any]:
+    """The fields of an Invoice row, in the structure apply_extraction takes"""
+    date = lambda value: value.strftime("%Y-%m-%d") if value else None
+    return {
+        "invoice_number": invoice.invoice_number,
+        "date": date(invoice.date),
+        "due_date": date(invoice.due_date),
+        "amount": invoice.amount,
+        "tax": invoice.tax,
+        "total": invoice.total,
+        "vendor_info": {
+            "name": invoice.vendor_name,
+            "address": invoice.vendor_address,
+            "email": invoice.vendor_email,
+        },
+        "client_info": {
+            "name": invoice.client_name,
+            "address": invoice.client_address,
+            "email": invoice.client_email,
+        },
+    }
+
+def duplicate_result(match: models.Invoice, reason: str) -> Dict[str, Any]:
+    """A pipeline result taking its fields from the invoice this one duplicates"""
+    return {
+        "success": True,
+        "data": invoice_data(match),
+        "field_sources": match.field_sources,
+        "text": match.ocr_text,
+        "pages": match.page_stats,
+        "image_hash": match.image_hash,
+        "error": None,
+        "cached": False,
+        "duplicate_of": match.duplicate_of_id or match.id,
+        "duplicate_reason": reason,
+    }
+
+def find_file_duplicate(invoice_id: int) -> Optional[Dict[str, Any]]:
+    """The result of an earlier upload of the same file, if there is one"""
+    db = SessionLocal()
+    try:
+        match = duplicates.find_file_duplicate(db, db.get(models.Invoice, invoice_id))
+        return duplicate_result(match, duplicates.FILE) if match is not None else None
+    finally:
+        db.close()
+
+def find_extracted_duplicate(invoice_id: int, owner_id: int, data: Dict[str, Any],
+                             image_hash: Optional[str]) -> Optional[Dict[str, Any]]:
+    """The result of an earlier invoice matching partly extracted fields, if there is one"""
+    db = SessionLocal()
+    try:
+        match = duplicates.find_duplicate(db, owner_id, invoice_id, duplicates.identity(data, image_hash))
+        return duplicate_result(*match) if match is not None else None
+    finally:
+        db.close()
+
+def claim_next_invoice() -> Optional[int]:
+    """Move the oldest pending invoice to PROCESSING and return its id"""
+    db = SessionLocal()
+    try:
+        candidates = db.query(models.Invoice.id)\
+            .filter(models.Invoice.status == models.InvoiceStatus.PENDING)\
+            .order_by(models.Invoice.created_at, models.Invoice.id)\
+            .limit(10)\
+            .all()
+
+        for (invoice_id,) in candidates:
+            # Another worker may have claimed the row in the meantime
+            result = db.execute(
+                update(models.Invoice)
+                .where(models.Invoice.id == invoice_id)
+                .where(models.Invoice.status == models.InvoiceStatus.PENDING)
+                .values(status=models.InvoiceStatus.PROCESSING)
+            )
+            if result.rowcount == 1:
+                rollups.record_status_change(
+                    db, invoice_id, models.InvoiceStatus.PENDING, models.InvoiceStatus.PROCESSING
+                )
+                db.commit()
+                return invoice_id
+            db.rollback()
+        return None
+    finally:
+        db.close()
+
+def complete_invoice(invoice_id: int, result: Dict[str, Any]) -> None:
+    """Store the pipeline result and move the invoice to COMPLETED or ERROR"""
+    db = SessionLocal()
+    try:
+        invoice = db.get(models.Invoice, invoice_id)
+        if invoice is None:
+            return
+
+        if result["success"]:
+            apply_extraction(invoice, result["data"])
+            identity = duplicates.identity(result["data"], result.get("image_hash"))
+            duplicates.store_identity(invoice, identity)
+            invoice.duplicate_of_id = result.get("duplicate_of")
+            invoice.duplicate_reason = result.get("duplicate_reason")
+            if invoice.duplicate_of_id is None and duplicates.DUPLICATE_DETECTION:
+                match = duplicates.find_duplicate(db, invoice.owner_id, invoice.id, identity)
+                if match is not None:
+                    duplicates.mark_duplicate(invoice, *match)
+            if invoice.duplicate_reason is not None:
+                metrics.DUPLICATES.inc(reason=invoice.duplicate_reason)
+            invoice.ocr_text = result.get("text")
+            # Cached results were extracted without a new prompt
+            invoice.ocr_tokens = result.get("ocr_tokens")
+            invoice.prompt_tokens = result.get("prompt_tokens")
+            invoice.field_sources = result.get("field_sources")
+            invoice.page_stats = result.get("pages")
+            invoice.status = models.InvoiceStatus.COMPLETED
+            invoice.error_message = None
+        else:
+            invoice.status = models.InvoiceStatus.ERROR
+            invoice.error_message = result["error"]
+        invoice.processed_at = datetime.utcnow()
+        with metrics.STAGE_SECONDS.time(stage="db_commit"):
+            db.commit()
+
+        # Clean up the file
+        if invoice.file_path and os.path.exists(invoice.file_path):
+            os.remove(invoice.file_path)
+    finally:
+        db.close()
+
+def requeue_interrupted() -> int:
+    """Reset invoices left in PROCESSING by a crashed worker back to PENDING"""
+    db = SessionLocal()
+    try:
+        invoice_ids = [
+            invoice_id for (invoice_id,) in db.query(models.Invoice.id)
+            .filter(models.Invoice.status == models.InvoiceStatus.PROCESSING)
+        ]
+        for invoice_id in invoice_ids:
+            db.execute(
+                update(models.Invoice)
+                .where(models.Invoice.id == invoice_id)
+                .values(status=models.InvoiceStatus.PENDING)
+            )
+            rollups.record_status_change(
+                db, invoice_id, models.InvoiceStatus.PROCESSING, models.InvoiceStatus.PENDING
+            )
+        db.commit()
+        return len(invoice_ids)
+    finally:
+        db.close()
+
+class InvoiceWorker:
+    """Dispatches pending invoices to a bounded process pool and the LLM"""
+
+    def __init__(self, concurrency: int = INVOICE_WORKERS, poll_interval: float = WORKER_POLL_INTERVAL,
+                 llm: Optional[LLMClient] = None):
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.llm = llm
+        self._processor: Optional[InvoiceProcessor] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._jobs: Optional[asyncio.Semaphore] = None
+        self._ocr_slots: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._stopping = False
+
+    def notify(self) -> None:
+        """Wake the dispatcher after new invoices have been queued"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def stop(self) -> None:
+        """Stop claiming new invoices; running jobs are allowed to finish"""
+        self._stopping = True
+        self.notify()
+
+    async def run(self) -> None:
+        """Claim and process pending invoices until stopped"""
+        loop = asyncio.get_running_loop()
+        owns_llm = self.llm is None
+        if owns_llm:
+            self.llm = LLMClient()
+        # Extraction and caching run in this process, only OCR goes to the pool
+        self._processor = InvoiceProcessor()
+        mp_context = None
+        if WORKER_PRELOAD_MODELS and "fork" in multiprocessing.get_all_start_methods():
+            await loop.run_in_executor(None, self._processor.tiered.preload)
+            ml_model_registry.freeze()
+            mp_context = multiprocessing.get_context("fork")
+        # Pool processes split the CPUs for their own OCR pools instead of each taking all of them
+        self._pool = ProcessPoolExecutor(max_workers=self.concurrency, mp_context=mp_context,
+                                         initializer=init_pool_process,
+                                         initargs=(ocr_workers_per_process(self.concurrency),))
+        # Enough claimed invoices to keep both the pool and the LLM busy
+        self._jobs = asyncio.Semaphore(self.concurrency + self.llm.max_concurrency)
+        self._ocr_slots = asyncio.Semaphore(self.concurrency)
+        self._wakeup = asyncio.Event()
+
+        try:
+            while not self._stopping:
+                await self._jobs.acquire()
+                self._wakeup.clear()
+                invoice_id = await loop.run_in_executor(None, claim_next_invoice)
+
+                if invoice_id is None:
+                    self._jobs.release()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                task = asyncio.create_task(self._process(invoice_id))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            if owns_llm:
+                await self.llm.aclose()
+                self.llm = None
+
+    async def _process(self, invoice_id: int) -> None:
+        loop = asyncio.get_running_loop()
+        metrics.INVOICES_IN_PROGRESS.inc()
+        try:
+            db = SessionLocal()
+            try:
+                invoice = db.get(models.Invoice, invoice_id)
+                file_path, file_hash, owner_id = invoice.file_path, invoice.file_hash, invoice.owner_id
+            finally:
+                db.close()
+
+            try:
+                result = None
+                if duplicates.DUPLICATE_DETECTION:
+                    # A file received before needs no OCR at all
+                    result = await loop.run_in_executor(None, find_file_duplicate, invoice_id)
+                if result is None:
+                    async with self._ocr_slots:
+                        result = await loop.run_in_executor(self._pool, analyze_file, file_path, file_hash)
+                    record_analysis(result)
+                    if result["success"] and not result["cached"]:
+                        result = await self._extract(invoice_id, owner_id, result)
+            except Exception as e:
+                metrics.ERRORS.inc(source="worker")
+                logger.exception("Analysis of invoice %s failed", invoice_id)
+                result = {"success": False, "data": None, "error": str(e)}
+
+            await loop.run_in_executor(None, complete_invoice, invoice_id, result)
+        except Exception:
+            metrics.ERRORS.inc(source="worker")
+            logger.exception("Error processing invoice %s", invoice_id)
+        finally:
+            metrics.INVOICES_IN_PROGRESS.dec()
+            self._jobs.release()
+
+    async def _extract(self, invoice_id: int, owner_id: int, result: Dict[str, Any]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        if duplicates.DUPLICATE_DETECTION and self._processor.tiered.fields_for_llm(result["fields"]):
+            # Skip the LLM when what the cheap tiers found already identifies an earlier invoice
+            duplicate = await loop.run_in_executor(
+                None, find_extracted_duplicate, invoice_id, owner_id,
+                to_invoice_data(result["fields"]), result["image_hash"]
+            )
+            if duplicate is not None:
+                return {**duplicate, "text": result["text"], "pages": result["pages"],
+                        "image_hash": result["image_hash"]}
+
+        start = time.perf_counter()
+        extraction = await self._processor.complete_extraction(result["text"], result["fields"], self.llm)
+        await loop.run_in_executor(
+            None, self._processor.store_result, result["cache_key"], extraction, result["text"],
+            result["elapsed"] + time.perf_counter() - start, result["image_hash"]
+        )
+        return {
+            **result,
+            "data": extraction.data,
+            "field_sources": extraction.sources,
+            "ocr_tokens": extraction.ocr_tokens,
+            "prompt_tokens": extraction.prompt_tokens,
+        }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Process pending invoices")
+    parser.add_argument("--workers", type=int, default=INVOICE_WORKERS,
+                        help="number of invoices processed in parallel")
+    parser.add_argument("--poll-interval", type=float, default=WORKER_POLL_INTERVAL,
+                        help="seconds to wait between polls when the queue is empty")
+    parser.add_argument("--requeue", action="store_true",
+                        help="reset invoices stuck in PROCESSING before starting")
+    parser.add_argument("--metrics-port", type=int, default=WORKER_METRICS_PORT,
+                        help="port to serve metrics on, 0 to disable")
+    args = parser.parse_args()
+
+    upgrade_database(engine)
+    if args.requeue:
+        print(f"Requeued {requeue_interrupted()} interrupted invoices")
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    worker = InvoiceWorker(concurrency=args.workers, poll_interval=args.poll_interval)
+    try:
+        asyncio.run(worker.run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Latency and throughput of the main API endpoints on a seeded database.
+
+Seeds a throwaway SQLite database with ``--seed-invoices`` invoices of one
+user, spread over two years and several vendors, runs the API in-process and
+sends requests from ``--clients`` concurrent clients to:
+
+- ``GET /invoices/``: the first page of the invoice list
+- ``GET /analytics``: the dashboard aggregates
+- ``POST /invoices/upload``: a synthetic invoice image (processing is not
+  started, ``EMBEDDED_WORKERS=0``)
+
+Run from the backend directory::
+
+    python -m benchmarks.bench_api --seed-invoices 50000 --clients 20 --output api.json
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List
+
+import cv2
+
+from benchmarks import harness, synthetic
+from benchmarks.bench_preprocessing import render
+
+SEED_CHUNK = 1000
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--seed-invoices", type=int, default=10000, help="invoices in the seeded database")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=500, help="requests per read endpoint")
+    parser.add_argument("--uploads", type=int, default=100, help="uploads to send")
+    parser.add_argument("--page-size", type=int, default=50, help="limit of the invoice list requests")
+
+def seed_database(owner_id: int, count: int, seed: int = 0) -> None:
+    """Insert count invoices through the ORM, so the rollups are maintained"""
+    from app import models, rollups  # noqa: F401 (keeps rollups up to date)
+    from app.database import SessionLocal
+
+    rng = random.Random(seed)
+    statuses = [models.InvoiceStatus.COMPLETED] * 8 + [models.InvoiceStatus.PENDING, models.InvoiceStatus.ERROR]
+    start = datetime(2023, 1, 1)
+    db = SessionLocal()
+    try:
+        for offset in range(0, count, SEED_CHUNK):
+            invoices = []
+            for index in range(offset, min(count, offset + SEED_CHUNK)):
+                created_at = start + timedelta(minutes=index * 60)
+                amount = round(rng.uniform(20, 5000), 2)
+                tax = round(amount * 0.085, 2)
+                status = rng.choice(statuses)
+                invoices.append(models.Invoice(
+                    filename=f"invoice_{index}.pdf",
+                    status=status,
+                    invoice_number=f"INV-{index:07d}",
+                    date=created_at - timedelta(days=rng.randint(0, 10)),
+                    due_date=created_at + timedelta(days=30),
+                    amount=amount,
+                    tax=tax,
+                    total=round(amount + tax, 2),
+                    vendor_name=rng.choice(synthetic.VENDORS)[0],
+                    client_name=rng.choice(synthetic.CLIENTS)[0],
+                    created_at=created_at,
+                    processed_at=created_at + timedelta(seconds=rng.uniform(2, 60))
+                    if status != models.InvoiceStatus.PENDING else None,
+                    owner_id=owner_id,
+                ))
+            db.add_all(invoices)
+            db.commit()
+    finally:
+        db.close()
+
+async def load(send: Callable[[], Awaitable[Any]], clients: int, requests: int) -> Dict[str, Any]:
+    """Send requests from concurrent clients, return throughput and latencies"""
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            response = await send()
+            elapsed = time.perf_counter() - start
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code < 400:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    duration = time.perf_counter() - start
+    return {
+        "clients": clients,
+        "requests_per_second": round(requests / duration, 2),
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        **harness.summarize(latencies),
+    }
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+    from app import auth, models
+    from app.database import SessionLocal, async_engine
+    from app.main import app
+
+    with SessionLocal() as db:
+        user = models.User(email="api@example.com", full_name="API", hashed_password=auth.get_password_hash("bench"))
+        db.add(user)
+        db.commit()
+        owner_id = user.id
+
+    start = time.perf_counter()
+    seed_database(owner_id, args.seed_invoices)
+    print(f"Seeded {args.seed_invoices} invoices in {time.perf_counter() - start:.1f}s")
+
+    _, image = cv2.imencode(".png", render(synthetic.generate(random.Random(0)).text, 150))
+    upload = image.tobytes()
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        token = (await client.post("/token", data={"username": "api@example.com", "password": "bench"})).json()
+        client.headers["Authorization"] = f"Bearer {token['access_token']}"
+
+        scenarios = [
+            ("GET /invoices/", args.requests,
+             lambda: client.get("/invoices/", params={"limit": args.page_size})),
+            ("GET /analytics", args.requests, lambda: client.get("/analytics")),
+            ("POST /invoices/upload", args.uploads,
+             lambda: client.post("/invoices/upload", files={"file": ("invoice.png", upload, "image/png")})),
+        ]
+        print(f"\n{'endpoint':<24} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+        for name, requests, send in scenarios:
+            # Warm up connections and code paths
+            await load(send, args.clients, min(args.clients, requests))
+            result = results[name] = await load(send, args.clients, requests)
+            print(f"{name:<24} {result['requests_per_second']:>8.1f} {result.get('p50_ms', 0):>8.1f} "
+                  f"{result.get('p95_ms', 0):>8.1f} {result.get('p99_ms', 0):>8.1f}  {result['statuses']}")
+
+    await async_engine.dispose()
+    return {"seed_invoices": args.seed_invoices, "endpoints": results}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    harness.isolate("bench_api_")
+    results = {"api": asyncio.run(run(args))}
+    if args.output:
+        harness.save_results(args.output, results)
+
+if __name__ == "__main__":
+    main()
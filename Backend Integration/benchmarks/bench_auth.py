@@ -0,0 +1,67 @@
+"""Requests/sec of authenticated endpoints with and without the token cache.
+
+Runs the API in-process against a throwaway SQLite database and hits
+/users/me from many concurrent clients, once with the token cache disabled
+and once enabled. Run from the backend directory::
+
+    python -m benchmarks.bench_auth --clients 50 --requests 5000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=50, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=5000, help="requests per run")
+    parser.add_argument("--path", default="/users/me", help="authenticated endpoint to call")
+    return parser.parse_args()
+
+async def run(client, path: str, headers, clients: int, requests: int) -> float:
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            response = await client.get(path, headers=headers)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return requests / (time.perf_counter() - start)
+
+async def main() -> None:
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="bench_auth_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ["EXTRACTION_CACHE_PATH"] = f"{workdir}/cache.db"
+    os.environ["EMBEDDED_WORKERS"] = "0"
+
+    import httpx
+    from app import auth
+    from app.database import async_engine
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/users/", json={"email": "bench@example.com", "full_name": "Bench", "password": "bench"})
+        token = (await client.post("/token", data={"username": "bench@example.com", "password": "bench"})).json()
+        headers = {"Authorization": f"Bearer {token['access_token']}"}
+
+        results = {}
+        for label, maxsize in [("without cache", 0), ("with cache", auth.TOKEN_CACHE_SIZE)]:
+            auth.token_cache.clear()
+            auth.token_cache.maxsize = maxsize
+            # Warm up connections and code paths
+            await run(client, args.path, headers, args.clients, min(200, args.requests))
+            results[label] = await run(client, args.path, headers, args.clients, args.requests)
+            print(f"{label:>14}: {results[label]:8.1f} req/s")
+
+    await async_engine.dispose()
+    print(f"{'speedup':>14}: {results['with cache'] / results['without cache']:8.2f}x")
+
+if __name__ == "__main__":
+    asyncio.run(main())
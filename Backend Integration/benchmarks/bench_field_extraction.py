@@ -0,0 +1,117 @@
+"""Regex field extraction on large OCR texts: per-pattern loops versus one scan.
+
+Builds multi-page texts from the sample invoices in ``benchmarks/ocr_samples``
+with many line items per page, and times:
+
+- ``loops``: the previous extraction, four ``re.findall`` passes for dates,
+  one for amounts and one for emails (positional guesses), a ``re.search``
+  per ml field pattern and one per labelled field pattern
+- ``loops+parse``: the same, plus parsing every date and amount found with
+  the previous ``strptime`` loop and ``float``, which is what ``scan``
+  returns
+- ``scan``: ``ml/field_extraction.scan``, which finds all of them in one
+  pass over the text, with their line numbers and parsed values
+
+Run from the backend directory::
+
+    python -m benchmarks.bench_field_extraction --pages 20 --repeat 50
+"""
+import argparse
+import os
+import random
+import re
+import time
+from datetime import datetime
+
+from app.services.ml_bridge import ml_field_extraction
+from benchmarks.bench_preprocessing import SAMPLES_DIR
+
+DATE_PATTERNS = [r"\d{2}/\d{2}/\d{4}", r"\d{2}-\d{2}-\d{4}", r"\d{4}/\d{2}/\d{2}", r"\d{4}-\d{2}-\d{2}"]
+AMOUNT_PATTERN = r"\$\s*\d+(?:,\d{3})*(?:\.\d{2})?"
+EMAIL_PATTERN = r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}"
+ML_PATTERNS = [
+    r"(?i)invoice\s*#?\s*([A-Z0-9-]+)",
+    r"(?i)date\s*:\s*(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})",
+    r"(?i)total\s*:?\s*[$€£]?\s*(\d+[.,]\d{2})",
+    r"(?i)tax\s*:?\s*[$€£]?\s*(\d+[.,]\d{2})",
+]
+_DATE = r"(\d{4}[-/]\d{2}[-/]\d{2}|\d{1,2}[-/]\d{1,2}[-/]\d{2,4})"
+_AMOUNT = r"[$€£]?\s*(\d[\d,]*\.\d{2})"
+LABELLED_PATTERNS = [
+    re.compile(r"(?im)\binvoice\s*(?:no\.?|number|#)?\s*[:#]?\s*([A-Z0-9][A-Z0-9/-]*\d[A-Z0-9/-]*)"),
+    re.compile(r"(?im)(?<!due )\b(?:invoice\s+)?date\b[^\n\d]*" + _DATE),
+    re.compile(r"(?im)\b(?:due\s+date|payment\s+due|due)\b[^\n\d]*" + _DATE),
+    re.compile(r"(?im)\bsub-?\s?total\b[^\n]*?" + _AMOUNT + r"[^\S\n]*$"),
+    re.compile(r"(?im)\b(?:tax|vat|gst)\b[^\n]*?" + _AMOUNT + r"[^\S\n]*$"),
+    re.compile(r"(?im)\b(?:grand\s+total|total(?:\s+due)?|amount\s+due|balance\s+due)\b[^\n]*?" + _AMOUNT + r"[^\S\n]*$"),
+]
+DATE_FORMATS = ["%Y-%m-%d", "%Y/%m/%d", "%m/%d/%Y", "%m-%d-%Y", "%d/%m/%Y", "%d-%m-%Y"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=20, help="pages per text")
+    parser.add_argument("--items", type=int, default=40, help="line items per page")
+    parser.add_argument("--repeat", type=int, default=50, help="extractions per method")
+    return parser.parse_args()
+
+def build_text(pages: int, items: int) -> str:
+    rng = random.Random(0)
+    samples = []
+    for name in sorted(os.listdir(SAMPLES_DIR)):
+        with open(os.path.join(SAMPLES_DIR, name)) as f:
+            samples.append(f.read())
+
+    output = []
+    for page in range(pages):
+        lines = samples[page % len(samples)].splitlines()
+        # Line items go between the header and the totals
+        header, footer = lines[:-6], lines[-6:]
+        rows = [
+            f"SKU-{rng.randint(1000, 9999)}  Item {index} shipped {rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/2024"
+            f"  {rng.randint(1, 20):>3}  ${rng.randint(1, 900)}.{rng.randint(0, 99):02d}"
+            for index in range(items)
+        ]
+        output.append("\n".join(header + rows + footer) + "\n\f")
+    return "".join(output)
+
+def loops(text: str):
+    dates = []
+    for pattern in DATE_PATTERNS:
+        dates.extend(re.findall(pattern, text))
+    amounts = re.findall(AMOUNT_PATTERN, text)
+    emails = re.findall(EMAIL_PATTERN, text)
+    ml_fields = [re.search(pattern, text) for pattern in ML_PATTERNS]
+    labelled = [pattern.search(text) for pattern in LABELLED_PATTERNS]
+    return dates, amounts, emails, ml_fields, labelled
+
+def strptime(value: str):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    return None
+
+def loops_and_parse(text: str):
+    dates, amounts, emails, ml_fields, labelled = loops(text)
+    dates = [strptime(date) for date in dates]
+    amounts = [float(amount.replace("$", "").replace(",", "")) for amount in amounts]
+    return dates, amounts, emails, ml_fields, labelled
+
+def main() -> None:
+    args = parse_args()
+    text = build_text(args.pages, args.items)
+    print(f"{args.pages} pages, {len(text) / 1024:.0f} KiB, {text.count(chr(10))} lines\n")
+
+    print(f"{'method':<12} {'ms/text':>8} {'MB/s':>8}")
+    methods = [("loops", loops), ("loops+parse", loops_and_parse), ("scan", ml_field_extraction.scan)]
+    for name, extract in methods:
+        extract(text)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            extract(text)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        print(f"{name:<12} {1000 * elapsed:>8.2f} {len(text) / elapsed / 1e6:>8.1f}")
+
+if __name__ == "__main__":
+    main()
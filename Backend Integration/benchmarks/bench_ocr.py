@@ -0,0 +1,88 @@
+"""Per-page OCR overhead of a process per image versus persistent workers.
+
+Renders the sample invoices of ``benchmarks/ocr_samples``, preprocesses them
+with the default preset and OCRs every page with:
+
+- ``cli``: ``pytesseract``, one ``tesseract`` process and temporary files
+  per page (only when the ``tesseract`` binary is installed)
+- ``reload``: a new tesserocr API per page, which loads the model every
+  time like the CLI does but without the process and files
+- ``persistent``: one tesserocr API kept for all pages
+- ``pool``: ``ml/tesseract_pool.OCRPool`` with ``--workers`` processes
+
+Run from the backend directory::
+
+    python -m benchmarks.bench_ocr --pages 24 --workers 4
+"""
+import argparse
+import os
+import shutil
+import time
+
+from app.services.ml_bridge import ml_tesseract_pool
+from app.services.preprocessing import Preprocessor
+from benchmarks.bench_preprocessing import SAMPLES_DIR, render
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=12, help="pages to OCR per mode")
+    parser.add_argument("--dpi", type=int, default=300, help="resolution the samples are rendered at")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes of the pool mode")
+    return parser.parse_args()
+
+def load_pages(count: int, dpi: int):
+    preprocess = Preprocessor()
+    samples = []
+    for name in sorted(os.listdir(SAMPLES_DIR)):
+        with open(os.path.join(SAMPLES_DIR, name)) as f:
+            samples.append(preprocess(render(f.read(), dpi)))
+    return [samples[index % len(samples)] for index in range(count)]
+
+def run_cli(pages):
+    import pytesseract
+    return [pytesseract.image_to_string(page) for page in pages]
+
+def run_reload(pages):
+    tesserocr = ml_tesseract_pool.load_tesserocr()
+    texts = []
+    for page in pages:
+        with tesserocr.PyTessBaseAPI(lang=ml_tesseract_pool.TESSERACT_LANG) as api:
+            height, width = page.shape
+            api.SetImageBytes(page.tobytes(), width, height, 1, width)
+            texts.append(api.GetUTF8Text())
+    return texts
+
+def run_persistent(pages):
+    return [ml_tesseract_pool.image_to_string(page) for page in pages]
+
+def main() -> None:
+    args = parse_args()
+    pages = load_pages(args.pages, args.dpi)
+    print(f"{len(pages)} pages at {args.dpi} DPI, {args.workers} pool workers\n")
+
+    modes = {}
+    if shutil.which("tesseract"):
+        modes["cli"] = run_cli
+    if ml_tesseract_pool.HAVE_TESSEROCR:
+        modes["reload"] = run_reload
+        modes["persistent"] = run_persistent
+    else:
+        print("tesserocr is not installed, only the cli mode can run\n")
+
+    print(f"{'mode':<12} {'ms/page':>8} {'pages/s':>8}")
+    for name, run in modes.items():
+        start = time.perf_counter()
+        run(pages)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<12} {1000 * elapsed / len(pages):>8.0f} {len(pages) / elapsed:>8.1f}")
+
+    with ml_tesseract_pool.OCRPool(max_workers=args.workers) as pool:
+        # Startup, including loading the model, is not counted
+        pool.map(pages[:args.workers])
+        start = time.perf_counter()
+        pool.map(pages)
+        elapsed = time.perf_counter() - start
+    print(f"{'pool':<12} {1000 * elapsed / len(pages):>8.0f} {len(pages) / elapsed:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Time of every stage of invoice processing, on synthetic invoices.
+
+Generates invoices with ``benchmarks.synthetic`` (clean PNGs, scanned-looking
+JPEGs and text-layer PDFs), then times for every invoice:
+
+- ``render``: generating and writing the file
+- ``preprocess``: reading and preprocessing the image (not for PDFs)
+- ``ocr``: OCR of the image, or reading the PDF (text layer or OCR)
+- ``extraction``: the cheap tiers and, for what they are unsure of, the LLM
+- ``db_insert``: storing the result as an ``Invoice`` row
+- ``process_invoice``: ``InvoiceProcessor.process_invoice`` end to end
+
+The LLM is ``benchmarks.fake_llm`` served locally with ``--llm-latency``, and
+the database a throwaway SQLite file, so the benchmark runs offline. The
+extracted fields are checked against the ground truth of every invoice.
+
+Run from the backend directory::
+
+    python -m benchmarks.bench_pipeline --invoices 12 --output pipeline.json
+"""
+import argparse
+import asyncio
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List
+
+from benchmarks import fake_llm, harness, synthetic
+
+STAGES = ["render", "preprocess", "ocr", "extraction", "db_insert", "process_invoice"]
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--invoices", type=int, default=12, help="synthetic invoices to process")
+    parser.add_argument("--formats", nargs="+", default=synthetic.FORMATS, choices=synthetic.FORMATS)
+    parser.add_argument("--dpi", type=int, default=300, help="resolution of the synthetic images")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds the fake LLM takes per reply")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic invoices")
+
+def print_stages(title: str, stages: Dict[str, Dict[str, Any]]) -> None:
+    print(f"\n{title}")
+    print(f"  {'stage':<16} {'count':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for stage, summary in stages.items():
+        if summary["count"]:
+            print(f"  {stage:<16} {summary['count']:>6} {summary['mean_ms']:>9.1f} "
+                  f"{summary['p50_ms']:>9.1f} {summary['p95_ms']:>9.1f}")
+
+async def run(args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    import cv2
+    from app import models, rollups  # noqa: F401 (keeps rollups up to date)
+    from app.database import SessionLocal, engine
+    from app.migrations import upgrade_database
+    from app.services.invoice_processor import InvoiceProcessor
+    from app.services.llm_client import LLMClient
+    from app.services.ml_bridge import ml_tesseract_pool
+    from app.worker import apply_extraction
+
+    upgrade_database(engine)
+    db = SessionLocal()
+    owner = models.User(email="pipeline@example.com", full_name="Pipeline", hashed_password="-")
+    db.add(owner)
+    db.commit()
+    owner_id = owner.id
+    db.close()
+
+    documents = synthetic.generate_dataset(os.path.join(workdir, "invoices"), args.invoices, args.formats,
+                                           args.dpi, args.seed)
+    processor = InvoiceProcessor()
+    timings: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+    matches: Dict[str, List[bool]] = defaultdict(list)
+    llm_requests = fake_llm.requests_served
+
+    async with LLMClient() as llm:
+        for document in documents:
+            stages = timings[document.format]
+            stages["render"].append(document.render_seconds)
+
+            start = time.perf_counter()
+            if document.format == "pdf":
+                text = processor.ocr_engine.extract_pdf(document.path).text
+            else:
+                processed = processor.preprocess_image(cv2.imread(document.path))
+                preprocessed = time.perf_counter()
+                stages["preprocess"].append(preprocessed - start)
+                start = preprocessed
+                text = ml_tesseract_pool.image_to_string(processed)
+            stages["ocr"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            fields = processor.tiered.extract(text)
+            extraction = await processor.complete_extraction(text, fields, llm)
+            stages["extraction"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            db = SessionLocal()
+            try:
+                invoice = models.Invoice(
+                    filename=os.path.basename(document.path), status=models.InvoiceStatus.COMPLETED,
+                    owner_id=owner_id, ocr_text=text, field_sources=extraction.sources,
+                    processed_at=datetime.utcnow()
+                )
+                apply_extraction(invoice, extraction.data)
+                db.add(invoice)
+                db.commit()
+            finally:
+                db.close()
+            stages["db_insert"].append(time.perf_counter() - start)
+
+            for field, correct in synthetic.field_matches(document.truth, extraction.data).items():
+                matches[field].append(correct)
+        llm_requests = fake_llm.requests_served - llm_requests
+
+    # process_invoice runs its own event loop, so it gets a thread
+    loop = asyncio.get_running_loop()
+    for document in documents:
+        start = time.perf_counter()
+        result = await loop.run_in_executor(None, processor.process_invoice, document.path)
+        if not result["success"]:
+            raise RuntimeError(f"process_invoice failed on {document.path}: {result['error']}")
+        timings[document.format]["process_invoice"].append(time.perf_counter() - start)
+
+    by_format = {
+        file_format: {stage: harness.summarize(stages[stage]) for stage in STAGES}
+        for file_format, stages in timings.items()
+    }
+    overall = {
+        stage: harness.summarize(value for stages in timings.values() for value in stages[stage])
+        for stage in STAGES
+    }
+    accuracy = {field: round(sum(values) / len(values), 3) for field, values in matches.items()}
+
+    print(f"{len(documents)} invoices ({', '.join(args.formats)}), fake LLM latency {args.llm_latency}s")
+    print_stages("all formats", overall)
+    for file_format, stages in by_format.items():
+        print_stages(file_format, stages)
+    print(f"\nLLM requests: {llm_requests} of {len(documents)} invoices")
+    print("field accuracy: " + ", ".join(f"{field} {value:.2f}" for field, value in accuracy.items()))
+
+    return {
+        "invoices": len(documents),
+        "llm_requests": llm_requests,
+        "stages": overall,
+        "by_format": by_format,
+        "accuracy": accuracy,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    workdir = harness.isolate("bench_pipeline_", fake_llm.start_server(args.llm_latency))
+    results = {"pipeline": asyncio.run(run(args, workdir))}
+    if args.output:
+        harness.save_results(args.output, results)
+
+if __name__ == "__main__":
+    main()
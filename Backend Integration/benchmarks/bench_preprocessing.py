@@ -0,0 +1,129 @@
+"""Throughput and OCR accuracy of the image preprocessing presets.
+
+The invoice texts in ``benchmarks/ocr_samples`` are rendered to page images
+with PyMuPDF and degraded the way scans and photos are (skew, speckle noise
+and blur, uneven lighting). Every preset of ``app.services.preprocessing``
+then preprocesses and OCRs every page, and the benchmark reports the time
+spent per page and the character accuracy of the OCR text against the
+original. Pick the fastest preset whose accuracy is as good as the best.
+
+Run from the backend directory::
+
+    python -m benchmarks.bench_preprocessing --dpi 300 --presets fast balanced
+
+OCR uses tesserocr when it is installed and pytesseract otherwise.
+"""
+import argparse
+import difflib
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+from app.services.preprocessing import PRESETS, preprocess
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "ocr_samples")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dpi", type=int, default=300, help="resolution the samples are rendered at")
+    parser.add_argument("--presets", nargs="+", default=list(PRESETS), choices=list(PRESETS))
+    parser.add_argument("--seed", type=int, default=0, help="seed of the degradations")
+    return parser.parse_args()
+
+def render(text: str, dpi: int) -> np.ndarray:
+    """A Letter page with the text in a monospaced font, as a grayscale image"""
+    import pymupdf
+
+    document = pymupdf.open()
+    page = document.new_page(width=612, height=792)
+    page.insert_text((54, 72), text, fontname="cour", fontsize=9)
+    pixmap = page.get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY)
+    return np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width).copy()
+
+def skewed(image: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    height, width = image.shape
+    angle = rng.uniform(1.5, 3.0) * rng.choice([-1, 1])
+    rotation = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(image, rotation, (width, height), borderValue=255)
+
+def noisy(image: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    image = cv2.GaussianBlur(image, (3, 3), 0)
+    speckles = rng.random(image.shape)
+    image = image.copy()
+    image[speckles < 0.01] = 0
+    image[speckles > 0.99] = 255
+    return image
+
+def shadowed(image: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    # Light falling off towards one corner, as in a phone photo
+    height, width = image.shape
+    y, x = np.mgrid[0:height, 0:width]
+    falloff = 1 - 0.55 * (x / width + y / height) / 2
+    return (image * falloff + rng.normal(0, 4, image.shape)).clip(0, 255).astype(np.uint8)
+
+DEGRADATIONS = {
+    "clean": lambda image, rng: image,
+    "skewed": skewed,
+    "noisy": noisy,
+    "shadowed": shadowed,
+}
+
+def ocr_function():
+    try:
+        import tesserocr
+        from PIL import Image
+
+        api = tesserocr.PyTessBaseAPI()
+        def ocr(image: np.ndarray) -> str:
+            api.SetImage(Image.fromarray(image))
+            return api.GetUTF8Text()
+        return ocr
+    except ImportError:
+        import pytesseract
+        return pytesseract.image_to_string
+
+def accuracy(expected: str, actual: str) -> float:
+    """Share of characters matching, ignoring whitespace differences"""
+    expected, actual = " ".join(expected.split()), " ".join(actual.split())
+    return difflib.SequenceMatcher(None, expected, actual, autojunk=False).ratio()
+
+def main() -> None:
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    ocr = ocr_function()
+
+    pages = []
+    for path in sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.txt"))):
+        with open(path) as f:
+            text = f.read()
+        image = render(text, args.dpi)
+        for name, degrade in DEGRADATIONS.items():
+            pages.append((name, text, degrade(image, rng)))
+    print(f"{len(pages)} pages at {args.dpi} DPI\n")
+
+    print(f"{'preset':<10} {'preprocess ms':>14} {'ocr ms':>8} {'total ms':>9} {'accuracy':>9}  "
+          + "  ".join(f"{name:>8}" for name in DEGRADATIONS))
+    for preset in args.presets:
+        config = PRESETS[preset]
+        preprocess_seconds = ocr_seconds = 0.0
+        scores = {name: [] for name in DEGRADATIONS}
+        for name, text, image in pages:
+            start = time.perf_counter()
+            processed = preprocess(image, config, dpi=args.dpi)
+            preprocessed = time.perf_counter()
+            result = ocr(processed)
+            ocr_seconds += time.perf_counter() - preprocessed
+            preprocess_seconds += preprocessed - start
+            scores[name].append(accuracy(text, result))
+
+        per_page = lambda seconds: 1000 * seconds / len(pages)
+        overall = sum(sum(values) for values in scores.values()) / len(pages)
+        print(f"{preset:<10} {per_page(preprocess_seconds):>14.0f} {per_page(ocr_seconds):>8.0f} "
+              f"{per_page(preprocess_seconds + ocr_seconds):>9.0f} {overall:>9.3f}  "
+              + "  ".join(f"{sum(values) / len(values):>8.3f}" for values in scores.values()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""A local stand-in for an OpenAI-compatible chat completions endpoint.
+
+Answers ``POST /chat/completions`` after a configurable delay with the JSON
+object the extraction prompt asks for. Values come from a regex scan of the
+invoice text in the prompt, the vendor and client names from the address
+blocks, so replies are deterministic and need no network or API key.
+
+Point ``LLM_BASE_URL`` at it to run the API or the workers offline::
+
+    python -m benchmarks.fake_llm --port 8001 --latency 0.5
+    LLM_BASE_URL=http://127.0.0.1:8001 uvicorn app.main:app
+
+The benchmarks start it in a background thread with ``start_server``.
+"""
+import argparse
+import asyncio
+import json
+import re
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+from app.services.ml_bridge import ml_field_extraction
+
+# Seconds every reply is delayed by
+latency = 0.0
+requests_served = 0
+
+app = FastAPI(title="Fake LLM")
+
+def requested_fields(prompt: str) -> List[str]:
+    return re.findall(r"^- (\w+): ", prompt, re.MULTILINE)
+
+def invoice_text(prompt: str) -> str:
+    return prompt.split("Invoice text:", 1)[-1].strip()
+
+def answer(prompt: str) -> Dict[str, Any]:
+    """The reply to an extraction prompt, null for whatever is not found"""
+    text = invoice_text(prompt)
+    candidates = ml_field_extraction.scan(text)
+    lines = [line.strip() for line in text.splitlines()]
+
+    values: Dict[str, Any] = {
+        field: candidate.text for field, candidate in candidates.fields.items()
+    }
+    values["amount"] = values.pop("subtotal", None)
+    # Unlabelled totals: the last amount-looking number on the page
+    numbers = re.findall(r"\d[\d,]*\.\d{2}\b", text)
+    values.setdefault("total", numbers[-1] if numbers else None)
+    dates = [candidate.value.strftime("%Y-%m-%d") for candidate in candidates.dates]
+    values.setdefault("date", dates[0] if dates else None)
+    values.setdefault("due_date", dates[1] if len(dates) > 1 else None)
+    number = re.search(r"^(?:invoice\s*(?:number|no\.?|#)|reference):?\s*(\S+)", text, re.IGNORECASE | re.MULTILINE)
+    values.setdefault("invoice_number", number.group(1) if number else None)
+    values["vendor_name"] = next((line for line in lines if line), None)
+    if "Bill To:" in lines:
+        values["client_name"] = lines[lines.index("Bill To:") + 1] or None
+    emails = [candidate.text for candidate in candidates.emails]
+    values["vendor_email"] = emails[0] if emails else None
+    values["client_email"] = emails[1] if len(emails) > 1 else None
+
+    return {field: values.get(field) for field in requested_fields(prompt)}
+
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    global requests_served
+    body = await request.json()
+    prompt = "\n".join(message["content"] for message in body["messages"] if message["role"] == "user")
+    if latency:
+        await asyncio.sleep(latency)
+    requests_served += 1
+    return {
+        "id": f"fake-{requests_served}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": json.dumps(answer(prompt))},
+            "finish_reason": "stop",
+        }],
+    }
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(delay: float = 0.0, port: Optional[int] = None) -> str:
+    """Serve the fake from a daemon thread and return its base URL"""
+    global latency
+    latency = delay
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+def main() -> None:
+    global latency
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every reply is delayed by")
+    args = parser.parse_args()
+
+    latency = args.latency
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
+
+if __name__ == "__main__":
+    main()
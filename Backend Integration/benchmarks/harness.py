@@ -0,0 +1,89 @@
+"""Shared setup and reporting of the end-to-end benchmarks.
+
+``isolate`` points the app at a throwaway database, upload directory and
+extraction cache and must run before anything from ``app`` is imported.
+Results are written as JSON together with the commit and machine they were
+measured on, and ``compare`` lists how much each timing changed between two
+result files.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from benchmarks.login_load import percentile
+
+def isolate(prefix: str, llm_url: Optional[str] = None) -> str:
+    """Configure the app to run on files in a new temporary directory"""
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ["UPLOAD_DIR"] = os.path.join(workdir, "uploads")
+    os.environ["EXTRACTION_CACHE_PATH"] = os.path.join(workdir, "cache.db")
+    # Every run must do the work instead of returning a cached result
+    os.environ["EXTRACTION_CACHE_ENABLED"] = "false"
+    os.environ["EMBEDDED_WORKERS"] = "0"
+    if llm_url is not None:
+        os.environ["LLM_BACKEND"] = "http"
+        os.environ["LLM_BASE_URL"] = llm_url
+        os.environ["LLM_REQUESTS_PER_MINUTE"] = "0"
+    return workdir
+
+def summarize(seconds: Iterable[float]) -> Dict[str, Any]:
+    """Count and latency distribution in milliseconds"""
+    values = [1000 * value for value in seconds]
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": round(statistics.mean(values), 3),
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "max_ms": round(max(values), 3),
+    }
+
+def environment() -> Dict[str, Any]:
+    """Commit and machine the results were measured on"""
+    def git(*args: str) -> Optional[str]:
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+def save_results(path: str, results: Dict[str, Any]) -> None:
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), **results}, f, indent=2)
+    print(f"\nResults written to {path}")
+
+def _timings(results: Any, prefix: str = "") -> Dict[str, float]:
+    """Flatten the mean and p95 latencies of a result file into path -> ms"""
+    timings = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            if key in ("mean_ms", "p95_ms", "requests_per_second") and isinstance(value, (int, float)):
+                timings[f"{prefix}{key}"] = value
+            elif key != "environment":
+                timings.update(_timings(value, f"{prefix}{key}."))
+    return timings
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """One line per timing in both results, with its relative change"""
+    before, after = _timings(baseline), _timings(current)
+    lines = [f"{'metric':<60} {'baseline':>10} {'current':>10} {'change':>8}"]
+    for key in sorted(before.keys() & after.keys()):
+        change = (after[key] - before[key]) / before[key] if before[key] else 0.0
+        lines.append(f"{key:<60} {before[key]:>10.2f} {after[key]:>10.2f} {change:>+8.1%}")
+    return lines
@@ -0,0 +1,68 @@
+"""Login latency under concurrent load.
+
+Sends POST /token from many concurrent clients to a running API and reports
+p50/p99 latency, throughput and how many requests were turned away with 429
+because the password-hashing pool was saturated::
+
+    uvicorn app.main:app --port 8000
+    python -m benchmarks.login_load --url http://localhost:8000 --clients 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+import httpx
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000", help="API base URL")
+    parser.add_argument("--clients", type=int, default=50, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=500, help="total login attempts")
+    parser.add_argument("--email", default="loadtest@example.com")
+    parser.add_argument("--password", default="loadtest-password")
+    return parser.parse_args()
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+async def main() -> None:
+    args = parse_args()
+    latencies: List[float] = []
+    statuses = {}
+    remaining = args.requests
+
+    limits = httpx.Limits(max_connections=args.clients)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        # Registering an existing user fails with 400, which is fine
+        await client.post("/users/", json={"email": args.email, "full_name": "Load Test", "password": args.password})
+        credentials = {"username": args.email, "password": args.password}
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                response = await client.post("/token", data=credentials)
+                elapsed = time.perf_counter() - start
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.status_code == 200:
+                    latencies.append(elapsed)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.clients)))
+        duration = time.perf_counter() - start
+
+    print(f"clients:    {args.clients}")
+    print(f"requests:   {args.requests} in {duration:.2f}s ({args.requests / duration:.1f} req/s)")
+    print(f"statuses:   {dict(sorted(statuses.items()))}")
+    if latencies:
+        print(f"p50:        {percentile(latencies, 50) * 1000:.1f} ms")
+        print(f"p99:        {percentile(latencies, 99) * 1000:.1f} ms")
+        print(f"mean:       {statistics.mean(latencies) * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+"""End-to-end benchmark suite: pipeline stages and API load, saved as JSON.
+
+Runs ``benchmarks.bench_pipeline`` and ``benchmarks.bench_api`` against one
+throwaway database with the fake LLM, and writes both results to one file.
+Keep the file of a known good commit to compare later runs against::
+
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --output current.json --compare baseline.json
+
+Two existing result files are compared with::
+
+    python -m benchmarks.suite --compare baseline.json current.json
+"""
+import argparse
+import asyncio
+import json
+from typing import Any, Dict
+
+from benchmarks import bench_api, bench_pipeline, fake_llm, harness
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    bench_pipeline.add_arguments(parser)
+    bench_api.add_arguments(parser)
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to write the results to")
+    parser.add_argument("--compare", nargs="+", metavar="RESULTS",
+                        help="baseline results to compare this run with, or a baseline and a current file")
+    parser.add_argument("--skip", nargs="+", default=[], choices=["pipeline", "api"], help="benchmarks not to run")
+    return parser.parse_args()
+
+async def run(args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    results = {}
+    if "pipeline" not in args.skip:
+        results["pipeline"] = await bench_pipeline.run(args, workdir)
+    if "api" not in args.skip:
+        print()
+        results["api"] = await bench_api.run(args)
+    return results
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+def main() -> None:
+    args = parse_args()
+    if args.compare and len(args.compare) == 2:
+        baseline, current = (load_results(path) for path in args.compare)
+    else:
+        workdir = harness.isolate("bench_suite_", fake_llm.start_server(args.llm_latency))
+        current = asyncio.run(run(args, workdir))
+        harness.save_results(args.output, current)
+        if not args.compare:
+            return
+        baseline = load_results(args.compare[0])
+
+    print()
+    print("\n".join(harness.compare(baseline, current)))
+
+if __name__ == "__main__":
+    main()
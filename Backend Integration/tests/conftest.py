@@ -0,0 +1,56 @@
+"""Shared fixtures.
+
+Tests run against a throwaway SQLite database, migrated like a real one.
+DATABASE_URL must be set before anything imports ``app.database``.
+"""
+import os
+import tempfile
+
+_DATA_DIR = tempfile.mkdtemp(prefix="invosmart-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_DATA_DIR, 'test.db')}"
+os.environ["EXTRACTION_CACHE_PATH"] = os.path.join(_DATA_DIR, "extraction_cache.db")
+os.environ["UPLOAD_DIR"] = os.path.join(_DATA_DIR, "uploads")
+os.environ["EMBEDDED_WORKERS"] = "0"
+
+import pytest  # noqa: E402
+
+from app import auth, models, rollups  # noqa: E402,F401 (rollups registers its flush listener)
+from app.database import SessionLocal, engine  # noqa: E402
+from app.migrations import upgrade_database  # noqa: E402
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    upgrade_database(engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def db(database):
+    session = SessionLocal()
+    yield session
+    session.close()
+    # Every test starts from empty tables
+    with database.begin() as connection:
+        for table in ("invoice_rollups", "invoices", "users"):
+            connection.exec_driver_sql(f"DELETE FROM {table}")
+
+@pytest.fixture
+def user(db):
+    owner = models.User(email="owner@example.com", full_name="Owner", hashed_password="-")
+    db.add(owner)
+    db.commit()
+    return owner
+
+@pytest.fixture
+def auth_headers(user):
+    token = auth.create_access_token({"sub": user.email, "uid": user.id})
+    return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def client(database):
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+    auth.token_cache.clear()
@@ -0,0 +1,109 @@
+import random
+
+import numpy as np
+import pytest
+
+from app import duplicates, models
+
+def flip_bits(value, bits):
+    number = int(value, 16)
+    for bit in bits:
+        number ^= 1 << bit
+    return f"{number:016x}"
+
+def test_bands_split_the_hash():
+    value = "0123456789abcdef"
+    bands = duplicates.image_hash_bands(value)
+    assert len(bands) == duplicates.IMAGE_HASH_BANDS
+    assert all(0 <= band < 1 << duplicates.BAND_BITS for band in bands)
+    assert sum(band << (index * duplicates.BAND_BITS) for index, band in enumerate(bands)) == int(value, 16)
+
+def test_near_hashes_share_a_band():
+    rng = random.Random(0)
+    for _ in range(1000):
+        value = f"{rng.getrandbits(64):016x}"
+        distance = rng.randint(0, duplicates.IMAGE_HASH_BANDS - 1)
+        other = flip_bits(value, rng.sample(range(64), distance))
+        assert duplicates.hamming_distance(value, other) == distance
+        shared = [a == b for a, b in zip(duplicates.image_hash_bands(value), duplicates.image_hash_bands(other))]
+        assert any(shared)
+
+def page_image(seed):
+    rng = np.random.default_rng(seed)
+    image = np.full((1100, 850), 255, dtype=np.uint8)
+    for _ in range(40):
+        y, x = rng.integers(0, 1000), rng.integers(0, 700)
+        image[y:y + 30, x:x + rng.integers(50, 150)] = 0
+    return image
+
+def test_image_hash_tolerates_scan_noise():
+    image = page_image(1)
+    noisy = np.clip(image.astype(np.int16) + np.random.default_rng(2).integers(-20, 20, image.shape), 0, 255)
+    original = duplicates.image_hash(image)
+    assert duplicates.hamming_distance(original, duplicates.image_hash(noisy.astype(np.uint8))) \
+        <= duplicates.DUPLICATE_IMAGE_DISTANCE
+    assert duplicates.hamming_distance(original, duplicates.image_hash(page_image(3))) \
+        > duplicates.DUPLICATE_IMAGE_DISTANCE
+
+# A hash with bits set in every band
+PAGE_HASH = "f0e1d2c3b4a59687"
+
+def add_invoice(db, owner, page_hash, total=100.0, invoice_number="INV-1",
+                status=models.InvoiceStatus.COMPLETED):
+    invoice = models.Invoice(filename="scan.png", owner_id=owner.id, status=status, total=total,
+                             invoice_number=invoice_number)
+    duplicates.store_identity(invoice, duplicates.Identity(None, invoice_number, total, page_hash))
+    db.add(invoice)
+    db.commit()
+    return invoice
+
+def lookup(db, owner, page_hash, total=100.0, invoice_number="INV-1"):
+    # Stored invoices have no fingerprint, so only the image can match
+    identity = duplicates.identity({"invoice_number": invoice_number, "total": total}, page_hash)
+    # A later invoice than every stored one
+    return duplicates.find_duplicate(db, owner.id, 10 ** 9, identity)
+
+@pytest.mark.parametrize("bits", [[], [0], [0, 17], [5, 20, 40], [60, 61, 62]])
+def test_image_match_within_distance(db, user, bits):
+    original = add_invoice(db, user, PAGE_HASH)
+    assert lookup(db, user, flip_bits(PAGE_HASH, bits)) == (original, duplicates.IMAGE)
+
+def test_no_image_match_beyond_distance(db, user):
+    add_invoice(db, user, PAGE_HASH)
+    # One bit in every band: no band is shared, and the distance is too large anyway
+    assert lookup(db, user, flip_bits(PAGE_HASH, [0, 16, 32, 48])) is None
+
+def test_image_match_needs_agreeing_fields(db, user):
+    add_invoice(db, user, PAGE_HASH)
+    # Same template, different figures
+    assert lookup(db, user, PAGE_HASH, total=250.0) is None
+    assert lookup(db, user, PAGE_HASH, total=None, invoice_number="INV-2") is None
+    assert lookup(db, user, PAGE_HASH, total=None, invoice_number="INV-1") is not None
+
+def test_image_match_is_per_user(db, user):
+    other = models.User(email="other@example.com", full_name="Other", hashed_password="-")
+    db.add(other)
+    db.commit()
+    add_invoice(db, other, PAGE_HASH)
+    assert lookup(db, user, PAGE_HASH) is None
+
+def test_only_completed_invoices_match(db, user):
+    add_invoice(db, user, PAGE_HASH, status=models.InvoiceStatus.PROCESSING)
+    assert lookup(db, user, PAGE_HASH) is None
+
+def test_blank_pages_are_not_looked_up(db, user):
+    add_invoice(db, user, "0" * 16)
+    assert lookup(db, user, "0" * 16) is None
+
+def test_fingerprint_match_comes_first(db, user):
+    data = {"invoice_number": "INV-7", "total": 12.5, "date": "2024-02-01", "vendor_info": {"name": "Acme Ltd"}}
+    invoice = models.Invoice(filename="a.pdf", owner_id=user.id, status=models.InvoiceStatus.COMPLETED)
+    duplicates.store_identity(invoice, duplicates.identity(data))
+    db.add(invoice)
+    db.commit()
+
+    # Same fields written differently
+    copy = {"invoice_number": "inv 7", "total": 12.50, "date": "02/01/2024", "vendor_info": {"name": "ACME"}}
+    assert duplicates.fingerprint(copy) == invoice.fingerprint
+    assert duplicates.find_duplicate(db, user.id, 10 ** 9, duplicates.identity(copy)) \
+        == (invoice, duplicates.FINGERPRINT)
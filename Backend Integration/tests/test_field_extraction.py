@@ -0,0 +1,82 @@
+import os
+import re
+from datetime import datetime
+
+import pytest
+
+from app.services.ml_bridge import ml_field_extraction as field_extraction
+from benchmarks import bench_field_extraction as previous
+from benchmarks.bench_preprocessing import SAMPLES_DIR
+
+SAMPLES = sorted(os.listdir(SAMPLES_DIR))
+# Order of previous.LABELLED_PATTERNS
+LABELLED_FIELDS = ["invoice_number", "date", "due_date", "subtotal", "tax", "total"]
+# Where the previous patterns were wrong: "total" also matched "Sub-total"
+CORRECTED = {("invoice_2.txt", "total"): "6456.00"}
+
+def read_sample(name):
+    with open(os.path.join(SAMPLES_DIR, name)) as f:
+        return f.read()
+
+def previous_fields(text):
+    """The labelled values of the per-field patterns scan replaced"""
+    fields = {}
+    for field, pattern in zip(LABELLED_FIELDS, previous.LABELLED_PATTERNS):
+        match = pattern.search(text)
+        fields[field] = match.group(1) if match else None
+    return fields
+
+def scanned_fields(text):
+    fields = field_extraction.scan(text).fields
+    return {field: fields[field].text if field in fields else None for field in LABELLED_FIELDS}
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_labelled_fields_match_previous_patterns(name):
+    text = read_sample(name)
+    expected = previous_fields(text)
+    for (sample, field), value in CORRECTED.items():
+        if sample == name:
+            expected[field] = value
+    assert scanned_fields(text) == expected
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_candidates_include_previous_matches(name):
+    text = read_sample(name)
+    candidates = field_extraction.scan(text)
+
+    dates = [date for pattern in previous.DATE_PATTERNS for date in re.findall(pattern, text)]
+    assert set(dates) <= {date.text for date in candidates.dates}
+    # Amounts with a dollar sign and emails, in document order
+    amounts = [re.sub(r"\s", "", amount) for amount in re.findall(previous.AMOUNT_PATTERN, text)]
+    assert amounts == [re.sub(r"\s", "", amount.text) for amount in candidates.amounts if amount.text.startswith("$")]
+    assert re.findall(previous.EMAIL_PATTERN, text) == [email.text for email in candidates.emails]
+
+def test_long_text_matches_previous_patterns():
+    text = previous.build_text(pages=5, items=20)
+    expected = previous_fields(text)
+    assert scanned_fields(text) == expected
+    candidates = field_extraction.scan(text)
+    assert len(candidates.amounts) == len(re.findall(previous.AMOUNT_PATTERN, text))
+
+def test_candidates_carry_parsed_values_and_lines():
+    text = "ACME Ltd\nInvoice No: INV-2024-001\nDate: 2024-03-14\nDue: 04/13/2024\nTotal: $1,234.56\nbilling@acme.example\n"
+    candidates = field_extraction.scan(text)
+
+    assert [(date.value, date.line) for date in candidates.dates] == [
+        (datetime(2024, 3, 14), 3), (datetime(2024, 4, 13), 4)
+    ]
+    assert [(amount.value, amount.currency, amount.line) for amount in candidates.amounts] == [(1234.56, "USD", 5)]
+    assert [email.text for email in candidates.emails] == ["billing@acme.example"]
+    assert candidates.fields["invoice_number"].text == "INV-2024-001"
+    assert candidates.fields["due_date"].value == datetime(2024, 4, 13)
+    assert candidates.fields["total"].value == 1234.56
+
+@pytest.mark.parametrize("value, expected", [
+    ("$1,234.56", 1234.56),
+    ("1.234,56", 1234.56),
+    ("1.234", 1234.0),
+    ("12,50", 12.5),
+    ("", None),
+])
+def test_parse_amount(value, expected):
+    assert field_extraction.parse_amount(value) == expected
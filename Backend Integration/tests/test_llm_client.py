@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from app.services import llm_client
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Sleeping advances a fake monotonic clock, so no test waits for real
+    state = {"now": 0.0, "slept": []}
+
+    async def sleep(seconds):
+        state["slept"].append(seconds)
+        state["now"] += seconds
+
+    monkeypatch.setattr(llm_client.time, "monotonic", lambda: state["now"])
+    monkeypatch.setattr(llm_client.asyncio, "sleep", sleep)
+    return state
+
+def acquire(bucket, count, tokens=1.0):
+    async def run():
+        for _ in range(count):
+            await bucket.acquire(tokens)
+    asyncio.run(run())
+
+def test_burst_up_to_capacity(clock):
+    acquire(llm_client.TokenBucket(rate=1.0, capacity=5), 5)
+    assert clock["slept"] == []
+
+def test_waits_at_the_refill_rate(clock):
+    bucket = llm_client.TokenBucket(rate=2.0, capacity=2)
+    acquire(bucket, 6)
+    # Two from the full bucket, then one every half second
+    assert clock["now"] == pytest.approx(2.0)
+    assert all(seconds == pytest.approx(0.5) for seconds in clock["slept"])
+
+def test_refills_while_idle_up_to_capacity(clock):
+    bucket = llm_client.TokenBucket(rate=1.0, capacity=3)
+    acquire(bucket, 3)
+    clock["now"] += 100
+    acquire(bucket, 3)
+    assert clock["slept"] == []
+    acquire(bucket, 1)
+    assert clock["slept"] == [pytest.approx(1.0)]
+
+def test_capacity_is_at_least_one(clock):
+    bucket = llm_client.TokenBucket(rate=1.0, capacity=0)
+    acquire(bucket, 2)
+    assert clock["now"] == pytest.approx(1.0)
+
+def test_zero_rate_never_waits(clock):
+    acquire(llm_client.TokenBucket(rate=0, capacity=1), 100)
+    assert clock["slept"] == []
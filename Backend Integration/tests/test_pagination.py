@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import models
+from app.pagination import InvalidCursor, decode_cursor, encode_cursor
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 17, 8, 30, 15, 123456)
+    cursor = encode_cursor(created_at, 42)
+    # URL-safe and without padding, so it can go into a query string as is
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+    assert decode_cursor(cursor) == (created_at, 42)
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor",
+    "",
+    encode_cursor(datetime(2024, 1, 1), 1)[:-3],
+    # Valid base64 of JSON, but not (created_at, id)
+    "WzFd",
+])
+def test_invalid_cursors(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+def add_invoices(db, owner, created_at):
+    invoices = [models.Invoice(filename=f"{index}.pdf", owner_id=owner.id, created_at=moment)
+                for index, moment in enumerate(created_at)]
+    db.add_all(invoices)
+    db.commit()
+    return invoices
+
+def collect_pages(client, headers, limit, **params):
+    ids, cursor, pages = [], None, 0
+    while True:
+        query = {"limit": limit, **params}
+        if cursor:
+            query["cursor"] = cursor
+        response = client.get("/invoices/", params=query, headers=headers)
+        assert response.status_code == 200
+        ids.extend(invoice["id"] for invoice in response.json())
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return ids, pages
+
+def test_pages_break_ties_on_id(client, db, user, auth_headers):
+    start = datetime(2024, 1, 1)
+    # Runs of invoices created in the same instant, e.g. one batch upload
+    moments = [start] * 4 + [start + timedelta(seconds=1)] * 3 + [start + timedelta(seconds=2)]
+    invoices = add_invoices(db, user, moments)
+    expected = [invoice.id for invoice in sorted(invoices, key=lambda invoice: (invoice.created_at, invoice.id),
+                                                 reverse=True)]
+
+    for limit in (1, 2, 3, 8):
+        ids, _ = collect_pages(client, auth_headers, limit)
+        assert ids == expected
+
+def test_last_full_page_is_followed_by_an_empty_one(client, db, user, auth_headers):
+    add_invoices(db, user, [datetime(2024, 1, 1)] * 4)
+    ids, pages = collect_pages(client, auth_headers, 2)
+    assert len(ids) == 4
+    assert pages == 3
+
+def test_cursor_with_filters(client, db, user, auth_headers):
+    invoices = add_invoices(db, user, [datetime(2024, 1, 1)] * 5)
+    for invoice in invoices[::2]:
+        invoice.status = models.InvoiceStatus.COMPLETED
+    db.commit()
+
+    ids, _ = collect_pages(client, auth_headers, 1, status="completed")
+    assert ids == [invoice.id for invoice in reversed(invoices[::2])]
+
+def test_invalid_cursor_is_rejected(client, user, auth_headers):
+    response = client.get("/invoices/", params={"cursor": "garbage"}, headers=auth_headers)
+    assert response.status_code == 400
@@ -0,0 +1,96 @@
+from datetime import datetime
+
+from app import models, rollups
+from app.worker import claim_next_invoice, complete_invoice, requeue_interrupted
+
+def assert_no_drift(db):
+    # Other sessions wrote the rollups, reload them
+    db.expire_all()
+    assert list(rollups.find_drift(db)) == []
+
+def add_invoice(db, owner, **values):
+    invoice = models.Invoice(filename="invoice.pdf", owner_id=owner.id, **values)
+    db.add(invoice)
+    db.commit()
+    return invoice
+
+def extraction(date, total):
+    return {"success": True, "data": {"invoice_number": f"INV-{total}", "date": date, "total": total}}
+
+def test_new_invoices_are_counted(db, user):
+    add_invoice(db, user, date=datetime(2024, 1, 5), total=100.0)
+    add_invoice(db, user, date=datetime(2024, 1, 20), total=50.0, status=models.InvoiceStatus.COMPLETED)
+    add_invoice(db, user)
+
+    stored = rollups.stored_rollups(db, user.id)
+    assert stored[(user.id, "2024-01")]["count"] == 2
+    assert stored[(user.id, "2024-01")]["amount_sum"] == 150.0
+    assert stored[(user.id, "2024-01")]["pending_count"] == 1
+    assert stored[(user.id, "2024-01")]["completed_count"] == 1
+    # Invoices without a date are kept under an empty month
+    assert stored[(user.id, "")]["count"] == 1
+    assert_no_drift(db)
+
+def test_status_changes_through_the_orm(db, user):
+    invoice = add_invoice(db, user, date=datetime(2024, 2, 1), total=10.0)
+    for status in (models.InvoiceStatus.PROCESSING, models.InvoiceStatus.ERROR, models.InvoiceStatus.COMPLETED):
+        invoice.status = status
+        db.commit()
+        assert_no_drift(db)
+
+    stored = rollups.stored_rollups(db, user.id)[(user.id, "2024-02")]
+    assert (stored["pending_count"], stored["processing_count"], stored["completed_count"]) == (0, 0, 1)
+
+def test_worker_status_changes(db, user):
+    first = add_invoice(db, user)
+    second = add_invoice(db, user)
+
+    # Claims are bulk updates, adjusted with record_status_change
+    assert claim_next_invoice() == first.id
+    assert_no_drift(db)
+    assert claim_next_invoice() == second.id
+    assert_no_drift(db)
+
+    complete_invoice(first.id, extraction("2024-03-10", 42.0))
+    assert_no_drift(db)
+    complete_invoice(second.id, {"success": False, "error": "unreadable"})
+    assert_no_drift(db)
+
+    stored = rollups.stored_rollups(db, user.id)
+    # The completed invoice moved from the empty month to its date
+    assert stored[(user.id, "2024-03")]["completed_count"] == 1
+    assert stored[(user.id, "2024-03")]["processing_time_count"] == 1
+    assert stored[(user.id, "")]["error_count"] == 1
+    assert stored[(user.id, "")]["count"] == 1
+
+def test_requeued_invoices(db, user):
+    add_invoice(db, user)
+    claim_next_invoice()
+    assert requeue_interrupted() == 1
+    assert_no_drift(db)
+    assert rollups.stored_rollups(db, user.id)[(user.id, "")]["pending_count"] == 1
+
+def test_updated_and_deleted_invoices(db, user):
+    invoice = add_invoice(db, user, date=datetime(2024, 4, 1), total=20.0)
+    invoice.date = datetime(2024, 5, 1)
+    invoice.total = 30.0
+    db.commit()
+    assert_no_drift(db)
+
+    db.delete(invoice)
+    db.commit()
+    assert_no_drift(db)
+    stored = rollups.stored_rollups(db, user.id)
+    assert all(values["count"] == 0 for values in stored.values())
+
+def test_drift_is_found_and_rebuilt(db, user):
+    add_invoice(db, user, date=datetime(2024, 6, 1), total=5.0)
+    # A bulk update without record_status_change leaves the rollups behind
+    db.query(models.Invoice).update({models.Invoice.status: models.InvoiceStatus.COMPLETED})
+    db.commit()
+
+    drift = list(rollups.find_drift(db))
+    assert {field for _, field, _, _ in drift} == {"pending_count", "completed_count"}
+
+    rollups.rebuild(db, user.id)
+    assert_no_drift(db)
@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+from app import auth, models
+
+USER_DATA = {"id": 1, "email": "a@example.com", "full_name": "A", "created_at": None}
+
+@pytest.fixture
+def cache():
+    return auth.TokenCache(maxsize=3, ttl=60)
+
+def test_cached_tokens_are_returned(cache):
+    cache.set("token", USER_DATA, time.time() + 600)
+    assert cache.get("token") == USER_DATA
+    assert cache.get("other") is None
+
+def test_entries_expire_with_the_ttl_or_the_token(cache, monkeypatch):
+    now = time.time()
+    cache.set("long", USER_DATA, now + 600)
+    cache.set("short", USER_DATA, now + 10)
+
+    monkeypatch.setattr(auth.time, "time", lambda: now + 30)
+    assert cache.get("short") is None
+    assert cache.get("long") == USER_DATA
+    monkeypatch.setattr(auth.time, "time", lambda: now + 61)
+    assert cache.get("long") is None
+
+def test_least_recently_used_entries_are_evicted(cache):
+    for token in ("a", "b", "c"):
+        cache.set(token, USER_DATA, time.time() + 600)
+    cache.get("a")
+    cache.set("d", USER_DATA, time.time() + 600)
+    assert cache.get("b") is None
+    assert all(cache.get(token) is not None for token in ("a", "c", "d"))
+
+def test_disabled_cache_stores_nothing():
+    cache = auth.TokenCache(maxsize=0)
+    cache.set("token", USER_DATA, time.time() + 600)
+    assert cache.get("token") is None
+
+def test_invalidate_user_drops_all_their_tokens(cache):
+    other = {**USER_DATA, "id": 2}
+    cache.set("first", USER_DATA, time.time() + 600)
+    cache.set("second", USER_DATA, time.time() + 600)
+    cache.set("other", other, time.time() + 600)
+    cache.invalidate_user(1)
+    assert cache.get("first") is None and cache.get("second") is None
+    assert cache.get("other") == other
+
+def cache_user(user):
+    token = f"token-{user.id}"
+    auth.token_cache.set(token, {column: getattr(user, column) for column in auth.USER_CACHE_COLUMNS},
+                         time.time() + 600)
+    return token
+
+def test_updating_a_user_invalidates_their_tokens(db, user):
+    other = models.User(email="other@example.com", full_name="Other", hashed_password="-")
+    db.add(other)
+    db.commit()
+    token, other_token = cache_user(user), cache_user(other)
+
+    user.full_name = "Renamed"
+    db.commit()
+    assert auth.token_cache.get(token) is None
+    assert auth.token_cache.get(other_token) is not None
+    auth.token_cache.clear()
+
+def test_deleting_a_user_invalidates_their_tokens(db, user):
+    token = cache_user(user)
+    db.delete(user)
+    db.commit()
+    assert auth.token_cache.get(token) is None
+
+def test_requests_fill_the_cache_without_the_password_hash(client, db, user, auth_headers):
+    response = client.get("/users/me", headers=auth_headers)
+    assert response.json()["full_name"] == "Owner"
+    token = auth_headers["Authorization"].split()[1]
+    assert "hashed_password" not in auth.token_cache.get(token)
+
+    user.full_name = "Renamed"
+    db.commit()
+    assert client.get("/users/me", headers=auth_headers).json()["full_name"] == "Renamed"
@@ -10,6 +10,7 @@ interface UseInvoicesOptions {
 
 export function useInvoices(options: UseInvoicesOptions = {}) {
   const [invoices, setInvoices] = useState<Invoice[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<Error | null>(null);
   const { user } = useAuth();
@@ -17,8 +18,9 @@ export function useInvoices(options: UseInvoicesOptions = {}) {
   const fetchInvoices = async () => {
     try {
       setLoading(true);
-      const data = await api.getInvoices({ limit: options.limit });
-      setInvoices(data);
+      const page = await api.getInvoices({ limit: options.limit });
+      setInvoices(page.items);
+      setNextCursor(page.nextCursor);
       setError(null);
     } catch (err) {
       setError(err as Error);
@@ -33,6 +35,23 @@ export function useInvoices(options: UseInvoicesOptions = {}) {
     }
   }, [user, options.autoFetch]);
 
+  const loadMore = async () => {
+    if (!nextCursor) {
+      return;
+    }
+    try {
+      setLoading(true);
+      const page = await api.getInvoices({ limit: options.limit, cursor: nextCursor });
+      setInvoices((prev) => [...prev, ...page.items]);
+      setNextCursor(page.nextCursor);
+      setError(null);
+    } catch (err) {
+      setError(err as Error);
+    } finally {
+      setLoading(false);
+    }
+  };
+
   const uploadInvoice = async (file: File) => {
     try {
       const newInvoice = await api.uploadInvoice(file);
@@ -51,6 +70,8 @@ export function useInvoices(options: UseInvoicesOptions = {}) {
     invoices,
     loading,
     error,
+    hasMore: nextCursor !== null,
+    loadMore,
     uploadInvoice,
     refreshInvoices,
   };
@@ -26,6 +26,12 @@ export interface Invoice {
   ownerId: number;
 }
 
+export interface InvoicePage {
+  items: Invoice[];
+  // Cursor of the next page, null on the last one
+  nextCursor: string | null;
+}
+
 export interface InvoiceAnalytics {
   totalCount: number;
   totalAmount: number;
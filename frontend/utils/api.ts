@@ -1,4 +1,5 @@
 import axios from 'axios';
+import { Invoice, InvoicePage } from '../types';
 
 const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
 
@@ -47,16 +48,45 @@ export const uploadInvoice = async (file: File) => {
   return response.data;
 };
 
-export const getInvoices = async (params?: { skip?: number; limit?: number }) => {
-  const response = await api.get('/invoices', { params });
+export const uploadInvoiceBatch = async (files: File[]) => {
+  const formData = new FormData();
+  files.forEach((file) => formData.append('files', file));
+  const response = await api.post('/invoices/batch', formData, {
+    headers: {
+      'Content-Type': 'multipart/form-data',
+    },
+  });
   return response.data;
 };
 
+export const getInvoices = async (params?: {
+  limit?: number;
+  cursor?: string;
+  status?: string;
+  date_from?: string;
+  date_to?: string;
+  vendor_name?: string;
+  min_total?: number;
+  max_total?: number;
+  fields?: string;
+}): Promise<InvoicePage> => {
+  const response = await api.get<Invoice[]>('/invoices', { params });
+  return {
+    items: response.data,
+    nextCursor: response.headers['x-next-cursor'] ?? null,
+  };
+};
+
 export const getInvoice = async (id: number) => {
   const response = await api.get(`/invoices/${id}`);
   return response.data;
 };
 
+export const getInvoiceStatus = async (id: number) => {
+  const response = await api.get(`/invoices/${id}/status`);
+  return response.data;
+};
+
 export const getAnalytics = async () => {
   const response = await api.get('/analytics');
   return response.data;
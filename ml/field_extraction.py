@@ -0,0 +1,185 @@
+"""Single-pass extraction of invoice field candidates.
+
+All patterns are compiled into one alternation and the text is scanned once.
+Every match is one of:
+
+- a date, an amount with a currency or an email
+- a field label ("Invoice No.", "Due date", "Subtotal", "Tax", "Total Due",
+  ...). A lookahead captures the value that belongs to the label without
+  consuming it, so the same value is still seen as a date or amount
+  candidate.
+
+Each alternative starts with a plain character or character class and ends
+with an empty named group telling which kind it is. The regex engine tests
+that first character before entering an alternative, so at most positions
+of the text every alternative is rejected with one lookup. Word boundaries
+are therefore checked by a lookbehind after the first character, and emails
+are matched from their "@", extending back over the local part afterwards.
+
+``scan`` returns every candidate with its position and line number, the
+values parsed into ``datetime`` and ``float``, and the first labelled value
+of each field. It is shared by ``invoice_processor.extract_fields`` and the
+backend's extraction tiers.
+"""
+import re
+from collections import namedtuple
+from datetime import datetime
+
+DATE_FORMATS = ['%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y', '%m-%d-%Y', '%d/%m/%Y', '%d-%m-%Y',
+                '%m/%d/%y', '%m-%d-%y', '%d/%m/%y', '%d-%m-%y']
+
+CURRENCIES = {'$': 'USD', '€': 'EUR', '£': 'GBP', 'USD': 'USD', 'EUR': 'EUR', 'GBP': 'GBP'}
+
+# Not preceded by a word character, checked once the first character is consumed
+_WORD_START = r'(?<!\w.)'
+# 2024-01-31, 1/31/2024 or 31-01-24, with no digit before the first one
+_DATE = r'\d(?<!\d\d)(?:\d{3}[-/]\d{1,2}[-/]\d{1,2}|\d?[-/]\d{1,2}[-/](?:\d{4}|\d{2}))(?!\d)'
+# 1,234.56 or 1.234,56 or 1234.56; the cents are optional next to a currency
+_NUMBER = r'\d{1,3}(?:,\d{3})+(?:\.\d{2})?|\d{1,3}(?:\.\d{3})+(?:,\d{2})?|\d+(?:[.,]\d{2})?'
+_DECIMAL = r'\d{1,3}(?:,\d{3})+\.\d{2}|\d{1,3}(?:\.\d{3})+,\d{2}|\d+[.,]\d{2}'
+_CURRENCY = r'[$€£]|[UEG]' + _WORD_START + r'(?:(?<=U)SD|(?<=E)UR|(?<=G)BP)\b'
+# A labelled amount is the last amount on the label's line
+_LINE_AMOUNT = r'[^\n]*?(?:' + _CURRENCY + r')?\s*(?P<value>' + _DECIMAL + r')(?!\d)[^\S\n]*$'
+_LINE_DATE = r'[^\n\d]*(?<!\d)(?P<value>' + _DATE + r')'
+
+# (field, first letters of its labels, rest of the labels, pattern of the
+# value following the label, captured as "value"). Lookbehinds on the first
+# letter tell the labels of a field apart.
+LABELS = [
+    ('invoice_number', 'i', r'nvoice\s*(?:no\.?|number|#)?\s*[:#]?\s*',
+     r'(?P<value>[A-Z0-9][A-Z0-9/-]*\d[A-Z0-9/-]*)'),
+    ('due_date', 'dp', r'(?<=d)ue(?:\s+date)?\b|(?<=p)ayment\s+due\b', _LINE_DATE),
+    ('date', 'id', r'(?<!due .)(?:(?<=i)nvoice\s+date|(?<=d)ate)\b', _LINE_DATE),
+    ('subtotal', 's', r'ub-?\s?total\b', _LINE_AMOUNT),
+    ('tax', 'tvg', r'(?:(?<=t)ax|(?<=v)at|(?<=g)st)\b', _LINE_AMOUNT),
+    ('total', 'gtab', r'(?:(?<=g)rand\s+total|(?<=t)otal(?:\s+due)?|(?<=a)mount\s+due|(?<=b)alance\s+due)\b',
+     _LINE_AMOUNT),
+]
+FIELDS = [field for field, _, _, _ in LABELS]
+AMOUNT_FIELDS = {'subtotal', 'tax', 'total'}
+DATE_FIELDS = {'date', 'due_date'}
+
+# The local part of an email, before the "@" the pattern matched
+_EMAIL_LOCAL = re.compile(r'[a-zA-Z0-9._%+-]+\Z')
+_EMAIL_LOCAL_MAX = 64
+
+def _build_pattern():
+    labels = [
+        f'[{first.upper()}{first}]{_WORD_START}'
+        f'(?i:(?:{rest})(?={value.replace("(?P<value>", f"(?P<value_{field}>")}))(?P<label_{field}>)'
+        for field, first, rest, value in LABELS
+    ]
+    alternatives = [
+        r'@(?<=[a-zA-Z0-9._%+-]@)[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}(?P<email>)',
+        # Labels come before dates and amounts that could start at the same place
+        *labels,
+        f'{_DATE}(?P<date>)',
+        f'(?P<currency>{_CURRENCY})\\s*(?P<amount>{_NUMBER})(?!\\d)(?P<money>)',
+    ]
+    return re.compile('|'.join(alternatives), re.MULTILINE)
+
+PATTERN = _build_pattern()
+
+Candidate = namedtuple('Candidate', ['kind', 'text', 'value', 'start', 'line', 'currency'])
+Candidates = namedtuple('Candidates', ['dates', 'amounts', 'emails', 'fields'])
+
+# Numeric dates are parsed without strptime, which is slow on the hundreds of
+# dates of a long invoice, following DATE_FORMATS: year first, otherwise
+# month first and day first; two-digit years as strptime reads them
+_NUMERIC_DATE = re.compile(r'(\d{4}|\d{1,2})([-/])(\d{1,2})\2(\d{4}|\d{1,2})')
+
+def _numeric_date(first, second, third):
+    if len(first) == 4:
+        if len(third) > 2:
+            return None
+        orders = [(first, second, third)]
+    else:
+        if len(third) == 1:
+            return None
+        orders = [(third, first, second), (third, second, first)]
+    for year, month, day in orders:
+        year = int(year)
+        if len(third) == 2 and len(first) != 4:
+            year += 2000 if year < 69 else 1900
+        try:
+            return datetime(year, int(month), int(day))
+        except ValueError:
+            continue
+    return None
+
+def parse_date(value):
+    """Parse a date string into a datetime, None if unparseable."""
+    if not value:
+        return None
+    match = _NUMERIC_DATE.fullmatch(value) if isinstance(value, str) else None
+    if match is not None:
+        first, _, second, third = match.groups()
+        return _numeric_date(first, second, third)
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+_NOT_NUMERIC = re.compile(r'[^\d.,]')
+_DECIMAL_COMMA = re.compile(r'\d*,\d{2}')
+_THOUSANDS_DOTS = re.compile(r'\d{1,3}(?:\.\d{3})+')
+
+def _parse_number(number):
+    if ',' in number and '.' in number:
+        # Whichever separator comes last is the decimal point
+        decimal = ',' if number.rfind(',') > number.rfind('.') else '.'
+    elif ',' in number:
+        # A comma followed by exactly two digits is a decimal comma
+        decimal = ',' if _DECIMAL_COMMA.fullmatch(number) else '.'
+    else:
+        # Dots followed by groups of three digits separate thousands
+        decimal = ',' if _THOUSANDS_DOTS.fullmatch(number) else '.'
+    thousands = '.' if decimal == ',' else ','
+    try:
+        return float(number.replace(thousands, '').replace(decimal, '.'))
+    except ValueError:
+        return None
+
+def parse_amount(value):
+    """Parse an amount such as '$1,234.56' or '1.234,56' into a float, None if unparseable."""
+    return _parse_number(_NOT_NUMERIC.sub('', value or ''))
+
+def _parse(field, text):
+    if field in AMOUNT_FIELDS:
+        return parse_amount(text)
+    if field in DATE_FIELDS:
+        return parse_date(text)
+    return text
+
+def scan(text):
+    """Every date, amount and email candidate and the first labelled value of each field, in one pass."""
+    dates, amounts, emails, fields = [], [], [], {}
+    line, position = 1, 0
+    for match in PATTERN.finditer(text):
+        start = match.start()
+        line += text.count('\n', position, start)
+        position = start
+
+        kind = match.lastgroup
+        if kind == 'email':
+            local = _EMAIL_LOCAL.search(text, max(0, start - _EMAIL_LOCAL_MAX), start)
+            email = text[local.start():match.end()]
+            emails.append(Candidate('email', email, email, local.start(), line, None))
+        elif kind == 'date':
+            # Digit groups that are no valid date, e.g. bank sort codes, are skipped
+            value = parse_date(match.group())
+            if value is not None:
+                dates.append(Candidate('date', match.group(), value, start, line, None))
+        elif kind == 'money':
+            currency = match.group('currency')
+            amounts.append(Candidate('amount', match.group(), _parse_number(match.group('amount')), start, line,
+                                     CURRENCIES[currency.upper()]))
+        else:
+            field = kind[len('label_'):]
+            if field not in fields:
+                value_group = 'value_' + field
+                value = match.group(value_group)
+                fields[field] = Candidate(field, value, _parse(field, value), match.start(value_group), line, None)
+    return Candidates(dates, amounts, emails, fields)
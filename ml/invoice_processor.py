@@ -1,26 +1,86 @@
-import pytesseract
 from PIL import Image
 import numpy as np
-import re
-from transformers import pipeline
-import spacy
+import os
 import cv2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import field_extraction
+import model_registry
+from tesseract_pool import image_to_string
+
+# Fields returned by extract_fields and the field_extraction labels they come from
+FIELD_LABELS = {
+    'invoice_number': 'invoice_number',
+    'date': 'date',
+    'amount': 'total',
+    'tax': 'tax',
+}
+
+# Fields a result needs to be considered valid
+REQUIRED_FIELDS = ['invoice_number', 'date', 'total_amount']
+
+# Labels for classify_invoice_type
+INVOICE_TYPES = ['purchase order', 'sales invoice', 'receipt', 'credit note']
+
+# Texts per spaCy / classifier batch in process_invoices
+NLP_BATCH_SIZE = int(os.getenv('NLP_BATCH_SIZE', '16'))
+# Threads OCRing images in process_invoices; Tesseract releases the GIL
+OCR_THREADS = int(os.getenv('OCR_THREADS', str(os.cpu_count() or 1)))
+
+# spaCy entity labels collected by extract_entities
+ENTITY_LABELS = {
+    'ORG': 'organizations',
+    'DATE': 'dates',
+    'MONEY': 'money',
+    'PERSON': 'persons',
+}
+
+def extract_fields(text):
+    """Extract specific fields with the single-pass field_extraction scanner."""
+    labelled = field_extraction.scan(text).fields
+    fields = {}
+    
+    for field, label in FIELD_LABELS.items():
+        candidate = labelled.get(label)
+        fields[field] = candidate.text if candidate else None
+    
+    return fields
+
+def collect_entities(doc):
+    """Group the entities of a spaCy doc by ENTITY_LABELS."""
+    entities = {key: [] for key in ENTITY_LABELS.values()}
+    
+    for ent in doc.ents:
+        if ent.label_ in ENTITY_LABELS:
+            entities[ENTITY_LABELS[ent.label_]].append(ent.text)
+    
+    return entities
+
+def extract_entities(nlp, text):
+    """Extract named entities from text with a spaCy pipeline."""
+    return collect_entities(nlp(text))
+
+def extract_entities_batch(nlp, texts, batch_size=NLP_BATCH_SIZE):
+    """Extract named entities from many texts, batched with nlp.pipe."""
+    return [collect_entities(doc) for doc in nlp.pipe(texts, batch_size=batch_size)]
+
+def find_missing_fields(results, required_fields=REQUIRED_FIELDS):
+    """Return the required fields that are empty in results."""
+    return [field for field in required_fields if not results.get(field)]
 
 class InvoiceProcessor:
-    def __init__(self):
-        # Load NER model for entity extraction
-        self.nlp = spacy.load("en_core_web_sm")
-        
-        # Load zero-shot classifier for invoice type classification
-        self.classifier = pipeline("zero-shot-classification")
-        
-        # Common invoice fields regex patterns
-        self.patterns = {
-            'invoice_number': r'(?i)invoice\s*#?\s*([A-Z0-9-]+)',
-            'date': r'(?i)date\s*:\s*(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
-            'amount': r'(?i)total\s*:?\s*[$€£]?\s*(\d+[.,]\d{2})',
-            'tax': r'(?i)tax\s*:?\s*[$€£]?\s*(\d+[.,]\d{2})',
-        }
+    # Models are loaded on first use and shared by all processors in the
+    # process (see model_registry)
+    @property
+    def nlp(self):
+        """spaCy pipeline for entity extraction."""
+        return model_registry.get_model('ner')
+
+    @property
+    def classifier(self):
+        """Zero-shot classifier for invoice type classification."""
+        return model_registry.get_model('zero_shot')
 
     def preprocess_image(self, image_path):
         """Preprocess the image for better OCR results."""
@@ -43,73 +103,41 @@ class InvoiceProcessor:
         # Preprocess image
         processed_image = self.preprocess_image(image_path)
         
-        # Perform OCR
-        text = pytesseract.image_to_string(processed_image)
+        # Perform OCR; the Tesseract model stays loaded between calls
+        text = image_to_string(processed_image)
         
         return text
 
     def extract_entities(self, text):
         """Extract named entities from text."""
-        doc = self.nlp(text)
-        entities = {
-            'organizations': [],
-            'dates': [],
-            'money': [],
-            'persons': []
-        }
-        
-        for ent in doc.ents:
-            if ent.label_ == 'ORG':
-                entities['organizations'].append(ent.text)
-            elif ent.label_ == 'DATE':
-                entities['dates'].append(ent.text)
-            elif ent.label_ == 'MONEY':
-                entities['money'].append(ent.text)
-            elif ent.label_ == 'PERSON':
-                entities['persons'].append(ent.text)
-        
-        return entities
+        return extract_entities(self.nlp, text)
 
     def extract_fields(self, text):
         """Extract specific fields using regex patterns."""
-        fields = {}
-        
-        for field, pattern in self.patterns.items():
-            match = re.search(pattern, text)
-            if match:
-                fields[field] = match.group(1)
-            else:
-                fields[field] = None
-        
-        return fields
+        return extract_fields(text)
 
     def classify_invoice_type(self, text):
         """Classify invoice type using zero-shot classification."""
-        candidate_labels = ['purchase order', 'sales invoice', 'receipt', 'credit note']
-        
-        result = self.classifier(text, candidate_labels)
+        result = self.classifier(text, INVOICE_TYPES)
         
         return {
             'type': result['labels'][0],
             'confidence': result['scores'][0]
         }
 
-    def process_invoice(self, image_path):
-        """Process invoice image and extract all relevant information."""
-        # Extract text from image
-        text = self.extract_text(image_path)
-        
+    def classify_invoice_types(self, texts, batch_size=NLP_BATCH_SIZE):
+        """Classify many invoice texts, batch_size texts per forward pass."""
+        return [
+            {'type': result['labels'][0], 'confidence': result['scores'][0]}
+            for result in self.classifier.classify(texts, INVOICE_TYPES, batch_size=batch_size)
+        ]
+
+    def build_result(self, text, entities, invoice_type):
+        """Combine the fields, entities and type of an invoice into its result."""
         # Extract fields using regex
         fields = self.extract_fields(text)
         
-        # Extract named entities
-        entities = self.extract_entities(text)
-        
-        # Classify invoice type
-        invoice_type = self.classify_invoice_type(text)
-        
-        # Combine all extracted information
-        result = {
+        return {
             'invoice_number': fields.get('invoice_number'),
             'date': fields.get('date'),
             'total_amount': fields.get('amount'),
@@ -119,17 +147,53 @@ class InvoiceProcessor:
             'confidence': invoice_type['confidence'],
             'entities': entities
         }
+
+    def process_invoice(self, image_path):
+        """Process invoice image and extract all relevant information."""
+        # Extract text from image
+        text = self.extract_text(image_path)
+        
+        # Extract named entities
+        entities = self.extract_entities(text)
+        
+        # Classify invoice type
+        invoice_type = self.classify_invoice_type(text)
         
-        return result
+        return self.build_result(text, entities, invoice_type)
+
+    def process_texts(self, texts, batch_size=NLP_BATCH_SIZE):
+        """Extract the information of many invoice texts with batched NER and classification."""
+        entities = extract_entities_batch(self.nlp, texts, batch_size)
+        invoice_types = self.classify_invoice_types(texts, batch_size)
+        return [
+            self.build_result(text, text_entities, invoice_type)
+            for text, text_entities, invoice_type in zip(texts, entities, invoice_types)
+        ]
+
+    def process_invoices(self, image_paths, batch_size=NLP_BATCH_SIZE, ocr_threads=OCR_THREADS):
+        """Process invoice images, returning an iterator of their results in input order."""
+        # Checked here rather than in the generator, which only runs on first next()
+        if batch_size <= 0:
+            raise ValueError(f'batch_size must be positive, got {batch_size}')
+        return self._process_invoices(image_paths, batch_size, ocr_threads)
+
+    def _process_invoices(self, image_paths, batch_size, ocr_threads):
+        # Images are OCR'd by the threads while the texts read so far go
+        # through NER and classification, with at most two batches read ahead
+        with ThreadPoolExecutor(max_workers=ocr_threads) as executor:
+            pending = deque()
+            for image_path in image_paths:
+                pending.append(executor.submit(self.extract_text, image_path))
+                if len(pending) >= 2 * batch_size:
+                    texts = [pending.popleft().result() for _ in range(batch_size)]
+                    yield from self.process_texts(texts, batch_size)
+            while pending:
+                texts = [pending.popleft().result() for _ in range(min(batch_size, len(pending)))]
+                yield from self.process_texts(texts, batch_size)
 
     def validate_results(self, results):
         """Validate extracted results."""
-        required_fields = ['invoice_number', 'date', 'total_amount']
-        missing_fields = []
-        
-        for field in required_fields:
-            if not results.get(field):
-                missing_fields.append(field)
+        missing_fields = find_missing_fields(results)
         
         return {
             'is_valid': len(missing_fields) == 0,
@@ -0,0 +1,157 @@
+"""Process-wide registry of the ml models.
+
+Models are loaded on first use and shared by every ``InvoiceProcessor`` (and
+every backend extractor) in the process, so creating processors is cheap and
+a model is only ever loaded once per process.
+
+Servers can ``preload`` the models they need at startup, which also runs a
+small warmup inference so the first request does not pay for lazy
+initialization. Before forking workers, ``prepare_fork`` preloads the models
+in the parent and freezes the garbage collector, so the workers inherit the
+loaded weights copy-on-write instead of loading their own copies.
+
+Load times and memory use are reported by ``stats``. Running the module
+compares cold starts and per-worker memory of both modes::
+
+    python model_registry.py --models ner --workers 4
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import threading
+import time
+
+SPACY_MODEL = os.getenv('SPACY_MODEL', 'en_core_web_sm')
+ZERO_SHOT_MODEL = os.getenv('ZERO_SHOT_MODEL', 'facebook/bart-large-mnli')
+# Pipeline components entity extraction does not need
+SPACY_DISABLE = [name for name in os.getenv('SPACY_DISABLE', 'parser,lemmatizer,tagger,attribute_ruler').split(',') if name]
+
+def load_ner(name):
+    import spacy
+    return spacy.load(name, disable=SPACY_DISABLE)
+
+def warmup_ner(nlp):
+    nlp('Invoice INV-1001 from Acme Corporation to Globex Inc, due 2024-01-31.')
+
+def load_zero_shot(name):
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+    from zero_shot import ZeroShotClassifier
+
+    model = AutoModelForSequenceClassification.from_pretrained(name).eval()
+    return ZeroShotClassifier(model, AutoTokenizer.from_pretrained(name))
+
+def warmup_zero_shot(classifier):
+    classifier('Invoice for consulting services', ['sales invoice', 'receipt'])
+
+# Kind -> (loader, warmup, default model name)
+MODELS = {
+    'ner': (load_ner, warmup_ner, SPACY_MODEL),
+    'zero_shot': (load_zero_shot, warmup_zero_shot, ZERO_SHOT_MODEL),
+}
+
+_models = {}
+_load_seconds = {}
+_lock = threading.Lock()
+
+def _key(kind, name):
+    if kind not in MODELS:
+        raise ValueError(f"Unknown model kind {kind!r}, expected one of {', '.join(MODELS)}")
+    return kind, name or MODELS[kind][2]
+
+def get_model(kind, name=None):
+    """Return the model of a kind, loading it on first use."""
+    key = _key(kind, name)
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            # Another thread may have loaded it while we waited
+            model = _models.get(key)
+            if model is None:
+                start = time.perf_counter()
+                model = MODELS[kind][0](key[1])
+                _load_seconds[key] = time.perf_counter() - start
+                _models[key] = model
+    return model
+
+def is_loaded(kind, name=None):
+    return _key(kind, name) in _models
+
+def preload(kinds=None, warmup=True):
+    """Load models (all kinds by default) and run a warmup inference on each."""
+    for kind in MODELS if kinds is None else kinds:
+        model = get_model(kind)
+        if warmup:
+            MODELS[kind][1](model)
+
+def freeze():
+    """Move every object that exists now out of the garbage collector's reach."""
+    # Collections in forked workers then do not write to, and thereby
+    # copy, the pages they share with the parent
+    gc.collect()
+    gc.freeze()
+
+def prepare_fork(kinds=None):
+    """Preload models so forked workers share them copy-on-write."""
+    preload(kinds)
+    freeze()
+
+def memory_usage():
+    """Memory of this process in MB: rss, and pss and private where the OS reports them."""
+    usage = {}
+    try:
+        # Linux only; pss splits shared pages between the processes sharing them
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        kb = lambda field: int(fields.get(field, '0 kB').split()[0])
+        usage['rss'] = kb('Rss') / 1024
+        usage['pss'] = kb('Pss') / 1024
+        usage['private'] = (kb('Private_Clean') + kb('Private_Dirty')) / 1024
+    except OSError:
+        import resource
+        # Peak rather than current RSS; kilobytes on Linux, bytes on macOS
+        usage['rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return usage
+
+def stats():
+    """Loaded models with their load time in seconds, and the memory of this process."""
+    return {
+        'models': {f'{kind}:{name}': round(seconds, 3) for (kind, name), seconds in _load_seconds.items()},
+        'memory': memory_usage(),
+    }
+
+def _worker(kinds, queue):
+    start = time.perf_counter()
+    preload(kinds)
+    queue.put((time.perf_counter() - start, memory_usage()))
+
+def _measure(kinds, workers):
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    processes = [context.Process(target=_worker, args=(kinds, queue)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    results = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start and per-worker memory of the ml models')
+    parser.add_argument('--models', nargs='+', default=list(MODELS), choices=list(MODELS))
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"parent before loading: {memory_usage()['rss']:.0f} MB rss")
+    for label, fork in [('lazy, loaded in every worker', False), ('preloaded, inherited by fork', True)]:
+        if fork:
+            start = time.perf_counter()
+            prepare_fork(args.models)
+            print(f"\nparent preload: {time.perf_counter() - start:.2f}s, {memory_usage()['rss']:.0f} MB rss")
+        print(f'\n{label}:')
+        for seconds, memory in _measure(args.models, args.workers):
+            details = ', '.join(f'{value:.0f} MB {field}' for field, value in memory.items())
+            print(f'  worker ready in {seconds:.2f}s, {details}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Long-lived Tesseract OCR workers.
+
+``pytesseract.image_to_string`` starts a ``tesseract`` process for every
+image, writes the image to a temporary file and loads the language model
+again each time. With tesserocr installed, every process (or thread) instead
+keeps one Tesseract API with the model loaded and hands it images straight
+from memory. Without tesserocr, pytesseract is used as before.
+
+``OCRPool`` runs such workers in a process pool whose processes load the
+model once when they start.
+
+Tesseract's OpenMP runtime reads ``OMP_THREAD_LIMIT`` once, when tesserocr
+is loaded, so tesserocr is only imported on first use and ``limit_threads``
+(called by ``init_worker``) sets the limit before that. Processes forked
+after tesserocr was loaded keep the limit of their parent.
+"""
+import importlib.util
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+HAVE_TESSEROCR = importlib.util.find_spec('tesserocr') is not None
+
+TESSERACT_LANG = os.getenv('TESSERACT_LANG', 'eng')
+
+_local = threading.local()
+
+def load_tesserocr():
+    """Import tesserocr, None when it is not installed."""
+    if not HAVE_TESSEROCR:
+        return None
+    import tesserocr
+    return tesserocr
+
+def get_api(lang=TESSERACT_LANG):
+    """Return this thread's Tesseract API, loading the model on first use."""
+    api = getattr(_local, 'api', None)
+    if api is None:
+        # Tesseract APIs must not be shared between threads
+        api = _local.api = load_tesserocr().PyTessBaseAPI(lang=lang)
+    return api
+
+def image_to_string(image, lang=TESSERACT_LANG):
+    """OCR a grayscale or RGB image given as a numpy array."""
+    if not HAVE_TESSEROCR:
+        import pytesseract
+        return pytesseract.image_to_string(image, lang=lang)
+
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    height, width = image.shape[:2]
+    channels = image.shape[2] if image.ndim == 3 else 1
+    api = get_api(lang)
+    api.SetImageBytes(image.tobytes(), width, height, channels, width * channels)
+    # The tesseract CLI ends every page with a form feed
+    return api.GetUTF8Text() + '\f'
+
+def limit_threads():
+    """Run Tesseract single-threaded in this process and its children."""
+    # Tesseract parallelises internally with OpenMP, which only adds
+    # contention when one Tesseract process runs per core. Must be set before
+    # tesserocr is loaded; pytesseract's tesseract processes inherit it.
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+def init_worker(lang=TESSERACT_LANG):
+    """Prepare a pool process: one Tesseract thread per process, model loaded."""
+    limit_threads()
+    if HAVE_TESSEROCR:
+        get_api(lang)
+
+class OCRPool:
+    """Process pool of Tesseract workers that keep their model loaded."""
+
+    def __init__(self, max_workers=None, lang=TESSERACT_LANG):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.lang = lang
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers, initializer=init_worker, initargs=(lang,)
+        )
+
+    def submit(self, image):
+        """OCR an image in a worker, returning a future of its text."""
+        return self._executor.submit(image_to_string, image, self.lang)
+
+    def map(self, images):
+        """OCR images in the workers, returning their texts in order."""
+        images = list(images)
+        return list(self._executor.map(image_to_string, images, [self.lang] * len(images)))
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
@@ -0,0 +1,89 @@
+"""Batched zero-shot classification with cached label hypotheses.
+
+The transformers ``zero-shot-classification`` pipeline turns every candidate
+label into a hypothesis ("This example is a receipt.") and tokenizes each
+(text, hypothesis) pair from scratch, so a text is tokenized once per label
+and the same few hypotheses are tokenized again for every text.
+
+``ZeroShotClassifier`` runs the same NLI model, but tokenizes each text once,
+keeps the token ids of the hypotheses of a label set, joins them with the
+tokenizer's special tokens and scores many pairs per forward pass. Scores
+match the pipeline's single-label mode: the entailment logits are softmaxed
+across the candidate labels.
+"""
+import numpy as np
+
+HYPOTHESIS_TEMPLATE = 'This example is {}.'
+
+class ZeroShotClassifier:
+    def __init__(self, model, tokenizer, hypothesis_template=HYPOTHESIS_TEMPLATE):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.hypothesis_template = hypothesis_template
+        self.entailment_id = self._label_id(model.config.label2id, 'entail')
+        self._hypotheses = {}
+
+    @staticmethod
+    def _label_id(label2id, prefix):
+        for label, label_id in label2id.items():
+            if label.lower().startswith(prefix):
+                return label_id
+        # NLI models put entailment last when the labels are unnamed
+        return len(label2id) - 1
+
+    def hypothesis_ids(self, labels):
+        """Token ids of the hypotheses for a label set, tokenized once per set."""
+        labels = tuple(labels)
+        ids = self._hypotheses.get(labels)
+        if ids is None:
+            hypotheses = [self.hypothesis_template.format(label) for label in labels]
+            ids = self._hypotheses[labels] = self.tokenizer(hypotheses, add_special_tokens=False)['input_ids']
+        return ids
+
+    def encode_pairs(self, texts, labels):
+        """Input ids of every (text, hypothesis) pair, text by text and label by label."""
+        hypotheses = self.hypothesis_ids(labels)
+        # Some tokenizers report no real limit, the position embeddings do
+        model_max_length = min(self.tokenizer.model_max_length,
+                               getattr(self.model.config, 'max_position_embeddings', 512))
+        # Room left for the text next to the longest hypothesis
+        max_length = (model_max_length
+                      - max(len(ids) for ids in hypotheses)
+                      - self.tokenizer.num_special_tokens_to_add(pair=True))
+        premises = self.tokenizer(list(texts), add_special_tokens=False, truncation=True,
+                                  max_length=max_length)['input_ids']
+        return [
+            self.tokenizer.build_inputs_with_special_tokens(premise, hypothesis)
+            for premise in premises
+            for hypothesis in hypotheses
+        ]
+
+    def entailment_logits(self, pairs):
+        import torch
+
+        batch = self.tokenizer.pad({'input_ids': pairs}, return_tensors='pt').to(self.model.device)
+        with torch.inference_mode():
+            logits = self.model(**batch).logits
+        return logits[:, self.entailment_id].float().cpu().numpy()
+
+    def classify(self, texts, labels, batch_size=8):
+        """Classify texts, scoring batch_size texts with all labels per forward pass."""
+        texts, labels = list(texts), list(labels)
+        results = []
+        for start in range(0, len(texts), batch_size):
+            chunk = texts[start:start + batch_size]
+            logits = self.entailment_logits(self.encode_pairs(chunk, labels)).reshape(len(chunk), len(labels))
+            scores = np.exp(logits - logits.max(axis=1, keepdims=True))
+            scores /= scores.sum(axis=1, keepdims=True)
+            for text, text_scores in zip(chunk, scores):
+                order = np.argsort(-text_scores)
+                results.append({
+                    'sequence': text,
+                    'labels': [labels[index] for index in order],
+                    'scores': [float(text_scores[index]) for index in order],
+                })
+        return results
+
+    def __call__(self, text, candidate_labels):
+        """Classify a single text, returning the same dict as the transformers pipeline."""
+        return self.classify([text], candidate_labels)[0]